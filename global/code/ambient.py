@@ -0,0 +1,229 @@
+import os
+import struct
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+import pygame
+from layerCache import layerCache
+
+
+class AmbientTrack:
+    # PCM cache file header: magic, mixer frequency, sample format and channel count
+    header = struct.Struct('<4sIiI')
+
+    def __init__(self, pcmPath, chunkBytes):
+        # Reads a transcoded track a chunk at a time, wrapping back to the start so it loops
+        self.file = open(pcmPath, 'rb')
+        self.chunkBytes = chunkBytes
+        self.dataStart = self.header.size
+        self.file.seek(self.dataStart)
+
+    def nextChunk(self):
+        chunk = self.file.read(self.chunkBytes)
+        while len(chunk) < self.chunkBytes:
+            self.file.seek(self.dataStart)
+            more = self.file.read(self.chunkBytes - len(chunk))
+            if not more:
+                break
+            chunk += more
+        return chunk
+
+    def close(self):
+        self.file.close()
+
+
+class AmbientVoice:
+    def __init__(self, channel, track):
+        # One track streaming into one channel: a chunk playing and the next one queued behind it
+        self.channel = channel
+        self.track = track
+        self.level = 0.0  # Fade level, multiplied by the ambient volume
+        self.fadeFrom = 0.0
+        self.fadeTo = 0.0
+        self.fadeStart = 0
+        self.fadeMs = 0
+        self.chunks = []  # The chunks the channel still holds, newest last
+
+    def fade(self, target, fadeMs, now):
+        self.fadeFrom = self.level
+        self.fadeTo = target
+        self.fadeStart = now
+        self.fadeMs = fadeMs
+
+    def update(self, now, volume):
+        if self.fadeMs > 0 and now - self.fadeStart < self.fadeMs:
+            self.level = self.fadeFrom + (self.fadeTo - self.fadeFrom) * (now - self.fadeStart) / self.fadeMs
+        else:
+            self.level = self.fadeTo
+        self.channel.set_volume(self.level * volume)
+
+        # Keep one chunk playing and one queued so playback never runs dry between frames
+        if not self.channel.get_busy():
+            self.chunks = [self.makeChunk()]
+            self.channel.play(self.chunks[0])
+        if self.channel.get_queue() is None:
+            self.chunks = self.chunks[-1:] + [self.makeChunk()]
+            self.channel.queue(self.chunks[-1])
+
+    def makeChunk(self):
+        return pygame.mixer.Sound(buffer=self.track.nextChunk())
+
+    @property
+    def silent(self):
+        return self.fadeTo == 0 and self.level == 0
+
+    def stop(self):
+        self.channel.stop()
+        self.track.close()
+        self.chunks = []
+
+    def bufferedBytes(self):
+        return len(self.chunks) * self.track.chunkBytes
+
+
+class AmbientPlayer:
+    def __init__(self, channels, cacheDir='../cache/audio', chunkSeconds=0.5, crossfadeMs=2000):
+        # Streams looping ambient tracks from disk and crossfades between them on two channels
+        # Tracks in any format the mixer can load (OGG, MP3, WAV) are decoded once into a PCM file
+        # in the mixer's format, after that only a couple of chunks per track are ever in memory
+        self.channels = list(channels)
+        self.cacheDir = cacheDir
+        self.chunkSeconds = chunkSeconds
+        self.crossfadeMs = crossfadeMs
+        self.volume = 1.0
+
+        self.voices = []  # Playing voices, the current track last
+        self.current = None  # Path of the track that is playing or about to
+        self.pending = None  # Future of the current track's PCM file while it is still being prepared
+
+        # Preparing a track is done off the main thread so it never stalls a frame
+        self.preparer = ThreadPoolExecutor(max_workers=1)
+        self.prepared = {}  # path -> Future of its PCM path
+
+        # Counters for stats()
+        self.transcodes = 0
+        self.failures = set()
+
+    def chunkBytes(self):
+        frequency, format, channels = pygame.mixer.get_init()
+        frameBytes = channels * (abs(format) // 8)
+        return int(frequency * self.chunkSeconds) * frameBytes
+
+    def pcmPath(self, path):
+        frequency, format, channels = pygame.mixer.get_init()
+        name = os.path.splitext(os.path.basename(path))[0].replace(' ', '_')
+        pathHash = hashlib.sha1(os.path.normpath(path).encode()).hexdigest()[:8]
+        return os.path.join(self.cacheDir, f"{name}-{pathHash}-{frequency}-{format}-{channels}-"
+                                           f"{layerCache.fileHash(path)}.pcm")
+
+    def prepare(self, path):
+        # Make sure a track is transcoded and ready to stream, call ahead of play() to hide the work
+        future = self.prepared.get(path)
+        if future is None:
+            future = self.preparer.submit(self.transcode, path)
+            self.prepared[path] = future
+        return future
+
+    def transcode(self, path):
+        pcmPath = self.pcmPath(path)
+        if self.validEntry(pcmPath):
+            return pcmPath
+
+        # The one time the whole track is decoded in memory, it is let go as soon as it is written
+        sound = pygame.mixer.Sound(path)
+        frequency, format, channels = pygame.mixer.get_init()
+        os.makedirs(self.cacheDir, exist_ok=True)
+        self.removeStale(pcmPath)
+        tempPath = f"{pcmPath}.{os.getpid()}.tmp"
+        with open(tempPath, 'wb') as file:
+            file.write(AmbientTrack.header.pack(b'PCM ', frequency, format, channels))
+            file.write(sound.get_raw())
+        os.replace(tempPath, pcmPath)
+        self.transcodes += 1
+        return pcmPath
+
+    def validEntry(self, pcmPath):
+        try:
+            with open(pcmPath, 'rb') as file:
+                header = file.read(AmbientTrack.header.size)
+        except OSError:
+            return False
+        if len(header) != AmbientTrack.header.size:
+            return False
+        magic, *trackFormat = AmbientTrack.header.unpack(header)
+        return magic == b'PCM ' and tuple(trackFormat) == pygame.mixer.get_init()
+
+    def removeStale(self, pcmPath):
+        # Drop files transcoded from an older version of the same track
+        fileName = os.path.basename(pcmPath)
+        prefix = fileName[:fileName.rindex('-') + 1]
+        for oldName in os.listdir(self.cacheDir):
+            if oldName.startswith(prefix) and oldName != fileName:
+                os.remove(os.path.join(self.cacheDir, oldName))
+
+    def play(self, path):
+        # Crossfade from whatever is playing to path, once path is ready
+        if path == self.current:
+            return
+        self.current = path
+        self.pending = self.prepare(path)
+
+    def stop(self, fadeMs=1000):
+        self.current = None
+        self.pending = None
+        now = pygame.time.get_ticks()
+        for voice in self.voices:
+            voice.fade(0.0, fadeMs, now)
+
+    def setVolume(self, volume):
+        self.volume = volume
+
+    def update(self):
+        # Called every frame: start a track that has become ready, advance fades and refill the channels
+        now = pygame.time.get_ticks()
+        if self.pending is not None and self.pending.done():
+            self.startPending(now)
+
+        for voice in self.voices:
+            voice.update(now, self.volume)
+        for voice in [voice for voice in self.voices if voice.silent]:
+            voice.stop()
+            self.voices.remove(voice)
+
+    def startPending(self, now):
+        path = self.current
+        future = self.pending
+        self.pending = None
+        try:
+            pcmPath = future.result()
+        except (OSError, pygame.error) as error:
+            # A missing or unreadable track plays as silence, the old one still fades out
+            if path not in self.failures:
+                print(f"Ambient track '{path}' unavailable: {error}")
+            self.failures.add(path)
+            pcmPath = None
+
+        # The incoming track needs a free channel, so the oldest voice makes room if both are in use
+        for voice in self.voices:
+            voice.fade(0.0, self.crossfadeMs, now)
+        if pcmPath is None:
+            return
+        if len(self.voices) == len(self.channels):
+            self.voices.pop(0).stop()
+        busy = [voice.channel for voice in self.voices]
+        channel = next(channel for channel in self.channels if channel not in busy)
+        voice = AmbientVoice(channel, AmbientTrack(pcmPath, self.chunkBytes()))
+        voice.fade(1.0, self.crossfadeMs, now)
+        self.voices.append(voice)
+
+    def residentBytes(self):
+        # Ambient audio held in memory: just the chunks queued on the channels
+        return sum(voice.bufferedBytes() for voice in self.voices)
+
+    def stats(self):
+        return {
+            'voices': len(self.voices),
+            'current': self.current,
+            'residentBytes': self.residentBytes(),
+            'transcodes': self.transcodes,
+            'failures': sorted(self.failures),
+        }
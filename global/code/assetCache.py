@@ -0,0 +1,122 @@
+import os
+import threading
+from collections import OrderedDict
+import pygame
+from layerCache import layerCache
+
+
+class AssetCache:
+    def __init__(self, byteBudget=512 * 1024 * 1024):
+        # Surfaces keyed by (path, scale, convert mode), least recently used first
+        self.entries = OrderedDict()
+        self.byteBudget = byteBudget
+        self.bytesUsed = 0
+
+        # Maps can be loaded on a worker thread while the main thread keeps running
+        self.lock = threading.RLock()
+
+        # Counters for stats()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def makeKey(self, path, scale=1, convert='alpha'):
+        # scale is either a factor of the image's own size or a final (width, height)
+        if isinstance(scale, (tuple, list)):
+            scale = (int(scale[0]), int(scale[1]))
+        return (os.path.normpath(path), scale, convert)
+
+    def load(self, path, scale=1, convert='alpha'):
+        # Get an image and take a reference to it. Every load needs a matching release()
+        key = self.makeKey(path, scale, convert)
+        with self.lock:
+            entry = self.entries.get(key)
+
+            if entry is not None:
+                self.hits += 1
+                self.entries.move_to_end(key)
+            else:
+                self.misses += 1
+                surface = self.decode(path, key[1], convert)
+                entry = {'surface': surface, 'bytes': surface.get_pitch() * surface.get_height(), 'refs': 0}
+                self.entries[key] = entry
+                self.bytesUsed += entry['bytes']
+                self.evict()
+
+            entry['refs'] += 1
+            return entry['surface']
+
+    def decode(self, path, scale, convert):
+        # Scaled images (the map layers) go through the on-disk layer cache
+        # so a warm load maps the pre-scaled pixels instead of decoding and scaling
+        if convert == 'alpha' and scale != 1:
+            size = scale
+            if not isinstance(scale, tuple):
+                sourceSize = layerCache.sourceSize(path)
+                if sourceSize is None:
+                    return self.decodeFile(path, scale, convert)
+                size = (int(sourceSize[0] * scale), int(sourceSize[1] * scale))
+            return layerCache.loadSurface(path, size, lambda: self.decodeFile(path, size, convert))
+        return self.decodeFile(path, scale, convert)
+
+    def decodeFile(self, path, scale, convert):
+        # The only place that actually decodes image files
+        surface = pygame.image.load(path)
+        if convert == 'alpha':
+            surface = surface.convert_alpha()
+        elif convert == 'opaque':
+            surface = surface.convert()
+
+        if isinstance(scale, tuple):
+            size = scale
+        else:
+            size = (int(surface.get_width() * scale), int(surface.get_height() * scale))
+        if size != surface.get_size():
+            surface = pygame.transform.scale(surface, size)
+        return surface
+
+    def release(self, path, scale=1, convert='alpha'):
+        # Drop a reference. The image stays cached until the byte budget needs the room
+        with self.lock:
+            entry = self.entries.get(self.makeKey(path, scale, convert))
+            if entry is not None and entry['refs'] > 0:
+                entry['refs'] -= 1
+
+    def evict(self):
+        # Remove unreferenced images, oldest first, until we are back under budget
+        with self.lock:
+            if self.bytesUsed <= self.byteBudget:
+                return
+            for key in list(self.entries):
+                entry = self.entries[key]
+                if entry['refs'] == 0:
+                    del self.entries[key]
+                    self.bytesUsed -= entry['bytes']
+                    self.evictions += 1
+                    if self.bytesUsed <= self.byteBudget:
+                        break
+
+    def setBudget(self, byteBudget):
+        self.byteBudget = byteBudget
+        self.evict()
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytesUsed = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hitRate': self.hits / lookups if lookups else 0.0,
+            'evictions': self.evictions,
+            'entries': len(self.entries),
+            'bytes': self.bytesUsed,
+            'budget': self.byteBudget,
+        }
+
+
+# One cache shared by everything that loads images
+assets = AssetCache()
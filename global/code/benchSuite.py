@@ -0,0 +1,377 @@
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import tracemalloc
+
+# Run without opening a real window or sound device
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+
+import numpy as np
+import pygame
+from constants import *
+
+
+# Each hot path of the real game, timed on its own against the real assets.
+# Unlike benchmark.py, which compares old and new ways of doing one job, this tracks
+# how long the game's own code takes so a change that slows any of it shows up.
+# A case is (name, iterations, call, setup): call(iteration) is timed, setup(iteration) runs
+# untimed before it when given
+
+
+def cameraSweep(level, iteration):
+    # Player positions that walk the camera over the whole current map
+    camera = level.visibleSprites
+    mapWidth = camera.originalWidth * camera.scaleFactor
+    mapHeight = camera.originalHeight * camera.scaleFactor
+    return ((iteration * 37) % mapWidth, (iteration * 23) % mapHeight)
+
+
+def customDrawCases(level):
+    surface = level.displaySurface
+    cases = []
+    for mapName in ('crypt', 'town'):
+        def setup(iteration, mapName=mapName):
+            if level.visibleSprites.currentMap != mapName:
+                level.loadMap(mapName)
+            level.player.rect.center = cameraSweep(level, iteration)
+            surface.fill('black')
+
+        cases.append((f'customDraw.{mapName}', 300, lambda iteration: level.visibleSprites.customDraw(level.player),
+                      setup))
+    return cases
+
+
+def playerMoveCases(level):
+    # Player.move is where collision against the wall mask happens, walked at normal speed and much faster
+    from benchmark import walkDirections
+    directions = walkDirections(2000)
+    cases = []
+    for speed in (PLAYERSPEED, PLAYERSPEED * 8):
+        def setup(iteration, speed=speed):
+            if iteration == 0:
+                level.loadMap('crypt')
+            level.player.direction.update(directions[iteration % len(directions)])
+
+        cases.append((f'playerMove.{speed}', 2000, lambda iteration, speed=speed: level.player.move(speed / SIMRATE),
+                      setup))
+    return cases
+
+
+def dialogDrawCases(level):
+    surface = level.displaySurface
+    dialog = level.dialogSystem
+    response = ("There's is only one person I know that might be able to help you. "
+                "Her name is Camilla and she runs the shops in town. ") * 3
+    options = ('Do you have any clue to the location of the codex?', 'Do you know anyone that does know the location?')
+
+    def typing(iteration):
+        if iteration == 0:
+            dialog.setDialog(options, response)
+        # One more character each draw, wrapping round so the whole response keeps being revealed
+        dialog.displayedChars = iteration % (len(response) + 1)
+        dialog.showOptions = False
+
+    def choosing(iteration):
+        if iteration == 0:
+            dialog.setDialog(options, response)
+        dialog.displayedChars = len(response)
+        dialog.showOptions = True
+        dialog.selectedOption = iteration % len(options)
+
+    def draw(iteration):
+        dialog.draw(surface)
+
+    return [('dialogDraw.typing', 1000, draw, typing), ('dialogDraw.options', 1000, draw, choosing)]
+
+
+def npcInteractionCases(level):
+    def setup(iteration):
+        if iteration == 0:
+            level.dialogSystem.closeDialog()
+            level.loadMap('crypt')
+            lucius = next(npc for npc in level.npcs if npc.name == 'Lucius')
+            level.player.setPosition((lucius.rect.centerx, lucius.rect.bottom))
+            level.visibleSprites.offset.update(level.visibleSprites.cameraOffset(level.player.rect.center))
+
+    return [
+        ('checkNpcInteraction', 5000, lambda iteration: level.checkNpcInteraction(), setup),
+        ('interactionPrompts', 5000, lambda iteration: level.drawInteractionPrompts(), setup),
+    ]
+
+
+def loadMapCases(level):
+    from assetCache import assets
+    from layerCache import layerCache
+    camera = level.visibleSprites
+    maps = [level.mapData[mapName] for mapName in ('crypt', 'town')]
+
+    def load(iteration):
+        mapInfo = maps[iteration % 2]
+        camera.loadMapSurfaces(mapInfo['floor'], mapInfo['walls'], mapInfo['props'], mapInfo['overlays'])
+
+    def fromDisk(iteration):
+        # Nothing in memory, the layer cache maps the pre-scaled layers from disk
+        assets.clear()
+        layerCache.enabled = True
+
+    def decode(iteration):
+        # Nothing cached anywhere: decode and scale every PNG
+        assets.clear()
+        layerCache.enabled = False
+
+    def restore(iteration):
+        layerCache.enabled = True
+
+    # Slowest first, so the last case leaves the layer cache switched back on
+    return [
+        ('loadMapSurfaces.decode', 4, load, decode),
+        ('loadMapSurfaces.disk', 10, load, fromDisk),
+        ('loadMapSurfaces.memory', 20, load, restore),
+    ]
+
+
+def winAnimationCases(level):
+    from simClock import simClock
+
+    def setup(iteration):
+        if iteration == 0:
+            level.loadMap('town')
+            level.visibleSprites.customDraw(level.player)
+        if not level.inWinAnimation:
+            level.startWinAnimation()
+        simClock.advance()
+
+    def update(iteration):
+        level.updateWinAnimation()
+
+    def draw(iteration):
+        level.drawWinAnimation()
+
+    return [('winAnimation.update', 1000, update, setup), ('winAnimation.draw', 1000, draw, setup)]
+
+
+def navigationCases(level):
+    # Path queries on the town map: fresh searches, cached ones, and a crowd of 200 asking every step
+    import random
+    pairs = []
+    crowd = []
+
+    def setup(iteration):
+        if iteration == 0 and not pairs:
+            level.loadMap('town')
+            navGrid = level.visibleSprites.navigation()
+            rng = random.Random(1)
+            walkable = [tile for tile in range(len(navGrid.open)) if navGrid.open[tile]]
+            pairs.extend((navGrid.tileCenter(rng.choice(walkable)), navGrid.tileCenter(rng.choice(walkable)))
+                         for _ in range(500))
+            crowd.extend(navGrid.tileCenter(rng.choice(walkable)) for _ in range(200))
+
+    def fresh(iteration):
+        setup(iteration)
+        level.visibleSprites.navGrid.clearCache()
+
+    def cached(iteration):
+        setup(iteration)
+        if iteration == 0:
+            for start, goal in pairs:
+                level.visibleSprites.navGrid.findPath(start, goal)
+
+    def findPath(iteration):
+        start, goal = pairs[iteration % len(pairs)]
+        level.visibleSprites.navGrid.findPath(start, goal)
+
+    def crowdStep(iteration):
+        # Everyone heads for the same spot, which moves every 60 steps
+        navGrid = level.visibleSprites.navGrid
+        goal = pairs[iteration // 60 % len(pairs)][1]
+        for start in crowd:
+            navGrid.requestPath(start, goal)
+        navGrid.update()
+
+    return [
+        ('navigation.findPath.fresh', 300, findPath, fresh),
+        ('navigation.findPath.cached', 2000, findPath, cached),
+        ('navigation.crowd200', 300, crowdStep, setup),
+    ]
+
+
+def flowFieldCases(level):
+    # A crowd of 2000 chasing the player across town on one flow field, against 50 separate path searches
+    import random
+    from flowField import FlowField, Crowd
+    state = {}
+
+    def setup(iteration):
+        if iteration == 0 and not state:
+            level.loadMap('town')
+            navGrid = level.visibleSprites.navigation()
+            rng = random.Random(1)
+            walkable = [tile for tile in range(len(navGrid.open)) if navGrid.open[tile]]
+            state['goals'] = [navGrid.tileCenter(rng.choice(walkable)) for _ in range(50)]
+            state['crowd'] = Crowd([navGrid.tileCenter(rng.choice(walkable)) for _ in range(2000)], PLAYERSPEED / 2)
+            state['starts'] = [navGrid.tileCenter(rng.choice(walkable)) for _ in range(50)]
+            state['field'] = level.chaseField()
+
+    def build(iteration):
+        field = FlowField(level.visibleSprites.navGrid)
+        field.setGoal(state['goals'][iteration % len(state['goals'])])
+
+    def crowdStep(iteration):
+        # The goal moves on every 30 steps, the field catches up a few rings a step
+        field = state['field']
+        field.setGoal(state['goals'][iteration // 30 % len(state['goals'])])
+        field.update()
+        state['crowd'].update(field, 1 / SIMRATE)
+
+    def searches(iteration):
+        navGrid = level.visibleSprites.navGrid
+        navGrid.clearCache()
+        goal = state['goals'][iteration % len(state['goals'])]
+        for start in state['starts']:
+            navGrid.findPath(start, goal)
+
+    return [
+        ('flowField.build', 50, build, setup),
+        ('flowField.crowd2000', 600, crowdStep, setup),
+        ('flowField.findPath50', 20, searches, setup),
+    ]
+
+
+SUITES = {
+    'customDraw': customDrawCases,
+    'playerMove': playerMoveCases,
+    'dialogDraw': dialogDrawCases,
+    'npcInteraction': npcInteractionCases,
+    'loadMap': loadMapCases,
+    'winAnimation': winAnimationCases,
+    'navigation': navigationCases,
+    'flowField': flowFieldCases,
+}
+
+
+def measure(call, setup, iterations, allocationIterations=50):
+    # Time every call on its own, then run a shorter pass under tracemalloc for allocations
+    # (tracing slows Python down too much to time the same calls)
+    for iteration in range(min(10, iterations)):
+        if setup is not None:
+            setup(iteration)
+        call(iteration)
+
+    durations = np.empty(iterations, np.int64)
+    for iteration in range(iterations):
+        if setup is not None:
+            setup(iteration)
+        start = time.perf_counter_ns()
+        call(iteration)
+        durations[iteration] = time.perf_counter_ns() - start
+
+    allocationIterations = min(allocationIterations, iterations)
+    peaks = np.empty(allocationIterations, np.int64)
+    retained = 0
+    tracemalloc.start()
+    for iteration in range(allocationIterations):
+        if setup is not None:
+            setup(iteration)
+        before = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        call(iteration)
+        current, peak = tracemalloc.get_traced_memory()
+        peaks[iteration] = peak - before
+        retained += current - before
+    tracemalloc.stop()
+
+    milliseconds = durations / 1e6
+    p50, p95, p99 = (float(value) for value in np.percentile(milliseconds, (50, 95, 99)))
+    return {
+        'iterations': iterations,
+        'meanMs': float(milliseconds.mean()),
+        'p50Ms': p50,
+        'p95Ms': p95,
+        'p99Ms': p99,
+        'minMs': float(milliseconds.min()),
+        'maxMs': float(milliseconds.max()),
+        # Python memory only: pixel data lives in SDL and is not traced
+        'allocPeakBytes': int(np.median(peaks)),
+        'allocRetainedBytes': retained // allocationIterations,
+    }
+
+
+def runSuites(names, scale=1.0):
+    pygame.init()
+    pygame.display.set_mode((WIDTH, HEIGTH))
+    from level import Level
+    level = Level()
+
+    results = {}
+    print(f"{'case':<26} {'mean ms':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'peak B':>9} {'kept B':>8}")
+    for suiteName in names:
+        for name, iterations, call, setup in SUITES[suiteName](level):
+            result = measure(call, setup, max(1, int(iterations * scale)))
+            results[name] = result
+            print(f"{name:<26} {result['meanMs']:>9.3f} {result['p50Ms']:>9.3f} {result['p95Ms']:>9.3f} "
+                  f"{result['p99Ms']:>9.3f} {result['allocPeakBytes']:>9} {result['allocRetainedBytes']:>8}")
+    level.close()
+    pygame.quit()
+    return results
+
+
+def environment():
+    return {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'pygame': pygame.version.ver,
+        'sdl': '.'.join(map(str, pygame.get_sdl_version())),
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'system': platform.system(),
+    }
+
+
+def compare(results, baseline, metric='p50Ms', threshold=0.10, noiseMs=0.005):
+    # Cases that got slower than the baseline by more than threshold (and by more than noiseMs,
+    # so sub-microsecond jitter on tiny cases isn't flagged). Returns the regressed case names
+    regressions = []
+    print(f"{'case':<26} {'baseline':>10} {'now':>10} {'change':>8}")
+    for name, result in results.items():
+        old = baseline.get(name, {}).get(metric)
+        if old is None:
+            print(f"{name:<26} {'-':>10} {result[metric]:>10.3f} {'new':>8}")
+            continue
+        new = result[metric]
+        change = (new - old) / old if old else 0.0
+        regressed = change > threshold and new - old > noiseMs
+        if regressed:
+            regressions.append(name)
+        print(f"{name:<26} {old:>10.3f} {new:>10.3f} {change:>+8.1%}{'  REGRESSION' if regressed else ''}")
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Time the game's hot paths headlessly")
+    parser.add_argument('suites', nargs='*', help=f"suites to run, all by default: {', '.join(SUITES)}")
+    parser.add_argument('--out', help='write the results as JSON to this file')
+    parser.add_argument('--compare', metavar='BASELINE', help='JSON written by an earlier --out to compare against')
+    parser.add_argument('--threshold', type=float, default=0.10, help='slowdown that counts as a regression (0.10 = 10%%)')
+    parser.add_argument('--metric', default='p50Ms', choices=['meanMs', 'p50Ms', 'p95Ms', 'p99Ms'])
+    parser.add_argument('--scale', type=float, default=1.0, help='multiply every iteration count, e.g. 0.1 for a quick run')
+    args = parser.parse_args()
+    unknown = [name for name in args.suites if name not in SUITES]
+    if unknown:
+        parser.error(f"unknown suite {', '.join(unknown)}, choose from {', '.join(SUITES)}")
+
+    results = runSuites(args.suites or list(SUITES), args.scale)
+    if args.out:
+        with open(args.out, 'w') as file:
+            json.dump({'environment': environment(), 'results': results}, file, indent=2)
+        print(f"Wrote {len(results)} results to {args.out}")
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)['results']
+        regressions = compare(results, baseline, args.metric, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} regressed past {args.threshold:.0%}: {', '.join(regressions)}")
+            sys.exit(1)
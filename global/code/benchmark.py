@@ -0,0 +1,401 @@
+import os
+import sys
+import math
+import time
+import random
+
+# Run without opening a real window
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+
+import pygame
+from constants import *
+from chunkedLayer import ChunkedLayer
+from collision import MaskCollider, getMask
+from spatialHash import SpatialHash
+from renderQueue import RenderQueue
+from textLayout import TextLayout
+from particles import ParticleSystem, ParticleEmitter
+
+
+def timeFrames(frames, drawFrame):
+    # Average milliseconds per frame for drawFrame(frameIndex)
+    start = time.perf_counter()
+    for frame in range(frames):
+        drawFrame(frame)
+    return (time.perf_counter() - start) / frames * 1000
+
+
+def cameraPath(frame, mapWidth, mapHeight):
+    # Sweep the camera diagonally across the whole map
+    x = (frame * 37) % max(1, mapWidth - WIDTH)
+    y = (frame * 23) % max(1, mapHeight - HEIGTH)
+    return pygame.math.Vector2(x, y)
+
+
+def benchmarkMapDraw(frames=300, sizes=(1024, 2048, 4096, 8192), chunkSize=256):
+    # Compare a full-map blit against chunked drawing as the map grows
+    screen = pygame.display.get_surface()
+    results = []
+    print(f"{'map size':>12} {'full blit ms':>14} {'chunked ms':>12} {'chunks/frame':>14}")
+    for size in sizes:
+        mapSurf = pygame.Surface((size, size), pygame.SRCALPHA).convert_alpha()
+        # Checker pattern so the layer is not a flat fill
+        for y in range(0, size, TILESIZE):
+            for x in range(0, size, TILESIZE):
+                shade = 40 + ((x // TILESIZE + y // TILESIZE) % 2) * 40
+                mapSurf.fill((shade, shade, shade, 255), (x, y, TILESIZE, TILESIZE))
+        layer = ChunkedLayer(mapSurf, chunkSize, background=(0, 0, 0))
+
+        def drawFull(frame):
+            screen.blit(mapSurf, -cameraPath(frame, size, size))
+
+        chunkCounts = []
+
+        def drawChunked(frame):
+            chunkCounts.append(layer.draw(screen, cameraPath(frame, size, size)))
+
+        fullMs = timeFrames(frames, drawFull)
+        chunkedMs = timeFrames(frames, drawChunked)
+        averageChunks = sum(chunkCounts) / len(chunkCounts)
+        print(f"{f'{size}x{size}':>12} {fullMs:>14.3f} {chunkedMs:>12.3f} {averageChunks:>14.1f}")
+        results.append((size, fullMs, chunkedMs, averageChunks))
+    return results
+
+
+def benchmarkRealMapLayers(frames=300, chunkSize=256, scaleFactor=2):
+    # Same comparison on the game's own floor and roof layers
+    screen = pygame.display.get_surface()
+    layers = [
+        ('crypt floor', '../graphics/maps/CryptTest.png', (0, 0, 0)),
+        ('town floor', '../graphics/maps/Outside/Map2.png', (0, 0, 0)),
+        ('town roofs', '../graphics/maps/Outside/Plants/HouseRoofs.png', None),
+    ]
+    results = []
+    print(f"{'layer':>12} {'full blit ms':>14} {'chunked ms':>12} {'chunks/frame':>14}")
+    for name, path, background in layers:
+        image = pygame.image.load(path).convert_alpha()
+        size = (image.get_width() * scaleFactor, image.get_height() * scaleFactor)
+        layerSurf = pygame.transform.scale(image, size)
+        layer = ChunkedLayer(layerSurf, chunkSize, background)
+
+        chunkCounts = []
+        fullMs = timeFrames(frames, lambda frame: screen.blit(layerSurf, -cameraPath(frame, *size)))
+        chunkedMs = timeFrames(frames, lambda frame: chunkCounts.append(layer.draw(screen, cameraPath(frame, *size))))
+        averageChunks = sum(chunkCounts) / len(chunkCounts)
+        print(f"{name:>12} {fullMs:>14.3f} {chunkedMs:>12.3f} {averageChunks:>14.1f}")
+        results.append((name, fullMs, chunkedMs, averageChunks))
+    return results
+
+
+class CountingMask:
+    # Wraps a wall mask to count overlap queries made by the old collision loop
+    def __init__(self, mask):
+        self.mask = mask
+        self.queries = 0
+
+    def overlap(self, other, offset):
+        self.queries += 1
+        return self.mask.overlap(other, offset)
+
+
+def legacyCollisionMove(rect, direction, speed, image, wallMask):
+    # The collision loop Player used before collision.py, kept here as the baseline
+    MAX_ATTEMPTS = 10
+    for axis in ('horizontal', 'vertical'):
+        if axis == 'horizontal':
+            rect.x += direction.x * speed
+        else:
+            rect.y += direction.y * speed
+        playerMask = pygame.mask.from_surface(image)
+        if wallMask.overlap(playerMask, (rect.x, rect.y)):
+            attempts = 0
+            step = direction.x if axis == 'horizontal' else direction.y
+            if step != 0:
+                push = -1 if step > 0 else 1
+                while wallMask.overlap(playerMask, (rect.x, rect.y)) and attempts < MAX_ATTEMPTS:
+                    if axis == 'horizontal':
+                        rect.x += push
+                    else:
+                        rect.y += push
+                    attempts += 1
+            if attempts >= MAX_ATTEMPTS:
+                if axis == 'horizontal':
+                    rect.x -= direction.x * speed
+                else:
+                    rect.y -= direction.y * speed
+
+
+def walkDirections(frames, seed=1321):
+    # The same random walk for both collision methods, changing direction every 20 frames
+    rng = random.Random(seed)
+    directions = []
+    for frame in range(frames):
+        if frame % 20 == 0:
+            direction = pygame.math.Vector2(rng.choice((-1, 0, 1)), rng.choice((-1, 0, 1)))
+            if direction.magnitude() != 0:
+                direction = direction.normalize()
+        directions.append(direction)
+    return directions
+
+
+def benchmarkCollision(frames=2000, speeds=(5, 10, 20, 30, 40, 50)):
+    # Old per-pixel stepping loop against MaskCollider on the real crypt walls
+    from layerCache import layerCache
+    wallImage = pygame.image.load('../graphics/maps/CryptCollideables.png').convert_alpha()
+    size = (wallImage.get_width() * 2, wallImage.get_height() * 2)
+    wallMask = layerCache.loadMask('../graphics/maps/CryptCollideables.png', size,
+                                   lambda: pygame.mask.from_surface(pygame.transform.scale(wallImage, size)))
+    playerImage = pygame.image.load('../graphics/test/player.png').convert_alpha()
+    directions = walkDirections(frames)
+    spawn = (2000, 600)
+
+    results = []
+    print(f"{'speed':>6} {'old queries/frame':>18} {'old ms/frame':>13} {'new queries/frame':>18} {'new ms/frame':>13}")
+    for speed in speeds:
+        countingMask = CountingMask(wallMask)
+        rect = playerImage.get_rect(topleft=spawn)
+        start = time.perf_counter()
+        for direction in directions:
+            legacyCollisionMove(rect, direction, speed, playerImage, countingMask)
+        oldMs = (time.perf_counter() - start) / frames * 1000
+
+        collider = MaskCollider(wallMask)
+        mask = getMask(playerImage)
+        x, y = spawn
+        start = time.perf_counter()
+        for direction in directions:
+            dx = int(x + direction.x * speed) - x
+            dy = int(y + direction.y * speed) - y
+            x, y = collider.move(mask, x, y, dx, dy)
+        newMs = (time.perf_counter() - start) / frames * 1000
+
+        oldQueries = countingMask.queries / frames
+        newQueries = collider.queries / frames
+        print(f"{speed:>6} {oldQueries:>18.2f} {oldMs:>13.4f} {newQueries:>18.2f} {newMs:>13.4f}")
+        results.append((speed, oldQueries, oldMs, newQueries, newMs))
+    return results
+
+
+class StandInNpc:
+    # Just enough of an NPC for the proximity checks
+    def __init__(self, pos):
+        self.rect = pygame.Rect(pos[0], pos[1], 51, 105)
+        self.interactionRadius = 150
+
+    def legacyCanInteract(self, player, offset):
+        # NPC.canInteract before the spatial index, kept here as the baseline
+        screenPos = pygame.math.Vector2(self.rect.center) - offset
+        playerScreenPos = pygame.math.Vector2(player.rect.center) - offset
+        return screenPos.distance_to(playerScreenPos) <= self.interactionRadius
+
+    def canInteract(self, player, offset=None):
+        dx = self.rect.centerx - player.rect.centerx
+        dy = self.rect.centery - player.rect.centery
+        return dx * dx + dy * dy <= self.interactionRadius * self.interactionRadius
+
+
+def benchmarkInteraction(frames=500, counts=(5, 50, 500, 5000)):
+    # Per-frame cost of finding interactable NPCs, scanning every NPC against the spatial index
+    rng = random.Random(1321)
+    mapSize = (3008, 1344)  # Scaled town map
+    results = []
+    print(f"{'npcs':>6} {'scan all ms':>12} {'spatial hash ms':>16} {'in range':>9}")
+    for count in counts:
+        npcs = [StandInNpc((rng.randrange(mapSize[0]), rng.randrange(mapSize[1]))) for _ in range(count)]
+        index = SpatialHash(cellSize=256)
+        for npc in npcs:
+            index.insert(npc, npc.rect.center)
+        player = StandInNpc((0, 0))
+        offset = pygame.math.Vector2()
+        playerPositions = [(rng.randrange(mapSize[0]), rng.randrange(mapSize[1])) for _ in range(frames)]
+
+        start = time.perf_counter()
+        for pos in playerPositions:
+            player.rect.center = pos
+            scanned = [npc for npc in npcs if npc.legacyCanInteract(player, offset)]
+        scanMs = (time.perf_counter() - start) / frames * 1000
+
+        inRange = 0
+        start = time.perf_counter()
+        for pos in playerPositions:
+            player.rect.center = pos
+            found = [npc for npc in index.queryRadius(pos, 150) if npc.canInteract(player)]
+            index.nearest(pos, 150, lambda npc: npc.canInteract(player))
+            inRange += len(found)
+        indexMs = (time.perf_counter() - start) / frames * 1000
+
+        print(f"{count:>6} {scanMs:>12.4f} {indexMs:>16.4f} {inRange / frames:>9.2f}")
+        results.append((count, scanMs, indexMs))
+    return results
+
+
+def benchmarkSprites(frames=200, counts=(100, 1000, 5000, 10000), movingFraction=0.05):
+    # Sorting every sprite and blitting them one by one against the render queue
+    screen = pygame.display.get_surface()
+    rng = random.Random(1321)
+    mapSize = (4096, 3072)  # Scaled crypt map
+    image = pygame.image.load('../graphics/Characters/Sprite1.png').convert_alpha()
+    image = pygame.transform.scale(image, (image.get_width() * 3, image.get_height() * 3))
+    results = []
+    print(f"{'sprites':>8} {'sort+blit ms':>13} {'queue ms':>9} {'submitted':>10} {'culled':>8}")
+    for count in counts:
+        sprites = []
+        for _ in range(count):
+            sprite = pygame.sprite.Sprite()
+            sprite.image = image
+            sprite.rect = image.get_rect(topleft=(rng.randrange(mapSize[0]), rng.randrange(mapSize[1])))
+            sprites.append(sprite)
+        movers = sprites[:max(1, int(count * movingFraction))]
+
+        def step(frame):
+            # A few sprites wander each frame, like NPCs walking around
+            for sprite in movers:
+                sprite.rect.y += 1 if (frame // 30) % 2 == 0 else -1
+
+        def drawSorted(frame):
+            step(frame)
+            offset = cameraPath(frame, *mapSize)
+            for sprite in sorted(sprites, key=lambda sprite: sprite.rect.centery):
+                screen.blit(sprite.image, sprite.rect.topleft - offset)
+
+        queue = RenderQueue()
+        for sprite in sprites:
+            queue.add(sprite)
+
+        def drawQueued(frame):
+            step(frame)
+            queue.draw(screen, cameraPath(frame, *mapSize))
+
+        sortedMs = timeFrames(frames, drawSorted)
+        queuedMs = timeFrames(frames, drawQueued)
+        print(f"{count:>8} {sortedMs:>13.3f} {queuedMs:>9.3f} {queue.submitted:>10} {queue.culled:>8}")
+        results.append((count, sortedMs, queuedMs, queue.submitted, queue.culled))
+    return results
+
+
+def legacyDrawResponse(surface, font, text, maxWidth, color):
+    # Dialog.draw's word wrap before TextLayout, kept here as the baseline
+    yOffset = 20
+    words = text.split()
+    lines = []
+    currentLine = []
+    for word in words:
+        currentLine.append(word)
+        if font.size(' '.join(currentLine))[0] > maxWidth:
+            currentLine.pop()
+            lines.append(' '.join(currentLine))
+            currentLine = [word]
+    if currentLine:
+        lines.append(' '.join(currentLine))
+    for line in lines:
+        surface.blit(font.render(line, True, color), (70, 570 + yOffset))
+        yOffset += 30
+
+
+def benchmarkDialogText(lengths=(50, 200, 800, 2000), charsPerFrame=0.75, holdFrames=60):
+    # Frame time while a response types out (45 chars/s at 60 FPS) and then sits on screen,
+    # re-wrapping every frame against TextLayout
+    screen = pygame.display.get_surface()
+    font = pygame.font.Font(None, 32)
+    words = 'the codex is contained where ancient stories are kept'.split()
+    maxWidth = WIDTH - 140
+    results = []
+    print(f"{'chars':>6} {'re-wrap ms':>11} {'layout ms':>10}")
+    for length in lengths:
+        text = ''
+        while len(text) < length:
+            text += words[len(text) % len(words)] + ' '
+        text = text[:length].strip()
+        frames = int(len(text) / charsPerFrame) + holdFrames
+
+        def revealed(frame):
+            return min(len(text), int(frame * charsPerFrame))
+
+        oldMs = timeFrames(frames, lambda frame: legacyDrawResponse(
+            screen, font, text[:revealed(frame)], maxWidth, (255, 255, 255)))
+
+        layout = TextLayout(font, (255, 255, 255))
+
+        def drawLayout(frame):
+            layout.layout(text, maxWidth)
+            layout.draw(screen, (70, 590), revealed(frame))
+
+        newMs = timeFrames(frames, drawLayout)
+        print(f"{length:>6} {oldMs:>11.3f} {newMs:>10.3f}")
+        results.append((length, oldMs, newMs))
+    return results
+
+
+def legacyParticleFrame(surface, particles, offset, progress):
+    # What Level's win animation used to do for each particle every frame
+    for particle in particles:
+        particle['x'] += math.cos(particle['angle']) * particle['speed']
+        particle['y'] += math.sin(particle['angle']) * particle['speed']
+        particle['angle'] += 0.02
+        particle['alpha'] = max(0, 255 * (1 - progress))
+    for particle in particles:
+        color = (135, 206, 235, particle['alpha'])
+        particleSurf = pygame.Surface((int(particle['size'] * 2), int(particle['size'] * 2)), pygame.SRCALPHA)
+        pygame.draw.circle(particleSurf, color, (int(particle['size']), int(particle['size'])), int(particle['size']))
+        surface.blit(particleSurf, (int(particle['x'] - offset.x - particle['size']),
+                                    int(particle['y'] - offset.y - particle['size'])))
+
+
+def benchmarkParticles(frames=120, counts=(200, 2000, 10000, 50000), legacyLimit=2000, emitters=10):
+    # Update and draw time for particles bursting out of a handful of emitters around the screen
+    screen = pygame.display.get_surface()
+    offset = pygame.math.Vector2(0, 0)
+    results = []
+    print(f"{'particles':>10} {'dict loop ms':>13} {'emitters ms':>12} {'drawn':>8}")
+    for count in counts:
+        random.seed(count)
+        centers = [(random.uniform(200, WIDTH - 200), random.uniform(200, HEIGTH - 200)) for _ in range(emitters)]
+
+        oldMs = float('nan')
+        if count <= legacyLimit:
+            particles = [{
+                'x': centers[index % emitters][0], 'y': centers[index % emitters][1],
+                'speed': random.random() * 2 + 1, 'angle': random.random() * math.pi * 2,
+                'size': random.random() * 4 + 2, 'alpha': 255,
+            } for index in range(count)]
+            oldMs = timeFrames(frames, lambda frame: legacyParticleFrame(screen, particles, offset, frame / frames))
+
+        system = ParticleSystem(maxParticles=count)
+        seconds = frames / FPS
+        for center in centers:
+            emitter = system.addEmitter(ParticleEmitter(
+                center, capacity=count, color=(135, 206, 235), life=(seconds, seconds), spin=1.2))
+            system.emit(emitter, count // emitters)
+            emitter.stop()
+        drawn = []
+
+        def drawSystem(frame):
+            system.update(1 / FPS)
+            drawn.append(system.draw(screen, offset))
+
+        newMs = timeFrames(frames, drawSystem)
+        print(f"{count:>10} {oldMs:>13.3f} {newMs:>12.3f} {sum(drawn) / len(drawn):>8.0f}")
+        results.append((count, oldMs, newMs))
+    return results
+
+
+BENCHMARKS = {
+    'draw': benchmarkMapDraw,
+    'mapLayers': benchmarkRealMapLayers,
+    'collision': benchmarkCollision,
+    'interaction': benchmarkInteraction,
+    'sprites': benchmarkSprites,
+    'dialogText': benchmarkDialogText,
+    'particles': benchmarkParticles,
+}
+
+
+if __name__ == '__main__':
+    pygame.init()
+    pygame.display.set_mode((WIDTH, HEIGTH))
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        print(f"== {name} ==")
+        BENCHMARKS[name]()
+    pygame.quit()
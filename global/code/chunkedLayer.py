@@ -0,0 +1,73 @@
+import pygame
+
+
+class ChunkedLayer:
+    def __init__(self, surface, chunkSize=256, background=None):
+        # Split a full map layer into a grid of fixed-size chunks
+        # If a background color is given the chunks are flattened onto it and stored without alpha,
+        # which makes them much cheaper to blit. Only use it for layers drawn straight onto that color.
+        self.chunkSize = chunkSize
+        self.width, self.height = surface.get_size()
+        self.columns = -(-self.width // chunkSize)  # Ceiling division
+        self.rows = -(-self.height // chunkSize)
+
+        # Chunks are stored row by row so (col, row) -> row * columns + col
+        # Fully transparent chunks are stored as None and never drawn
+        self.chunks = []
+        for row in range(self.rows):
+            for col in range(self.columns):
+                x = col * chunkSize
+                y = row * chunkSize
+                chunkRect = pygame.Rect(x, y, min(chunkSize, self.width - x), min(chunkSize, self.height - y))
+                self.chunks.append(self.makeChunk(surface, chunkRect, background))
+
+        # Number of chunks blitted by the last draw call
+        self.lastDrawCount = 0
+
+    def makeChunk(self, surface, chunkRect, background):
+        chunk = surface.subsurface(chunkRect)
+
+        # Crop the chunk down to the pixels that are actually visible
+        visibleRect = chunk.get_bounding_rect()
+        if visibleRect.width == 0 or visibleRect.height == 0:
+            return None
+        x = chunkRect.x + visibleRect.x
+        y = chunkRect.y + visibleRect.y
+
+        if background is None:
+            return chunk.subsurface(visibleRect).copy(), x, y
+
+        flatChunk = pygame.Surface(visibleRect.size)
+        flatChunk.fill(background)
+        flatChunk.blit(chunk, (0, 0), visibleRect)
+        if pygame.display.get_surface() is not None:
+            flatChunk = flatChunk.convert()
+        return flatChunk, x, y
+
+    def visibleRange(self, offsetX, offsetY, viewWidth, viewHeight):
+        # Work out which columns and rows overlap the view
+        firstCol = max(0, int(offsetX) // self.chunkSize)
+        lastCol = min(self.columns - 1, int(offsetX + viewWidth - 1) // self.chunkSize)
+        firstRow = max(0, int(offsetY) // self.chunkSize)
+        lastRow = min(self.rows - 1, int(offsetY + viewHeight - 1) // self.chunkSize)
+        return firstCol, lastCol, firstRow, lastRow
+
+    def draw(self, surface, offset):
+        # Blit only the chunks that intersect the current camera view
+        viewWidth, viewHeight = surface.get_size()
+        firstCol, lastCol, firstRow, lastRow = self.visibleRange(offset[0], offset[1], viewWidth, viewHeight)
+        offsetX = int(offset[0])
+        offsetY = int(offset[1])
+
+        blitList = []
+        for row in range(firstRow, lastRow + 1):
+            rowStart = row * self.columns
+            for col in range(firstCol, lastCol + 1):
+                chunk = self.chunks[rowStart + col]
+                if chunk is not None:
+                    chunkSurf, x, y = chunk
+                    blitList.append((chunkSurf, (x - offsetX, y - offsetY)))
+
+        surface.blits(blitList, doreturn=False)
+        self.lastDrawCount = len(blitList)
+        return self.lastDrawCount
@@ -0,0 +1,91 @@
+import weakref
+import pygame
+
+
+# Masks built from sprite images, shared by every sprite using the same image
+# Entries go away on their own once nothing uses the image any more
+spriteMasks = weakref.WeakKeyDictionary()
+
+
+def getMask(image):
+    # Build a sprite's mask once instead of on every collision check
+    mask = spriteMasks.get(image)
+    if mask is None:
+        mask = pygame.mask.from_surface(image)
+        spriteMasks[image] = mask
+    return mask
+
+
+def solidSize(mask):
+    # Width and height of the part of the mask that is actually set
+    rects = mask.get_bounding_rects()
+    if not rects:
+        return 1, 1
+    bounds = rects[0].unionall(rects[1:])
+    return max(1, bounds.width), max(1, bounds.height)
+
+
+class MaskCollider:
+    def __init__(self, wallMask):
+        # Resolves movement of any masked sprite against a map's wall mask
+        self.wallMask = wallMask
+
+        # Solid size of each sprite mask seen, by id (masks can't be weakly referenced so they are kept here)
+        self.solidSizes = {}
+
+        # Number of wallMask.overlap calls, so cost per frame can be measured
+        self.queries = 0
+
+    def blocked(self, mask, x, y):
+        self.queries += 1
+        return self.wallMask.overlap(mask, (x, y)) is not None
+
+    def move(self, mask, x, y, dx, dy):
+        # Move horizontally then vertically. Each axis stops at the wall on its own,
+        # so a diagonal move into a wall keeps sliding along it
+        x = self.moveAxis(mask, x, y, dx, True)
+        y = self.moveAxis(mask, x, y, dy, False)
+        return x, y
+
+    def moveAxis(self, mask, x, y, distance, horizontal):
+        # Returns the new x (or y) after moving as far as possible along one axis
+        start = x if horizontal else y
+        if distance == 0:
+            return start
+
+        def positionAt(step):
+            return (start + step, y) if horizontal else (x, start + step)
+
+        # Sample the path no further apart than the sprite is thick so thin walls can't be skipped
+        sign = 1 if distance > 0 else -1
+        length = abs(distance)
+        sampleStep = self.sampleStep(mask, horizontal)
+        free = 0
+        hit = None
+        while free < length:
+            step = min(length, free + sampleStep)
+            if self.blocked(mask, *positionAt(step * sign)):
+                hit = step
+                break
+            free = step
+
+        if hit is None:
+            return start + distance
+
+        # Bisect between the last free step and the first blocked one to find the contact point
+        # A sprite that starts inside a wall just ends up back at (or near) where it started
+        while hit - free > 1:
+            middle = (free + hit) // 2
+            if self.blocked(mask, *positionAt(middle * sign)):
+                hit = middle
+            else:
+                free = middle
+        return start + free * sign
+
+    def sampleStep(self, mask, horizontal):
+        known = self.solidSizes.get(id(mask))
+        if known is None:
+            known = (mask, solidSize(mask))
+            self.solidSizes[id(mask)] = known
+        size = known[1]
+        return size[0] if horizontal else size[1]
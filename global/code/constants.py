@@ -2,3 +2,13 @@ WIDTH = 1280
 HEIGTH = 800
 FPS = 60
 TILESIZE = 32
+
+# Simulation steps per second, independent of how often frames are drawn
+SIMRATE = 120
+PLAYERSPEED = 300  # Pixels per second
+
+# 'capped' draws at most FPS frames a second, 'uncapped' draws as fast as it can, 'vsync' waits for the display
+RENDERMODE = 'capped'
+
+# While the camera is still, only redraw and update the parts of the screen that changed
+DIRTYRECTS = True
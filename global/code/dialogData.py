@@ -0,0 +1,237 @@
+import os
+import json
+from layerCache import layerCache
+
+
+# Actions a dialog option can trigger, handled by Dialog.handleInput
+knownActions = {'transition_town', 'transition_crypt', 'portal_animation'}
+
+
+class DialogError(ValueError):
+    # A dialog file that doesn't describe a valid dialog graph. The message lists every problem found
+    pass
+
+
+class DialogTree:
+    # Version of the compiled form written by toData, bumped whenever its layout changes
+    formatVersion = 1
+
+    def __init__(self, name, stateNames, start, firstOption, optionTexts, responses, nextStates, actions):
+        # A dialog graph compiled into flat tables. States and options are numbered,
+        # state s owns options firstOption[s] up to firstOption[s + 1] and an option's
+        # next state is an index into stateNames, or -1 where the conversation ends
+        self.name = name
+        self.stateNames = stateNames
+        self.start = start
+        self.firstOption = firstOption
+        self.optionTexts = optionTexts
+        self.responses = responses
+        self.nextStates = nextStates
+        self.actions = actions
+
+        # One tuple of option texts per state, the same object every time so the dialog box
+        # keeps its rendered options when a state is shown again
+        self.stateOptions = [tuple(optionTexts[firstOption[state]:firstOption[state + 1]])
+                             for state in range(len(stateNames))]
+
+    def optionsFor(self, state):
+        return self.stateOptions[state]
+
+    def choose(self, state, optionIndex):
+        # (response text, next state, action) for picking an option, next state -1 ends the conversation
+        option = self.firstOption[state] + optionIndex
+        if not 0 <= optionIndex < len(self.stateOptions[state]):
+            return None, -1, None
+        return self.responses[option], self.nextStates[option], self.actions[option]
+
+    def toData(self):
+        # Plain lists and numbers, safe to write as JSON and read back with fromData
+        return {
+            'format': self.formatVersion,
+            'name': self.name,
+            'states': self.stateNames,
+            'start': self.start,
+            'firstOption': self.firstOption,
+            'options': self.optionTexts,
+            'responses': self.responses,
+            'next': self.nextStates,
+            'actions': self.actions,
+        }
+
+    @classmethod
+    def fromData(cls, data):
+        # The tables written by toData, or None if they are from another format version or inconsistent
+        try:
+            if data['format'] != cls.formatVersion:
+                return None
+            states = data['states']
+            firstOption = data['firstOption']
+            optionCount = len(data['options'])
+            if (len(firstOption) != len(states) + 1 or firstOption[-1] != optionCount
+                    or not len(data['responses']) == len(data['next']) == len(data['actions']) == optionCount
+                    or not all(-1 <= state < len(states) for state in data['next'])):
+                return None
+            return cls(data['name'], states, data['start'], firstOption, data['options'],
+                       data['responses'], data['next'], data['actions'])
+        except (KeyError, TypeError):
+            return None
+
+    @classmethod
+    def empty(cls, name):
+        # A dialog with one state and nothing to say, for NPCs without a dialog file
+        return cls(name, ['greeting'], 0, [0, 0], [], [], [], [])
+
+
+def compileDialog(name, source):
+    # Check a dialog file's contents and turn them into a DialogTree. Raises DialogError listing every problem
+    # A file is {"start": state, "states": {state: {"options": [{"text", "response", "next", "action"}]}}},
+    # "next" is null where the conversation ends and "action" is optional
+    errors = []
+    states = source.get('states') if isinstance(source, dict) else None
+    if not isinstance(states, dict) or not states:
+        raise DialogError(f"{name}: needs a non-empty 'states' object")
+    for key in set(source) - {'start', 'states'}:
+        errors.append(f"{name}: unknown key '{key}'")
+
+    stateNames = list(states)
+    stateIndex = {stateName: index for index, stateName in enumerate(stateNames)}
+    startName = source.get('start', 'greeting')
+    if startName not in stateIndex:
+        errors.append(f"{name}: start state '{startName}' does not exist")
+
+    firstOption = [0]
+    optionTexts = []
+    responses = []
+    nextStates = []
+    actions = []
+    for stateName in stateNames:
+        state = states[stateName]
+        options = state.get('options') if isinstance(state, dict) else None
+        if not isinstance(options, list) or not options:
+            errors.append(f"{name}: state '{stateName}' needs a non-empty 'options' list")
+            options = []
+        for number, option in enumerate(options, 1):
+            where = f"{name}: state '{stateName}' option {number}"
+            if not isinstance(option, dict):
+                errors.append(f"{where}: must be an object")
+                option = {}
+            for key in set(option) - {'text', 'response', 'next', 'action'}:
+                errors.append(f"{where}: unknown key '{key}'")
+            text = option.get('text')
+            response = option.get('response', '')
+            nextName = option.get('next')
+            action = option.get('action')
+            if not isinstance(text, str) or not text:
+                errors.append(f"{where}: 'text' must be a non-empty string")
+            if not isinstance(response, str):
+                errors.append(f"{where}: 'response' must be a string")
+            if nextName is not None and nextName not in stateIndex:
+                errors.append(f"{where}: next state '{nextName}' does not exist")
+            if action is not None and action not in knownActions:
+                errors.append(f"{where}: unknown action '{action}'")
+            optionTexts.append(text)
+            responses.append(response)
+            nextStates.append(stateIndex.get(nextName, -1))
+            actions.append(action)
+        firstOption.append(len(optionTexts))
+
+    if errors:
+        raise DialogError('\n'.join(errors))
+
+    tree = DialogTree(name, stateNames, stateIndex[startName], firstOption, optionTexts, responses, nextStates,
+                      actions)
+    unreachable = set(range(len(stateNames))) - reachableStates(tree)
+    if unreachable:
+        # Not fatal, but usually a typo in some option's "next"
+        print(f"Dialog '{name}' has unreachable states: {', '.join(stateNames[state] for state in sorted(unreachable))}")
+    return tree
+
+
+def reachableStates(tree):
+    seen = {tree.start}
+    waiting = [tree.start]
+    while waiting:
+        state = waiting.pop()
+        for nextState in tree.nextStates[tree.firstOption[state]:tree.firstOption[state + 1]]:
+            if nextState >= 0 and nextState not in seen:
+                seen.add(nextState)
+                waiting.append(nextState)
+    return seen
+
+
+class DialogLibrary:
+    def __init__(self, dataDir='../data/dialogs', cacheDir='../cache/dialogs'):
+        # Compiled dialog trees by NPC name, one per name however many NPCs or map loads use it.
+        # A dialog is read from dataDir/<name>.json, and its compiled tables are kept in cacheDir
+        # so later runs skip validating and compiling files that haven't changed
+        self.dataDir = dataDir
+        self.cacheDir = cacheDir
+        self.trees = {}
+
+        # Counters for stats()
+        self.hits = 0
+        self.cacheHits = 0
+        self.compiles = 0
+
+    def get(self, name):
+        tree = self.trees.get(name)
+        if tree is not None:
+            self.hits += 1
+            return tree
+
+        path = os.path.join(self.dataDir, f"{name}.json")
+        if os.path.exists(path):
+            tree = self.load(name, path)
+        else:
+            tree = DialogTree.empty(name)
+        self.trees[name] = tree
+        return tree
+
+    def load(self, name, path):
+        entryPath = os.path.join(self.cacheDir, f"{name}-{layerCache.fileHash(path)}.json")
+        tree = self.readEntry(entryPath)
+        if tree is not None:
+            self.cacheHits += 1
+            return tree
+
+        with open(path, encoding='utf-8') as file:
+            try:
+                source = json.load(file)
+            except json.JSONDecodeError as error:
+                raise DialogError(f"{name}: {error}") from None
+        tree = compileDialog(name, source)
+        self.compiles += 1
+        self.writeEntry(entryPath, tree)
+        return tree
+
+    def readEntry(self, entryPath):
+        try:
+            with open(entryPath, encoding='utf-8') as file:
+                return DialogTree.fromData(json.load(file))
+        except (OSError, ValueError):
+            return None
+
+    def writeEntry(self, entryPath, tree):
+        # Write to a temporary file and rename so a half written entry is never read
+        try:
+            os.makedirs(self.cacheDir, exist_ok=True)
+            prefix = f"{tree.name}-"
+            for oldName in os.listdir(self.cacheDir):
+                if oldName.startswith(prefix) and oldName.count('-') == 1 and oldName.endswith('.json'):
+                    os.remove(os.path.join(self.cacheDir, oldName))
+            tempPath = f"{entryPath}.{os.getpid()}.tmp"
+            with open(tempPath, 'w', encoding='utf-8') as file:
+                json.dump(tree.toData(), file, ensure_ascii=False, separators=(',', ':'))
+            os.replace(tempPath, entryPath)
+        except OSError as error:
+            print(f"Could not write dialog cache entry {entryPath}: {error}")
+
+    def clear(self):
+        self.trees.clear()
+
+    def stats(self):
+        return {'trees': len(self.trees), 'hits': self.hits, 'cacheHits': self.cacheHits, 'compiles': self.compiles}
+
+
+# One library for every NPC, so each dialog file is compiled once however often maps are loaded
+dialogLibrary = DialogLibrary()
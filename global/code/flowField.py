@@ -0,0 +1,220 @@
+import numpy as np
+
+
+# The eight moves out of a tile as (dx, dy), straight ones first so they win ties
+moves = ((1, 0), (-1, 0), (0, 1), (0, -1), (1, 1), (1, -1), (-1, 1), (-1, -1))
+# Unit vector of each move, to steer along
+moveVectors = np.array([(dx, dy) for dx, dy in moves], np.float32)
+moveVectors /= np.linalg.norm(moveVectors, axis=1)[:, None]
+
+
+def shifted(rows, cols, dx, dy):
+    # Slices (destination, source) moving a (rows, cols) grid by (dx, dy): grid[destination] = grid[source]
+    destination = (slice(max(dy, 0), rows + min(dy, 0)), slice(max(dx, 0), cols + min(dx, 0)))
+    source = (slice(max(-dy, 0), rows - max(dy, 0)), slice(max(-dx, 0), cols - max(dx, 0)))
+    return destination, source
+
+
+class FlowField:
+    def __init__(self, navGrid, ringsPerStep=None, goalRings=3):
+        # Which way to walk from every tile of a NavGrid to reach one goal tile, so any number of
+        # characters heading to the same place each look their direction up instead of searching.
+        # Distances are a breadth first expansion done a whole ring of tiles at a time with NumPy.
+        # Every new goal tile rebuilds the field over the whole grid: with ringsPerStep that rebuild is
+        # time sliced, that many rings per update(), and characters keep following the previous field
+        # until it's done.
+        # A goal on a tile characters can't stand on (beside a wall) moves to the nearest walkable tile
+        # within goalRings tiles
+        self.navGrid = navGrid
+        self.tileSize = navGrid.tileSize
+        self.walkable = navGrid.walkableArray().astype(bool)
+        self.rows, self.columns = self.walkable.shape
+        self.ringsPerStep = ringsPerStep
+        self.goalRings = goalRings
+
+        # For each move, the tiles that can be entered by it: walkable, and for a diagonal
+        # the two tiles beside the corner it cuts are too
+        self.moveSlices = []
+        self.canEnter = []
+        for dx, dy in moves:
+            destination, source = shifted(self.rows, self.columns, dx, dy)
+            enter = np.zeros_like(self.walkable)
+            enter[destination] = self.walkable[destination] & self.walkable[source]
+            if dx and dy:
+                besideX = np.zeros_like(self.walkable)
+                besideY = np.zeros_like(self.walkable)
+                xDestination, xSource = shifted(self.rows, self.columns, dx, 0)
+                yDestination, ySource = shifted(self.rows, self.columns, 0, dy)
+                besideX[xDestination] = self.walkable[xSource]
+                besideY[yDestination] = self.walkable[ySource]
+                enter &= besideX & besideY
+            self.moveSlices.append((destination, source))
+            self.canEnter.append(enter)
+
+        # The finished field: rings from the goal (-1 where it can't be reached) and a direction per tile
+        self.goalTile = None
+        self.distance = np.full((self.rows, self.columns), -1, np.int32)
+        self.directionX = np.zeros((self.rows, self.columns), np.float32)
+        self.directionY = np.zeros((self.rows, self.columns), np.float32)
+
+        # The expansion for a goal that isn't finished yet, and the goal to start on once it is.
+        # A goal that keeps moving is caught up with one finished field at a time.
+        # Its buffers are made once: working swaps places with distance when a field is finished
+        self.pendingGoal = None
+        self.nextGoal = None
+        self.working = np.full((self.rows, self.columns), -1, np.int32)
+        self.frontier = np.zeros_like(self.walkable)
+        self.reached = np.zeros_like(self.walkable)
+        self.ring = 0
+
+        # Counters for stats()
+        self.builds = 0
+        self.rings = 0
+
+    def setGoal(self, pos):
+        # Head for the tile under a world position. Nothing happens while it stays on the same tile
+        goal = self.nearestWalkable(pos)
+        if goal is None:
+            return
+        row, col = goal
+        if self.pendingGoal is not None:
+            self.nextGoal = (row, col) if (row, col) != self.pendingGoal else None
+            return
+        if (row, col) != self.goalTile:
+            self.startExpansion((row, col))
+
+    def nearestWalkable(self, pos):
+        # (row, col) of the walkable tile closest to a world position: the tile under it, or else the nearest
+        # one in the rings of tiles around it. None when there's none within goalRings
+        row = min(max(int(pos[1]) // self.tileSize, 0), self.rows - 1)
+        col = min(max(int(pos[0]) // self.tileSize, 0), self.columns - 1)
+        if self.walkable[row, col]:
+            return row, col
+        for ring in range(1, self.goalRings + 1):
+            firstRow, firstCol = max(row - ring, 0), max(col - ring, 0)
+            rows, cols = np.nonzero(self.walkable[firstRow:row + ring + 1, firstCol:col + ring + 1])
+            if len(rows):
+                # Measured from the position itself to the tile centres
+                distances = ((firstCol + cols + 0.5) * self.tileSize - pos[0]) ** 2 + \
+                            ((firstRow + rows + 0.5) * self.tileSize - pos[1]) ** 2
+                nearest = int(np.argmin(distances))
+                return int(firstRow + rows[nearest]), int(firstCol + cols[nearest])
+        return None
+
+    def startExpansion(self, goal):
+        row, col = goal
+        self.pendingGoal = goal
+        self.working.fill(-1)
+        self.working[row, col] = 0
+        self.frontier.fill(False)
+        self.frontier[row, col] = True
+        self.ring = 0
+        if self.ringsPerStep is None:
+            self.expand(self.rows * self.columns)
+
+    def update(self):
+        # Carry on with an unfinished expansion, called once a simulation step
+        if self.pendingGoal is not None:
+            self.expand(self.ringsPerStep or self.rows * self.columns)
+
+    def expand(self, rings):
+        # Grow the expansion by up to this many rings of tiles, finishing the field once nothing new is reached
+        for _ in range(rings):
+            reached = self.reached
+            reached.fill(False)
+            for (destination, source), enter in zip(self.moveSlices, self.canEnter):
+                reached[destination] |= self.frontier[source] & enter[destination]
+            reached &= self.working < 0
+            if not reached.any():
+                self.finish()
+                return
+            self.ring += 1
+            self.rings += 1
+            self.working[reached] = self.ring
+            self.frontier, self.reached = reached, self.frontier
+
+    def finish(self):
+        # Point every reachable tile at its neighbour closest to the goal
+        distance = np.where(self.working >= 0, self.working, np.iinfo(np.int32).max).astype(np.float32)
+        best = np.full((self.rows, self.columns), np.inf, np.float32)
+        bestMove = np.full((self.rows, self.columns), -1, np.int8)
+        for index, ((dx, dy), (destination, source), enter) in enumerate(zip(moves, self.moveSlices, self.canEnter)):
+            # A tile in the move's source slice steps onto the tile at the same place in its destination slice
+            neighbour = np.full((self.rows, self.columns), np.inf, np.float32)
+            neighbour[source] = np.where(enter[destination], distance[destination], np.inf)
+            if dx and dy:
+                neighbour += 0.5  # Go straight where a diagonal gets no closer
+            better = neighbour < best
+            best[better] = neighbour[better]
+            bestMove[better] = index
+        closer = (best < distance) & (bestMove >= 0) & (self.working > 0)
+        self.directionX.fill(0)
+        self.directionY.fill(0)
+        self.directionX[closer] = moveVectors[bestMove[closer], 0]
+        self.directionY[closer] = moveVectors[bestMove[closer], 1]
+
+        self.distance, self.working = self.working, self.distance
+        self.goalTile, self.pendingGoal = self.pendingGoal, None
+        self.builds += 1
+        if self.nextGoal is not None:
+            goal, self.nextGoal = self.nextGoal, None
+            if goal != self.goalTile:
+                self.startExpansion(goal)
+
+    def ready(self):
+        return self.goalTile is not None
+
+    def direction(self, pos):
+        # Unit (x, y) to walk in from a world position, (0, 0) at the goal, off the map or where it can't be reached
+        row, col = int(pos[1]) // self.tileSize, int(pos[0]) // self.tileSize
+        if 0 <= row < self.rows and 0 <= col < self.columns:
+            return float(self.directionX[row, col]), float(self.directionY[row, col])
+        return 0.0, 0.0
+
+    def directions(self, positions):
+        # direction() for an (n, 2) array of world positions at once, as an (n, 2) array
+        cols = np.clip(positions[:, 0].astype(np.int32) // self.tileSize, 0, self.columns - 1)
+        rows = np.clip(positions[:, 1].astype(np.int32) // self.tileSize, 0, self.rows - 1)
+        return np.stack((self.directionX[rows, cols], self.directionY[rows, cols]), axis=1)
+
+    def distanceAt(self, pos):
+        # Tiles to walk to the goal from a world position, None where it can't be reached
+        row, col = int(pos[1]) // self.tileSize, int(pos[0]) // self.tileSize
+        if 0 <= row < self.rows and 0 <= col < self.columns and self.distance[row, col] >= 0:
+            return int(self.distance[row, col])
+        return None
+
+    def stats(self):
+        return {
+            'tiles': (self.columns, self.rows),
+            'goal': self.goalTile,
+            'expanding': self.pendingGoal is not None,
+            'builds': self.builds,
+            'rings': self.rings,
+        }
+
+
+class Crowd:
+    def __init__(self, positions, speed):
+        # Many characters moved together along a flow field, held as one (n, 2) array of world positions
+        # instead of a sprite each so moving them all is a handful of array operations
+        self.positions = np.asarray(positions, np.float32).reshape(-1, 2).copy()
+        self.speed = speed  # Pixels per second
+
+    def update(self, flowField, seconds):
+        # Move everyone along the field for this long. A move onto a tile that isn't walkable is dropped
+        # one axis at a time, so characters slide along walls rather than stopping dead
+        step = flowField.directions(self.positions) * (self.speed * seconds)
+        tileSize = flowField.tileSize
+        walkable = flowField.walkable
+        maxCol, maxRow = flowField.columns - 1, flowField.rows - 1
+        for axis in (0, 1):
+            moved = self.positions.copy()
+            moved[:, axis] += step[:, axis]
+            cols = np.clip(moved[:, 0].astype(np.int32) // tileSize, 0, maxCol)
+            rows = np.clip(moved[:, 1].astype(np.int32) // tileSize, 0, maxRow)
+            allowed = walkable[rows, cols]
+            self.positions[allowed, axis] = moved[allowed, axis]
+
+    def __len__(self):
+        return len(self.positions)
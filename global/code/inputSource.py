@@ -0,0 +1,166 @@
+import time
+import zlib
+import struct
+import pygame
+
+
+# Keys the game reads through key.get_pressed(), the only ones whose state a recording keeps
+trackedKeys = (pygame.K_w, pygame.K_a, pygame.K_s, pygame.K_d, pygame.K_e, pygame.K_ESCAPE, pygame.K_LSHIFT)
+
+# Events a recording keeps, by their code in the file. Mouse and window events don't affect the game
+recordedEvents = {pygame.QUIT: 0, pygame.KEYDOWN: 1, pygame.KEYUP: 2}
+eventTypes = {code: eventType for eventType, code in recordedEvents.items()}
+
+
+class KeyState:
+    # Stands in for key.get_pressed() while a recording plays back
+    def __init__(self, pressed):
+        self.pressed = pressed  # Set of keys held down
+
+    def __getitem__(self, key):
+        return key in self.pressed
+
+
+class InputRecording:
+    # File layout: header, the tracked key codes, then zlib compressed frames.
+    # A frame is its simulation step count, a bitmask of the tracked keys held and its events
+    header = struct.Struct('<4sHHH')  # b'INPT', format version, simulation rate, tracked key count
+    keyCode = struct.Struct('<I')
+    frameHeader = struct.Struct('<BHB')  # steps, held keys mask, event count
+    event = struct.Struct('<BI')  # event code, key
+    formatVersion = 1
+
+    def __init__(self, simRate, keys=trackedKeys):
+        self.simRate = simRate
+        self.keys = tuple(keys)
+        self.frames = []  # (steps, set of held keys, [(event type, key)])
+
+    def addFrame(self, steps, keyState, events):
+        held = {key for key in self.keys if keyState[key]}
+        self.frames.append((steps, held, [(event.type, getattr(event, 'key', 0)) for event in events
+                                          if event.type in recordedEvents]))
+
+    def save(self, path):
+        body = bytearray()
+        for steps, held, events in self.frames:
+            mask = sum(1 << bit for bit, key in enumerate(self.keys) if key in held)
+            body += self.frameHeader.pack(steps, mask, len(events))
+            for eventType, key in events:
+                body += self.event.pack(recordedEvents[eventType], key)
+        with open(path, 'wb') as file:
+            file.write(self.header.pack(b'INPT', self.formatVersion, self.simRate, len(self.keys)))
+            for key in self.keys:
+                file.write(self.keyCode.pack(key))
+            file.write(zlib.compress(bytes(body), 9))
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as file:
+            data = file.read()
+        magic, version, simRate, keyCount = cls.header.unpack_from(data)
+        if magic != b'INPT' or version != cls.formatVersion:
+            raise ValueError(f"{path} is not an input recording this version can play")
+        offset = cls.header.size
+        keys = [cls.keyCode.unpack_from(data, offset + index * cls.keyCode.size)[0] for index in range(keyCount)]
+        recording = cls(simRate, keys)
+
+        body = zlib.decompress(data[offset + keyCount * cls.keyCode.size:])
+        offset = 0
+        while offset < len(body):
+            steps, mask, eventCount = cls.frameHeader.unpack_from(body, offset)
+            offset += cls.frameHeader.size
+            events = []
+            for _ in range(eventCount):
+                code, key = cls.event.unpack_from(body, offset)
+                offset += cls.event.size
+                events.append((eventTypes[code], key))
+            recording.frames.append((steps, {key for bit, key in enumerate(keys) if mask >> bit & 1}, events))
+        return recording
+
+    def simSeconds(self):
+        return sum(frame[0] for frame in self.frames) / self.simRate
+
+
+class InputSource:
+    def __init__(self):
+        # The one place the game reads the keyboard from. Live, it passes pygame's input through
+        # (and can write it to a recording), or it plays a recording back frame by frame
+        # with the number of simulation steps each frame ran, so a replay simulates exactly the same game
+        self.keyState = None
+        self.recording = None  # InputRecording being written
+        self.recordPath = None
+        self.replay = None  # InputRecording being played back
+        self.frame = 0
+        self.frameSteps = 0
+        self.frameEvents = []
+        self.replayStart = None  # perf_counter when the replay started
+
+    @property
+    def replaying(self):
+        return self.replay is not None
+
+    def startRecording(self, path, simRate):
+        self.recording = InputRecording(simRate)
+        self.recordPath = path
+
+    def startReplay(self, path, simRate):
+        self.replay = InputRecording.load(path)
+        if self.replay.simRate != simRate:
+            raise ValueError(f"{path} was recorded at {self.replay.simRate} steps a second, the game runs {simRate}")
+        self.frame = 0
+
+    def beginFrame(self):
+        # The frame's events, and the key state pressed() returns until the next frame.
+        # A replay that has run out of frames asks the game to quit
+        if self.replay is None:
+            self.frameEvents = pygame.event.get()
+            self.keyState = pygame.key.get_pressed()
+            return self.frameEvents
+
+        if self.replayStart is None:
+            self.replayStart = time.perf_counter()
+        if pygame.display.get_init():
+            pygame.event.pump()  # Keeps the window responsive, the live events themselves are ignored
+        if self.frame >= len(self.replay.frames):
+            return [pygame.event.Event(pygame.QUIT)]
+        steps, held, events = self.replay.frames[self.frame]
+        self.keyState = KeyState(held)
+        self.frameSteps = steps
+        return [pygame.event.Event(eventType, key=key) for eventType, key in events]
+
+    def hold(self, keys):
+        # Scripted input for bots: pressed() reports exactly these keys held until the next hold()
+        self.keyState = KeyState(set(keys))
+
+    def pressed(self):
+        if self.keyState is None:
+            return pygame.key.get_pressed()
+        return self.keyState
+
+    def steps(self, liveSteps):
+        # How many simulation steps this frame runs: the live count, or the count the recorded frame ran
+        if self.replay is not None:
+            return self.frameSteps
+        self.frameSteps = liveSteps
+        return liveSteps
+
+    def endFrame(self):
+        if self.recording is not None:
+            self.recording.addFrame(self.frameSteps, self.keyState, self.frameEvents)
+        self.frame += 1
+
+    def stop(self):
+        # Save a recording in progress. Called when the game quits
+        if self.recording is not None:
+            self.recording.save(self.recordPath)
+            print(f"Recorded {len(self.recording.frames)} frames "
+                  f"({self.recording.simSeconds():.1f} s of game time) to {self.recordPath}")
+            self.recording = None
+        if self.replay is not None and self.replayStart is not None:
+            wallSeconds = time.perf_counter() - self.replayStart
+            print(f"Replayed {self.frame} frames ({self.replay.simSeconds():.1f} s of game time) "
+                  f"in {wallSeconds:.2f} s")
+
+
+# Shared by the game loop, the player and the level
+inputs = InputSource()
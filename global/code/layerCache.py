@@ -0,0 +1,172 @@
+import os
+import mmap
+import struct
+import hashlib
+import pygame
+
+
+class LayerCache:
+    # File headers: magic, width, height and a format detail
+    surfaceHeader = struct.Struct('<4sIII')  # b'SURF', width, height, bytes per pixel
+    maskHeader = struct.Struct('<4sIIII')  # b'MASK', width, height, word size, data bytes
+
+    def __init__(self, cacheDir='../cache/layers'):
+        # Pre-scaled map layers and wall masks, stored next to the game so warm loads skip decoding
+        self.cacheDir = cacheDir
+        self.enabled = True
+
+        # Content hashes by path, remembered until the file's size or modification time changes
+        self.hashes = {}
+
+        # Counters so the benefit can be checked
+        self.hits = 0
+        self.misses = 0
+
+    def fileHash(self, path):
+        # Hash the file contents so an edited PNG never matches its old cache entry
+        fileStat = os.stat(path)
+        signature = (fileStat.st_size, fileStat.st_mtime_ns)
+        known = self.hashes.get(path)
+        if known is not None and known[0] == signature:
+            return known[1]
+
+        digest = hashlib.sha1()
+        with open(path, 'rb') as file:
+            for block in iter(lambda: file.read(1 << 20), b''):
+                digest.update(block)
+        contentHash = digest.hexdigest()[:16]
+        self.hashes[path] = (signature, contentHash)
+        return contentHash
+
+    def sourceSize(self, path):
+        # Read a PNG's size from its header so a warm load never has to decode it
+        try:
+            with open(path, 'rb') as file:
+                header = file.read(24)
+        except OSError:
+            return None
+        if len(header) < 24 or header[:8] != b'\x89PNG\r\n\x1a\n' or header[12:16] != b'IHDR':
+            return None
+        return struct.unpack('>II', header[16:24])
+
+    def entryPrefix(self, path, size):
+        # Everything cached for this source file at this size starts with the same prefix
+        name = os.path.splitext(os.path.basename(path))[0].replace(' ', '_')
+        pathHash = hashlib.sha1(os.path.normpath(path).encode()).hexdigest()[:8]
+        return f"{name}-{pathHash}-{size[0]}x{size[1]}-"
+
+    def entryPath(self, path, size, extension):
+        return os.path.join(self.cacheDir, self.entryPrefix(path, size) + self.fileHash(path) + extension)
+
+    def loadSurface(self, path, size, build):
+        # Return the layer scaled to size, calling build() to make it when there is no valid entry
+        if not self.enabled:
+            return build()
+
+        entryPath = self.entryPath(path, size, '.surf')
+        surface = self.readSurface(entryPath, size)
+        if surface is not None:
+            self.hits += 1
+            return surface
+
+        self.misses += 1
+        surface = build()
+        self.writeEntry(entryPath, self.surfaceHeader.pack(b'SURF', size[0], size[1], 4),
+                        pygame.image.tobytes(surface, 'BGRA'))
+        return surface
+
+    def loadMask(self, path, size, build):
+        # Same as loadSurface but for collision masks
+        if not self.enabled:
+            return build()
+
+        entryPath = self.entryPath(path, size, '.mask')
+        mask = self.readMask(entryPath, size)
+        if mask is not None:
+            self.hits += 1
+            return mask
+
+        self.misses += 1
+        mask = build()
+        data = memoryview(mask)
+        self.writeEntry(entryPath, self.maskHeader.pack(b'MASK', size[0], size[1], data.itemsize, data.nbytes),
+                        data.cast('B'))
+        return mask
+
+    def readSurface(self, entryPath, size):
+        mapped = self.mapFile(entryPath)
+        if mapped is None:
+            return None
+
+        magic, width, height, bytesPerPixel = self.surfaceHeader.unpack_from(mapped)
+        dataSize = width * height * bytesPerPixel
+        if magic != b'SURF' or (width, height) != tuple(size) or len(mapped) != self.surfaceHeader.size + dataSize:
+            return None
+
+        # The surface shares the mapped pages, nothing is copied or decoded
+        # ACCESS_COPY in mapFile means drawing onto it can never write back to the file
+        pixels = memoryview(mapped)[self.surfaceHeader.size:]
+        surface = pygame.image.frombuffer(pixels, (width, height), 'BGRA')
+
+        # Only a display with a different pixel layout needs a real conversion
+        display = pygame.display.get_surface()
+        if display is not None and surface.get_masks()[:3] != display.get_masks()[:3]:
+            surface = surface.convert_alpha()
+        return surface
+
+    def readMask(self, entryPath, size):
+        mapped = self.mapFile(entryPath)
+        if mapped is None:
+            return None
+
+        mask = pygame.mask.Mask(size)
+        data = memoryview(mask)
+        magic, width, height, wordSize, dataSize = self.maskHeader.unpack_from(mapped)
+        if (magic != b'MASK' or (width, height) != tuple(size) or wordSize != data.itemsize
+                or dataSize != data.nbytes or len(mapped) != self.maskHeader.size + dataSize):
+            return None
+
+        data.cast('B')[:] = memoryview(mapped)[self.maskHeader.size:]
+        return mask
+
+    def mapFile(self, entryPath):
+        try:
+            with open(entryPath, 'rb') as file:
+                return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_COPY)
+        except (OSError, ValueError):
+            return None
+
+    def writeEntry(self, entryPath, header, data):
+        # Write to a temporary file and rename so a half written entry is never read
+        try:
+            os.makedirs(self.cacheDir, exist_ok=True)
+            self.removeStale(entryPath)
+            tempPath = f"{entryPath}.{os.getpid()}.tmp"
+            with open(tempPath, 'wb') as file:
+                file.write(header)
+                file.write(data)
+            os.replace(tempPath, entryPath)
+        except OSError as error:
+            # A read only install still works, it just never gets warm loads
+            print(f"Could not write layer cache entry {entryPath}: {error}")
+
+    def removeStale(self, entryPath):
+        # Drop entries made from an older version of the same source file
+        fileName = os.path.basename(entryPath)
+        prefix = fileName[:fileName.rindex('-') + 1]
+        extension = os.path.splitext(fileName)[1]
+        for oldName in os.listdir(self.cacheDir):
+            if oldName.startswith(prefix) and oldName.endswith(extension) and oldName != fileName:
+                os.remove(os.path.join(self.cacheDir, oldName))
+
+    def clear(self):
+        if os.path.isdir(self.cacheDir):
+            for fileName in os.listdir(self.cacheDir):
+                os.remove(os.path.join(self.cacheDir, fileName))
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
+
+
+# One cache directory shared by the asset cache and the camera group
+layerCache = LayerCache()
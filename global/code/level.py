@@ -1,31 +1,51 @@
 import pygame
-import math
-import random
+import time
+from concurrent.futures import ThreadPoolExecutor
 from constants import *
 from player import Player
 from random import choice
 from dialog import Dialog, NPC
 from soundManager import *
+from chunkedLayer import ChunkedLayer
+from overlayLayer import OverlayLayer
+from assetCache import assets
+from layerCache import layerCache
+from spatialHash import SpatialHash
+from navigation import NavGrid
+from flowField import FlowField
+from renderQueue import RenderQueue
+from textCache import textCache
+from spriteAtlas import spriteAtlas
+from particles import ParticleSystem, ParticleEmitter
+from profiler import profiler
+from simClock import simClock
+from inputSource import inputs
 
 
 
 class Level:
-    def __init__(self):
-        self.dialog = Dialog()
+    def __init__(self, headless=False):
+        # A headless level runs the game without drawing or sound: no display, mixer or fonts are needed,
+        # maps load only what collision needs, and it is meant to be stepped with update() as fast as it will go
+        self.headless = headless
 
         # Get the display surface
-        self.displaySurface = pygame.display.get_surface()
+        self.displaySurface = None if headless else pygame.display.get_surface()
 
         # Sprite group setup
-        self.visibleSprites = cameraGroup()
+        self.visibleSprites = cameraGroup(headless)
         self.obstacleSprites = pygame.sprite.Group()
         self.npcs = pygame.sprite.Group()
 
+        # NPCs and anything else the player can interact with, indexed by position
+        self.interactables = SpatialHash(cellSize=256)
+        self.interactionRange = 0  # Largest interaction radius of anything in the index
+
         # Debug font
-        self.debugFont = pygame.font.Font(None, 36)
+        self.debugFont = None if headless else textCache.getFont(None, 36)
 
         # Initialize dialog system
-        self.dialogSystem = Dialog()
+        self.dialogSystem = Dialog(headless)
         self.dialogSystem.setLevelReference(self)
 
         # Map management
@@ -38,91 +58,273 @@ class Level:
         self.transitionAlpha = 0
         self.fadeOut = True
 
+        # The target map is loaded on this thread while the screen fades out
+        self.mapLoader = ThreadPoolExecutor(max_workers=1)
+        self.pendingMap = None
+        # Normally the fade holds on black while a slow load finishes. Recording, replaying and
+        # headless runs wait for it instead, so the new map always arrives on the same step
+        self.waitForMapLoads = headless
+
+        # Flow field towards the player for characters chasing or following them, made by chaseField()
+        self.playerField = None
+
+        # Frame timing so we can check transitions don't hitch
+        self.lastFrameTime = None
+        self.transitionStats = {'worstFrameMs': 0.0, 'frames': 0, 'loadWaitMs': 0.0}
+        self.lastTransitionStats = None
+        self.transitionHistory = []  # (map, stats) of every finished transition, for transitionReport()
+
         # Add win animation state
         self.inWinAnimation = False
         self.winAnimationStart = 0
         self.winAnimationDuration = 10000
         self.messageDuration = 5000
-        self.particles = []
+        self.particles = ParticleSystem()
+        self.lastParticleUpdate = 0
         self.portalSize = 0
         self.done = False
 
+        # Portal circle drawn into one reusable surface, redrawn only when its radius changes
+        self.portalSurface = None
+        self.portalRadius = None
+
+        # What the last renderDirty frame showed, to tell which parts of the screen have changed since
+        self.lastView = None  # (map, camera offset), None forces a full redraw
+        self.lastDialogState = None
+        self.lastPromptRects = []
+        self.maxClipGroups = 4  # Separate clips a dirty frame is redrawn under at most
+
         # Create fade surface for transitions
-        self.fadeSurface = pygame.Surface((WIDTH, HEIGTH))
-        self.fadeSurface.fill((0, 0, 0))
+        if not headless:
+            self.fadeSurface = pygame.Surface((WIDTH, HEIGTH))
+            self.fadeSurface.fill((0, 0, 0))
 
         # Create map and load initial map
         self.createMapData()
         self.loadMap(self.currentMap)
 
-        # Initialize sound manager
-        self.soundManager = SoundManager()
+        # Sound manager shared with the dialog and the game loop
+        self.soundManager = nullSoundManager if headless else soundManager
         # Start ambient sound for initial map
         self.soundManager.startAmbient(self.currentMap)
 
 
 
+    def close(self):
+        # Stop the map loader thread, dropping a load still in progress. Called when the game or a tool is done
+        self.mapLoader.shutdown(wait=False, cancel_futures=True)
+        self.pendingMap = None
+
     def run(self):
+        # One simulation step and one frame, for callers that don't run their own fixed timestep
+        self.update()
+        self.render()
+
+    def update(self):
+        # Advance the game by one fixed simulation step (SIMRATE per second, whatever the frame rate)
         # Check for map transitions first
         if not self.dialogSystem.active:
             self.checkMapTransitions()
 
         # Update transition if active
         if self.inTransition:
-            self.updateTransition()
+            with profiler.phase('transition'):
+                self.updateTransition()
 
         if self.inWinAnimation:
-            self.updateWinAnimation()
+            with profiler.phase('winAnimation'):
+                self.updateWinAnimation()
+        else:
+            with profiler.phase('spriteUpdate'):
+                self.visibleSprites.update()
+
+            # Only check for NPC interaction if we're not transitioning or in dialog
+            with profiler.phase('npcInteraction'):
+                if not self.inTransition and not self.dialogSystem.active:
+                    self.checkNpcInteraction()
+                elif self.dialogSystem.active:
+                    self.checkDialogDistance()
+            self.dialogSystem.updateTypewriter()
+
+        # Path searches characters have asked for, and the field leading to the player
+        if self.visibleSprites.navGrid is not None:
+            with profiler.phase('navigation'):
+                self.visibleSprites.navGrid.update()
+                if self.playerField is not None:
+                    self.playerField.setGoal(self.player.hitbox.center)
+                    self.playerField.update()
+
+        simClock.advance()
+
+    def render(self, alpha=1.0):
+        # Draw the game once per displayed frame. alpha is how far real time has got
+        # from the last simulation step towards the next one, moving sprites are drawn that far along
+        self.beginFrame(alpha)
+        self.drawFrame()
+
+    def renderDirty(self, alpha=1.0, forceFull=False):
+        # Like render, but while the camera is still only the parts of the screen that changed are redrawn.
+        # Returns the screen rects to pass to display.update, an empty list when nothing changed,
+        # or None when the whole screen was redrawn
+        self.beginFrame(alpha)
+        with profiler.phase('dirtyRects'):
+            regions = self.changedRegions(forceFull)
+        if regions is None:
+            self.displaySurface.fill('black')
+            self.drawFrame()
+        else:
+            # Each group of touching regions is redrawn under its own clip, so a prompt at the top and the
+            # dialog box at the bottom changing together don't redraw everything between them
+            for clip in self.clipGroups(regions):
+                self.displaySurface.set_clip(clip)
+                self.displaySurface.fill('black')
+                self.drawFrame()
+            self.displaySurface.set_clip(None)
+        return regions
+
+    def clipGroups(self, regions):
+        # Join regions that overlap until none do. Past maxClipGroups, drawing the frame once per group
+        # would cost more than the area it saves, so they are drawn under one bounding clip instead
+        groups = [pygame.Rect(rect) for rect in regions]
+        merged = True
+        while merged:
+            merged = False
+            for index, rect in enumerate(groups):
+                other = rect.collidelist(groups[index + 1:])
+                if other >= 0:
+                    groups[index] = rect.union(groups.pop(index + 1 + other))
+                    merged = True
+                    break
+        if len(groups) > self.maxClipGroups:
+            return [groups[0].unionall(groups[1:])]
+        return groups
+
+    def changedRegions(self, forceFull=False):
+        # Screen rects that differ from the last frame, or None if everything has to be redrawn:
+        # when the camera moved, the map changed, or a fade or the win animation covers the screen
+        camera = self.visibleSprites
+        offset = camera.cameraOffset(self.player.rect.center)
+        view = (camera.currentMap, int(offset.x), int(offset.y))
+
+        # Always asked, so the render queue keeps its record of the screen up to date
+        regions = camera.renderQueue.changedRects(self.displaySurface, offset)
+        # Roofs and balustrades part way through fading
+        regions += camera.overlayChanges(offset)
+
+        promptRects = []
+        if not self.inTransition and not self.dialogSystem.active:
+            promptRects = [npc.interactionPrompt(offset)[1] for npc in self.promptedNpcs()]
+        if promptRects != self.lastPromptRects:
+            regions += self.lastPromptRects + promptRects
+        self.lastPromptRects = promptRects
+
+        dialogState = self.dialogSystem.drawState()
+        if dialogState != self.lastDialogState:
+            regions.append(self.dialogSystem.boxRect(self.displaySurface))
+        self.lastDialogState = dialogState
+
+        if forceFull or self.inTransition or self.inWinAnimation:
+            # Whatever covered the screen has to be cleared off it by a full redraw once it's gone too
+            self.lastView = None
+            return None
+        if view != self.lastView:
+            self.lastView = view
+            return None
+        screen = self.displaySurface.get_rect()
+        return [rect.clip(screen) for rect in regions if rect.colliderect(screen)]
+
+    def beginFrame(self, alpha):
+        self.trackFrameTime()
+        self.soundManager.update()
+        self.player.interpolate(alpha)
+        self.visibleSprites.updateOverlays(self.player)
+
+    def drawFrame(self):
+        with profiler.phase('customDraw'):
             self.visibleSprites.customDraw(self.player)
-            self.drawWinAnimation()
-            return
 
-        # Update and draw the game
-        self.visibleSprites.customDraw(self.player)
-        self.visibleSprites.update()
+        if self.inWinAnimation:
+            with profiler.phase('winAnimationDraw'):
+                self.drawWinAnimation()
+            return
 
-        # Only check for NPC interaction if we're not transitioning or in dialog
-        if not self.inTransition and not self.dialogSystem.active:
-            self.checkNpcInteraction()
-        elif self.dialogSystem.active:
-            self.checkDialogDistance()
+        with profiler.phase('interactionPrompts'):
+            if not self.inTransition and not self.dialogSystem.active:
+                self.drawInteractionPrompts()
 
         # Draw dialog and transition effect
-        self.dialogSystem.draw(self.displaySurface)
-        self.drawTransition()
+        with profiler.phase('dialogDraw'):
+            self.dialogSystem.draw(self.displaySurface)
+        with profiler.phase('transitionDraw'):
+            self.drawTransition()
 
     def startTransition(self, targetMap, spawnPosition):
         if not self.inTransition:
             # print(f"Starting transition to {targetMap} with spawn position {spawnPosition}")
             self.inTransition = True
-            self.transitionTimer = pygame.time.get_ticks()
+            self.transitionTimer = simClock.now()
             self.fadeOut = True
             self.targetMap = targetMap
             self.targetSpawn = spawnPosition
             self.soundManager.playSound('transition')
+            self.soundManager.preloadAmbient(targetMap)
+
+            # Start loading the target map now so it is ready by the middle of the fade
+            mapInfo = self.mapData[targetMap]
+            self.pendingMap = self.mapLoader.submit(
+                self.visibleSprites.buildMapSurfaces, mapInfo['floor'], mapInfo['walls'], mapInfo['props'],
+                mapInfo['overlays'])
+            self.transitionStats = {'worstFrameMs': 0.0, 'frames': 0, 'loadWaitMs': 0.0}
+            self.lastFrameTime = time.perf_counter()
 
     def updateTransition(self):
         if not self.inTransition:
             return
 
-        currentTime = pygame.time.get_ticks()
+        currentTime = simClock.now()
         elapsedTime = currentTime - self.transitionTimer
 
         if self.fadeOut:
             self.transitionAlpha = min(255, (elapsedTime / (self.transitionDuration / 2)) * 255)
             if elapsedTime >= self.transitionDuration / 2:
+                # Hold on the black screen until the loader thread is done with the new map
+                if not self.pendingMap.done() and not self.waitForMapLoads:
+                    self.transitionStats['loadWaitMs'] = elapsedTime - self.transitionDuration / 2
+                    return
+                try:
+                    mapSurfaces = self.pendingMap.result()
+                except Exception as error:
+                    raise RuntimeError(f"Loading the {self.targetMap} map for the transition failed") from error
+                finally:
+                    self.pendingMap = None
                 self.currentMap = self.targetMap  # Update current map
-                self.loadMap(self.targetMap)
-                self.player.rect.topleft = self.targetSpawn
-                self.player.hitbox.topleft = self.targetSpawn
+                self.loadMap(self.targetMap, mapSurfaces)
+                self.player.setPosition(self.targetSpawn)
                 self.fadeOut = False
+
+                # Crossfade into the new map's ambient while the screen fades back in
+                self.soundManager.startAmbient(self.currentMap)
                 self.transitionTimer = currentTime
         else:
             self.transitionAlpha = max(0, 255 - (elapsedTime / (self.transitionDuration / 2)) * 255)
             if elapsedTime >= self.transitionDuration / 2:
                 self.inTransition = False
-                # Start new ambient sound
-                self.soundManager.startAmbient(self.currentMap)
+                self.lastTransitionStats = self.transitionStats
+                self.transitionHistory.append((self.currentMap, self.transitionStats))
+
+    def transitionReport(self):
+        # One line per finished transition, the worst frame is what shows whether loading the map hitched
+        return [f"Transition to {mapName}: worst frame {stats['worstFrameMs']:.1f} ms over {stats['frames']} frames, "
+                f"waited {stats['loadWaitMs']:.0f} ms for the map" for mapName, stats in self.transitionHistory]
+
+    def trackFrameTime(self):
+        # Record how long the last frame took and keep the worst one seen during a transition
+        now = time.perf_counter()
+        if self.lastFrameTime is not None and self.inTransition:
+            frameMs = (now - self.lastFrameTime) * 1000
+            self.transitionStats['frames'] += 1
+            self.transitionStats['worstFrameMs'] = max(self.transitionStats['worstFrameMs'], frameMs)
+        self.lastFrameTime = now
 
     def drawTransition(self):
         #Draw the transition effect.
@@ -130,30 +332,48 @@ class Level:
             self.fadeSurface.set_alpha(self.transitionAlpha)
             self.displaySurface.blit(self.fadeSurface, (0, 0))
 
-    def loadMap(self, mapName):
+    def loadMap(self, mapName, mapSurfaces=None):
         # Load a new map and set up all necessary sprites and objects.
-        # Clear existing sprites
+        # mapSurfaces is a map already built on the loader thread, otherwise it is loaded here
+        # Hand the old player's image back to the asset cache, NPC frames stay in the sprite atlas
+        if hasattr(self, 'player'):
+            self.player.releaseAssets()
+
+        # Clear existing sprites, the old map's flow field goes with them
+        self.playerField = None
         self.visibleSprites.empty()
         self.obstacleSprites.empty()
         self.npcs.empty()
+        self.interactables.clear()
+        self.interactionRange = 0
 
         # Get map data
         mapInfo = self.mapData[mapName]
 
         # Update camera group with new map
-        self.visibleSprites.loadMapSurfaces(
-            mapInfo['floor'],
-            mapInfo['walls'],
-            mapInfo['props'],
-        )
+        if mapSurfaces is None:
+            mapSurfaces = self.visibleSprites.buildMapSurfaces(mapInfo['floor'], mapInfo['walls'], mapInfo['props'],
+                                                               mapInfo['overlays'])
+        self.visibleSprites.applyMapSurfaces(mapSurfaces)
 
         # Create player at spawn position
         self.player = Player(mapInfo['playerSpawn'],[self.visibleSprites],self.obstacleSprites, self.visibleSprites.wallMask, self)
         # Create NPCs specific to this map
         self.createNpcs(mapName)
+        for npc in self.npcs:
+            self.addInteractable(npc)
 
         self.current_map = mapName
 
+    def chaseField(self):
+        # The flow field towards the player on the current map, for characters that chase or follow them
+        # (none of the current NPCs move). They look their direction up with direction(pos), and each
+        # time the player reaches a new tile the field is rebuilt a few rings of tiles per simulation step
+        if self.playerField is None:
+            self.playerField = FlowField(self.visibleSprites.navigation(), ringsPerStep=8)
+            self.playerField.setGoal(self.player.hitbox.center)
+        return self.playerField
+
     def checkMapTransitions(self):
         if self.inTransition or self.dialogSystem.active:
             return  # Don't check for transitions if we're already transitioning or in dialog
@@ -174,13 +394,12 @@ class Level:
         # print(f"Transitioning to {targetMap} with spawn position {spawnPosition}")
         # could add transition effects here
         self.loadMap(targetMap)
-        self.player.rect.topleft = spawnPosition
-        self.player.hitbox.topleft = spawnPosition
+        self.player.setPosition(spawnPosition)
 
     def checkDialogDistance(self):
         #Check if player has moved too far from NPC during dialog
         if self.dialogSystem.active and self.dialogSystem.currentNpc:
-            if not self.dialogSystem.currentNpc.canInteract(self.player, self.visibleSprites.offset):
+            if not self.dialogSystem.currentNpc.canInteract(self.player):
                 self.dialogSystem.closeDialog()
                 # print("Dialog closed: Player moved too far from NPC") # Debug info
 
@@ -192,9 +411,9 @@ class Level:
 
     def createNpcs(self, mapName):
         if mapName == "crypt":
-            luciusImage = pygame.image.load("../graphics/Characters/Sprite2.png"),
-            # marcusImage = pygame.image.load("../graphics/Characters/Sprite3.png"),
-            # dudeImage = pygame.image.load("../graphics/Characters/Sprite4.png"),
+            luciusImage = spriteAtlas.frame("Sprite2")
+            # marcusImage = spriteAtlas.frame("Sprite3")
+            # dudeImage = spriteAtlas.frame("Sprite4")
             # Add more NPC sprites as needed
 
             # Create NPCs closer to starting position for testing
@@ -206,7 +425,7 @@ class Level:
             npc9 = NPC((1220, 1500), [self.visibleSprites, self.npcs], "codex", None)
             print(f"Created NPCs. Total NPCs: {len(self.npcs)}") # Debug statement
         elif mapName == "town":
-            artistImage = pygame.image.load("../graphics/Characters/Sprite1.png"),
+            artistImage = spriteAtlas.frame("Sprite1")
 
             # Add any town-specific NPCs here
             npc5 = NPC((2695, 580), [self.visibleSprites, self.npcs], "crypt", None)
@@ -219,7 +438,7 @@ class Level:
             print(f"Created Town NPCs. Total NPCs: {len(self.npcs)}") # Debug statement
 
     def checkNpcInteraction(self):
-        keys = pygame.key.get_pressed()
+        keys = inputs.pressed()
 
         '''
         # Debug info
@@ -236,11 +455,28 @@ class Level:
             debugY += 30
         '''
 
-        for npc in self.npcs:
-            if npc.canInteract(self.player, self.visibleSprites.offset):
-                npc.drawInteractionPrompt(self.displaySurface, self.visibleSprites.offset)
-                if keys[pygame.K_e]:
-                    npc.startDialog(self.dialogSystem)
+        # Only NPCs in the cells around the player get checked, however many the map has
+        playerPos = self.player.hitbox.center
+        if keys[pygame.K_e]:
+            npc = self.interactables.nearest(playerPos, self.interactionRange,
+                                             lambda npc: npc.canInteract(self.player))
+            if npc is not None:
+                npc.startDialog(self.dialogSystem)
+
+    def drawInteractionPrompts(self):
+        for npc in self.promptedNpcs():
+            npc.drawInteractionPrompt(self.displaySurface, self.visibleSprites.offset)
+
+    def promptedNpcs(self):
+        # NPCs close enough to the player to show their interaction prompt
+        playerPos = self.player.hitbox.center
+        return [npc for npc in self.interactables.queryRadius(playerPos, self.interactionRange)
+                if npc.canInteract(self.player)]
+
+    def addInteractable(self, entity):
+        # Anything with a rect and an interactionRadius can be indexed
+        self.interactables.insert(entity, entity.rect.center)
+        self.interactionRange = max(self.interactionRange, entity.interactionRadius)
 
     def createMapData(self):
         self.mapData = {
@@ -248,6 +484,8 @@ class Level:
                 'floor': '../graphics/maps/CryptTest.png',
                 'walls': '../graphics/maps/CryptCollideables.png',
                 'props': '../graphics/maps/SolidProps.png',
+                # Drawn over the sprites, each piece fading out while it covers the player
+                'overlays': ['../graphics/maps/CryptBallister.png'],
                 'playerSpawn': (2000, 600),
                 'connections': {
                     'town': {
@@ -266,6 +504,7 @@ class Level:
                 'floor': '../graphics/maps/Outside/Map2.png',
                 'walls': '../graphics/maps/Outside/Map2Walls.png',
                 'props': '../graphics/maps/Outside/outsideHouses.png',
+                'overlays': ['../graphics/maps/Outside/Plants/HouseRoofs.png'],
                 'playerSpawn': (4000, 1000),
                 'connections': {
                     'crypt': {
@@ -281,25 +520,23 @@ class Level:
 
     def startWinAnimation(self):
         self.inWinAnimation = True
-        self.winAnimationStart = pygame.time.get_ticks()
+        self.winAnimationStart = simClock.now()
         self.winAnimationDuration = 3000  # 3 seconds
-        self.particles = []
         self.portalSize = 0
         self.maxPortalSize = 200
 
-        self.messageStartTime = pygame.time.get_ticks()
+        self.messageStartTime = simClock.now()
 
 
-        # Create initial particles
-        for _ in range(20):
-            self.particles.append({
-                'x': self.player.rect.centerx,
-                'y': self.player.rect.centery,
-                'speed': random.random() * 2 + 1,
-                'angle': random.random() * math.pi * 2,
-                'size': random.random() * 4 + 2,
-                'alpha': 255  # Add alpha for fade out
-            })
+        # Burst of particles spiralling out from the player and fading over the whole animation
+        lifetime = self.winAnimationDuration / 1000
+        self.particles.clear()
+        self.lastParticleUpdate = self.winAnimationStart
+        burst = self.particles.addEmitter(ParticleEmitter(
+            self.player.hitbox.center, capacity=20, color=(135, 206, 235),
+            speed=(60, 180), size=(2, 6), life=(lifetime, lifetime), spin=1.2))
+        self.particles.emit(burst, 20)
+        burst.stop()
 
         # Play portal sound
         self.soundManager.playSound('portalOpen')
@@ -308,7 +545,7 @@ class Level:
         if not self.inWinAnimation:
             return
 
-        current_time = pygame.time.get_ticks()
+        current_time = simClock.now()
         elapsed = current_time - self.winAnimationStart
         progress = elapsed / self.winAnimationDuration  # normalized time (0 to 1)
 
@@ -316,6 +553,7 @@ class Level:
         # Check if animation should end
         if elapsed >= self.winAnimationDuration:
             self.inWinAnimation = False
+            self.particles.clear()
             print("Victory Dialog triggered")  # Debug line
             # self.dialog.startVictoryDialog()
             return
@@ -324,123 +562,213 @@ class Level:
         self.portalSize = min(self.maxPortalSize,
                               self.maxPortalSize * self.easeOutQuad(progress))
 
-        # Update particles with fade out
-        for particle in self.particles:
-            # Update position
-            particle['x'] += math.cos(particle['angle']) * particle['speed']
-            particle['y'] += math.sin(particle['angle']) * particle['speed']
-            particle['angle'] += 0.02
-
-            # Fade out particles
-            particle['alpha'] = max(0, 255 * (1 - progress))
+        # Move and fade the particles by the time since the last update
+        self.particles.update((current_time - self.lastParticleUpdate) / 1000)
+        self.lastParticleUpdate = current_time
 
     def drawWinAnimation(self):
         if not self.inWinAnimation:
             return
 
-        # Draw portal with alpha
-        portal_surface = pygame.Surface((self.portalSize * 2, self.portalSize * 2), pygame.SRCALPHA)
-        portal_alpha = max(0, 255 * (1 - (self.portalSize / self.maxPortalSize)))
-        pygame.draw.circle(portal_surface, (135, 206, 235, portal_alpha),
-                           (self.portalSize, self.portalSize), self.portalSize)
-
         # Draw particles with fade
-        for particle in self.particles:
-            color = (135, 206, 235, particle['alpha'])
-            particle_surface = pygame.Surface((int(particle['size'] * 2),
-                                               int(particle['size'] * 2)),
-                                              pygame.SRCALPHA)
-            pygame.draw.circle(particle_surface, color,
-                               (int(particle['size']), int(particle['size'])),
-                               int(particle['size']))
-
-            # Calculate screen position
-            screen_x = int(particle['x'] - self.visibleSprites.offset.x - particle['size'])
-            screen_y = int(particle['y'] - self.visibleSprites.offset.y - particle['size'])
-            self.displaySurface.blit(particle_surface, (screen_x, screen_y))
+        self.particles.draw(self.displaySurface, self.visibleSprites.offset)
 
         # Draw portal at player position
+        portal_alpha = max(0, 255 * (1 - (self.portalSize / self.maxPortalSize)))
+        portal_surface, portal_area = self.portalImage(portal_alpha)
         portal_pos = (self.player.rect.centerx - self.portalSize - self.visibleSprites.offset.x,
                       self.player.rect.centery - self.portalSize - self.visibleSprites.offset.y)
-        self.displaySurface.blit(portal_surface, portal_pos)
+        self.displaySurface.blit(portal_surface, portal_pos, portal_area)
 
         # Display "You have won" message
-        if pygame.time.get_ticks() - self.messageStartTime <= self.messageDuration:
-            font = pygame.font.SysFont("Arial", 48)
-            text = font.render("You have won!", True, (255, 255, 255))  # White text
+        if simClock.now() - self.messageStartTime <= self.messageDuration:
+            text = textCache.render("You have won!", "Arial", 48, (255, 255, 255))  # White text
             text_rect = text.get_rect(center=(self.displaySurface.get_width() // 2, 50))  # Centered at the top
             self.displaySurface.blit(text, text_rect)
 
+    def portalImage(self, alpha):
+        # The portal surface and the area of it holding the current circle
+        if self.portalSurface is None:
+            self.portalSurface = pygame.Surface((self.maxPortalSize * 2, self.maxPortalSize * 2), pygame.SRCALPHA)
+        radius = int(self.portalSize)
+        if radius != self.portalRadius:
+            if self.portalRadius:
+                self.portalSurface.fill((0, 0, 0, 0), (0, 0, self.portalRadius * 2, self.portalRadius * 2))
+            pygame.draw.circle(self.portalSurface, (135, 206, 235), (radius, radius), radius)
+            self.portalRadius = radius
+        self.portalSurface.set_alpha(int(alpha))
+        return self.portalSurface, (0, 0, radius * 2, radius * 2)
+
     def easeOutQuad(self, t):
         # Quadratic easing function for smoother animation
         return t * (2 - t)
 
 class cameraGroup(pygame.sprite.Group):
-    def __init__(self):
+    def __init__(self, headless=False):
         # General set up
+        # The render queue has to exist before the group can take any sprites
+        self.renderQueue = RenderQueue()
         super().__init__()
-        self.displaySurface = pygame.display.get_surface()
-        self.halfWidth = self.displaySurface.get_size()[0] // 2
-        self.halfHeight = self.displaySurface.get_size()[1] // 2
+        # Headless there is no screen, the camera still works out where a WIDTH x HEIGTH one would be
+        self.headless = headless
+        self.displaySurface = None if headless else pygame.display.get_surface()
+        screenSize = (WIDTH, HEIGTH) if headless else self.displaySurface.get_size()
+        self.halfWidth = screenSize[0] // 2
+        self.halfHeight = screenSize[1] // 2
         self.offset = pygame.math.Vector2()
 
         # Scale factor setup
         self.scaleFactor = 2
 
+        # Size of the square chunks the map layers are split into
+        self.chunkSize = 256
+
         # Store screen dimensions
-        self.screenWidth = self.displaySurface.get_width()
-        self.screenHeight = self.displaySurface.get_height()
+        self.screenWidth = screenSize[0]
+        self.screenHeight = screenSize[1]
 
-        # Initialize with default map
-        self.loadMapSurfaces(
-            floorPath='../graphics/maps/CryptTest.png',
-            wallsPath='../graphics/maps/CryptCollideables.png',
-            propsPath='../graphics/maps/SolidProps.png',
-        )
+        # Cache keys of the images the current map is holding on to
+        # The map surfaces themselves are loaded when the level calls loadMapSurfaces
+        self.mapAssets = []
 
         # Track current map
         self.currentMap = 'crypt'  # Default map
 
-    def loadMapSurfaces(self, floorPath, wallsPath, propsPath):
-        # Update current map based on the path
-        self.currentMap = 'town' if 'outside' in floorPath.lower() else 'crypt'
+        # Where characters can walk on the current map, built the first time a path is asked for.
+        # Tiles are walkable for a character the size of the player's hitbox
+        self.navGrid = None
+        self.navAgentSize = (64, 64)
+
+    def add_internal(self, sprite, layer=None):
+        # Keep the render queue in step with the group's members
+        super().add_internal(sprite, layer)
+        self.renderQueue.add(sprite)
+
+    def remove_internal(self, sprite):
+        super().remove_internal(sprite)
+        self.renderQueue.remove(sprite)
+
+    def loadMapSurfaces(self, floorPath, wallsPath, propsPath, overlayPaths=()):
+        # Load a map straight away on the calling thread
+        self.applyMapSurfaces(self.buildMapSurfaces(floorPath, wallsPath, propsPath, overlayPaths))
+
+    def buildMapSurfaces(self, floorPath, wallsPath, propsPath, overlayPaths=()):
+        # Load everything a map needs without touching the camera group's current state,
+        # so it can run on the level's loader thread while the old map is still on screen
+        # Every layer is loaded through the shared asset cache and scaled to the size of the scaled floor
+        if self.headless:
+            return self.buildMapCollision(floorPath, wallsPath)
+        mapSurfaces = {}
+        mapSurfaces['floorSurf'] = assets.load(floorPath, self.scaleFactor)
+        newSize = mapSurfaces['floorSurf'].get_size()
+        mapSurfaces['size'] = newSize
+        mapSurfaces['assets'] = [
+            (floorPath, self.scaleFactor),
+            (wallsPath, newSize),
+            (propsPath, newSize),
+        ]
+        mapSurfaces['wallSurf'] = assets.load(wallsPath, newSize)
+        mapSurfaces['propSurf'] = assets.load(propsPath, newSize)
+
+        # Split the drawn layers into chunks so only the visible ones get blitted
+        # The floor is always drawn onto the black screen so it can be flattened
+        mapSurfaces['floorLayer'] = ChunkedLayer(mapSurfaces['floorSurf'], self.chunkSize, background=(0, 0, 0))
+
+        # Layers drawn over the sprites are split into their separate pieces instead, each one faded on its own.
+        # They are scaled like the floor, from their own size: they don't all cover the whole map
+        mapSurfaces['overlays'] = []
+        for overlayPath in overlayPaths:
+            overlaySurf = assets.load(overlayPath, self.scaleFactor)
+            mapSurfaces['assets'].append((overlayPath, self.scaleFactor))
+            overlayMask = layerCache.loadMask(overlayPath, overlaySurf.get_size(),
+                                              lambda: pygame.mask.from_surface(overlaySurf))
+            mapSurfaces['overlays'].append(OverlayLayer(overlaySurf, overlayMask))
+
+        # Create masks, the layer cache keeps them on disk so warm loads skip from_surface
+        mapSurfaces['wallMask'] = layerCache.loadMask(
+            wallsPath, newSize, lambda: pygame.mask.from_surface(mapSurfaces['wallSurf']))
+        # mapSurfaces['propMask'] = pygame.mask.from_surface(mapSurfaces['propSurf'])  # Uncomment if needed
 
-        # Load and scale new map surfaces
-        # Load base surfaces
-        self.floorSurf = pygame.image.load(floorPath).convert_alpha()
-        self.wallSurf = pygame.image.load(wallsPath).convert_alpha()
-        self.propSurf = pygame.image.load(propsPath).convert_alpha()
-        self.roofSurf = pygame.image.load("../graphics/maps/Outside/Plants/HouseRoofs.png").convert_alpha()
-        self.ballisterSurf = pygame.image.load("../graphics/maps/CryptBallister.png").convert_alpha()
+        # Update current map based on the path
+        mapSurfaces['mapName'] = 'town' if 'outside' in floorPath.lower() else 'crypt'
+        return mapSurfaces
+
+    def buildMapCollision(self, floorPath, wallsPath):
+        # Headless maps are just their size and wall mask. The size comes from the floor PNG's header
+        # and the mask from the layer cache, so a warm load decodes no images at all
+        width, height = layerCache.sourceSize(floorPath) or pygame.image.load(floorPath).get_size()
+        newSize = (width * self.scaleFactor, height * self.scaleFactor)
+        mapSurfaces = dict.fromkeys(('floorSurf', 'wallSurf', 'propSurf', 'floorLayer'))
+        mapSurfaces['size'] = newSize
+        mapSurfaces['assets'] = []
+        mapSurfaces['overlays'] = []
+        mapSurfaces['wallMask'] = layerCache.loadMask(
+            wallsPath, newSize, lambda: pygame.mask.from_surface(pygame.transform.scale(
+                pygame.image.load(wallsPath), newSize)))
+        mapSurfaces['mapName'] = 'town' if 'outside' in floorPath.lower() else 'crypt'
+        return mapSurfaces
+
+    def applyMapSurfaces(self, mapSurfaces):
+        # Swap a map made by buildMapSurfaces in. Must run on the main thread
+        # Headless the surfaces and layers are all None
+        self.currentMap = mapSurfaces['mapName']
+        self.floorSurf = mapSurfaces['floorSurf']
+        self.wallSurf = mapSurfaces['wallSurf']
+        self.propSurf = mapSurfaces['propSurf']
+        self.floorLayer = mapSurfaces['floorLayer']
+        self.overlays = mapSurfaces['overlays']
+        self.wallMask = mapSurfaces['wallMask']
+        self.navGrid = None
+
+        # Let go of the previous map's images now that shared ones have been picked up again
+        for path, scale in self.mapAssets:
+            assets.release(path, scale)
+        self.mapAssets = mapSurfaces['assets']
 
         # Get and store original dimensions
-        originalSize = self.floorSurf.get_size()
-        self.originalWidth = originalSize[0]
-        self.originalHeight = originalSize[1]
-        newSize = (originalSize[0] * self.scaleFactor, originalSize[1] * self.scaleFactor)
-
-        # Scale all surfaces
-        self.floorSurf = pygame.transform.scale(self.floorSurf, newSize)
-        self.wallSurf = pygame.transform.scale(self.wallSurf, newSize)
-        self.propSurf = pygame.transform.scale(self.propSurf, newSize)
-        self.roofSurf = pygame.transform.scale(self.roofSurf, newSize)
-        self.ballisterSurf = pygame.transform.scale(self.ballisterSurf, newSize)
-
-        # Set up rects
-        self.floorRect = self.floorSurf.get_rect(topleft=(0, 0))
-        self.wallRect = self.wallSurf.get_rect(topleft=(0, 0))
-        self.propRect = self.propSurf.get_rect(topleft=(0, 0))
-        self.roofRect = self.roofSurf.get_rect(topleft=(0, 0))
-        self.ballisterRect = self.ballisterSurf.get_rect(topleft=(0, 0))
-
-        # Create masks
-        self.wallMask = pygame.mask.from_surface(self.wallSurf)
-        # self.propMask = pygame.mask.from_surface(self.propSurf)  # Uncomment if needed
+        newSize = mapSurfaces['size']
+        self.originalWidth = newSize[0] // self.scaleFactor
+        self.originalHeight = newSize[1] // self.scaleFactor
+
+        # Set up rects, every layer is scaled to the floor's size
+        self.floorRect = pygame.Rect((0, 0), newSize)
+        self.wallRect = pygame.Rect((0, 0), newSize)
+        self.propRect = pygame.Rect((0, 0), newSize)
+
+    def navigation(self):
+        # The current map's navigation grid, for findPath and requestPath
+        if self.navGrid is None:
+            self.navGrid = NavGrid(self.wallMask, TILESIZE, self.navAgentSize)
+        return self.navGrid
 
     def customDraw(self, player):
-        # Calculate the ideal camera position (centered on player)
-        self.offset.x = player.rect.centerx - self.halfWidth
-        self.offset.y = player.rect.centery - self.halfHeight
+        self.offset.update(self.cameraOffset(player.rect.center))
+
+        # Drawing the floor
+        self.floorLayer.draw(self.displaySurface, self.offset)
+
+        # Drawing sprites in Y order, skipping anything off screen
+        self.renderQueue.draw(self.displaySurface, self.offset)
+
+        # Roofs and balustrades over the sprites, the pieces on screen only
+        for overlay in self.overlays:
+            overlay.draw(self.displaySurface, self.offset)
+
+    def updateOverlays(self, player):
+        # Fade out whichever overlay pieces are covering the player, and back in those that no longer are
+        for overlay in self.overlays:
+            overlay.update(player.rect, simClock.now())
+
+    def overlayChanges(self, offset):
+        # Screen rects of overlay pieces that look different since they were last drawn
+        rects = []
+        for overlay in self.overlays:
+            rects += overlay.changedRects(offset)
+        return rects
+
+    def cameraOffset(self, center):
+        # Camera position centered on a point and kept inside the current map
+        offset = pygame.math.Vector2()
 
         # Set boundaries based on current map
         if self.currentMap == 'town':
@@ -455,8 +783,8 @@ class cameraGroup(pygame.sprite.Group):
             topOffset = 0
 
         # Calculate the ideal camera position (centered on player)
-        self.offset.x = player.rect.centerx - self.halfWidth
-        self.offset.y = player.rect.centery - self.halfHeight
+        offset.x = center[0] - self.halfWidth
+        offset.y = center[1] - self.halfHeight
 
         # Calculate boundaries
         leftBoundary = 0
@@ -465,23 +793,6 @@ class cameraGroup(pygame.sprite.Group):
         bottomBoundary = (self.originalHeight * self.scaleFactor - self.screenHeight * 2) - TILESIZE * bottomOffset
 
         # Apply boundaries
-        self.offset.x = max(leftBoundary, min(self.offset.x, rightBoundary))
-        self.offset.y = max(topBoundary, min(self.offset.y, bottomBoundary))
-
-        # Drawing the floor
-        floorOffsetPos = self.floorRect.topleft - self.offset
-        self.displaySurface.blit(self.floorSurf, floorOffsetPos)
-
-        # Drawing sprites
-        for sprite in sorted(self.sprites(), key=lambda sprite: sprite.rect.centery):
-            if sprite.image is not None:
-                offsetPos = sprite.rect.topleft - self.offset
-                self.displaySurface.blit(sprite.image, offsetPos)
-
-        if self.currentMap == "town":
-            if player.rect.centery <= self.roofRect.centery:
-                self.displaySurface.blit(self.roofSurf, floorOffsetPos)
-
-        #elif self.currentMap == "crypt":
-            #if player.rect.centery <= self.ballisterRect.centery:
-                #self.displaySurface.blit(self.ballisterSurf, ballisterOffsetPos)
\ No newline at end of file
+        offset.x = max(leftBoundary, min(offset.x, rightBoundary))
+        offset.y = max(topBoundary, min(offset.y, bottomBoundary))
+        return offset
@@ -1,54 +1,153 @@
-import pygame, sys
+import pygame, sys, time, argparse
 from constants import *
 from level import Level
 from dialog import *
 from soundManager import *
+from profiler import profiler
+from simClock import simClock
+from inputSource import inputs
 
 class Game:
-    def __init__(self):
-        pygame.init()
-        self.screen = pygame.display.set_mode((WIDTH, HEIGTH))
-        pygame.display.set_caption('1321 Project')
+    def __init__(self, record=None, replay=None, replaySpeed=1.0, headless=False):
+        # Headless runs the game logic only, with no window, drawing or sound, as fast as it can.
+        # It needs a replay to drive it
+        self.headless = headless
+        if headless:
+            self.screen = None
+        else:
+            pygame.init()
+            if RENDERMODE == 'vsync':
+                # pygame only honours vsync on a SCALED or OpenGL display
+                self.screen = pygame.display.set_mode((WIDTH, HEIGTH), pygame.SCALED, vsync=1)
+            else:
+                self.screen = pygame.display.set_mode((WIDTH, HEIGTH))
+            pygame.display.set_caption('1321 Project')
+            pygame.mouse.set_visible(False)
+        self.frameLimit = FPS if RENDERMODE == 'capped' else 0
         self.clock = pygame.time.Clock()
-        self.level = Level()
-        pygame.mouse.set_visible(False)
-        self.soundManager = SoundManager()
+        self.level = Level(headless)
+        self.soundManager = self.level.soundManager
         self.played_intro_sound = False  # Flag to track if the intro sound has been played
-        self.u = 0
+        self.introEnds = 0  # Game time in ms the intro finishes, the player can't move until then
+
+        # Input comes live from pygame, optionally recorded, or from a recording played back.
+        # Either way map loads are waited for at the same step, so replays run the same game
+        self.inputs = inputs
+        if record:
+            self.inputs.startRecording(record, SIMRATE)
+        if replay:
+            self.inputs.startReplay(replay, SIMRATE)
+        if record or replay:
+            self.level.waitForMapLoads = True
+        self.replaySpeed = replaySpeed  # Game seconds per real second, 0 replays as fast as possible
+
+        # Real time not yet simulated, always less than one simulation step after the steps run
+        self.accumulator = 0.0
+        self.lastTime = None
+
+    def introPlaying(self):
+        # Timed in game time rather than by the mixer, so it ends on the same step in a replay
+        # (a missing intro never blocks)
+        return simClock.now() < self.introEnds
+
+    def quit(self):
+        self.inputs.stop()
+        # Frame times mean nothing headless, where no frames are drawn
+        if not self.headless:
+            for line in self.level.transitionReport():
+                print(line)
+        self.level.close()
+        pygame.quit()
+        sys.exit()
+
+    def paceReplay(self):
+        # Hold each replayed frame until real time catches up with the game time simulated so far
+        if self.replaySpeed > 0:
+            target = self.inputs.replayStart + simClock.now() / 1000 / self.replaySpeed
+            delay = target - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
 
     def run(self):
         while True:
+            profiler.beginFrame()
+            now = time.perf_counter()
+            if self.lastTime is not None:
+                self.accumulator += min(now - self.lastTime, simClock.maxFrameTime)
+            self.lastTime = now
+
             # Play the intro sound only once at the start
             if not self.played_intro_sound:
                 self.soundManager.playSound('intro')
+                self.introEnds = simClock.now() + self.soundManager.soundLength('intro')
                 self.played_intro_sound = True
 
-            if self.u >= 1100:  # Intro sound finished
-                self.level.player.speed = 5  # Resume normal movement speed
-            else:
-                self.u += 1
+            if self.introPlaying():
                 self.level.player.speed = 0  # Stop player movement while sound is playing
+            else:
+                self.level.player.speed = PLAYERSPEED  # Resume normal movement speed
 
-            for event in pygame.event.get():
+            for event in self.inputs.beginFrame():
                 if event.type == pygame.QUIT:
-                    pygame.quit()
-                    sys.exit()
+                    self.quit()
+
+                # F3 toggles the frame profiler and its overlay, F4 saves the buffered frames as a Chrome trace
+                if event.type == pygame.KEYDOWN and event.key == pygame.K_F3:
+                    profiler.toggle()
+                if event.type == pygame.KEYDOWN and event.key == pygame.K_F4:
+                    profiler.dumpTrace()
 
-                keys = pygame.key.get_pressed()
+                keys = self.inputs.pressed()
                 if keys[pygame.K_ESCAPE] and keys[pygame.K_LSHIFT]:
-                    # print(self.u)
-                    pygame.quit()
-                    sys.exit()
+                    self.quit()
                 # Only handle dialog input if dialog is active
                 if self.level.dialogSystem.active:
                     result = self.level.dialogSystem.handleInput(event)
                     if result is not None:
                         self.level.processDialogChoice(result)
-            self.screen.fill('black')
-            self.level.run()
-            pygame.display.update()
-            self.clock.tick(FPS)
+            # Run as many fixed steps as real time has covered, then draw once between the last two.
+            # A replay runs the steps its recorded frame ran instead
+            liveSteps = int(self.accumulator / simClock.step)
+            self.accumulator -= liveSteps * simClock.step
+            for step in range(self.inputs.steps(liveSteps)):
+                self.level.update()
+
+            self.inputs.endFrame()
+            if self.headless:
+                profiler.endFrame()
+                continue
+
+            alpha = 1.0 if self.inputs.replaying else self.accumulator / simClock.step
+            if DIRTYRECTS:
+                # The profiler overlay sits on top of everything, so while it shows every frame is drawn in full
+                regions = self.level.renderDirty(alpha, forceFull=profiler.enabled and profiler.showOverlay)
+            else:
+                self.screen.fill('black')
+                self.level.render(alpha)
+                regions = None
+            profiler.drawOverlay(self.screen)
+            with profiler.phase('displayUpdate'):
+                if regions is None:
+                    pygame.display.update()
+                elif regions:
+                    pygame.display.update(regions)
+            profiler.endFrame()
+            if self.inputs.replaying:
+                self.paceReplay()
+            else:
+                self.clock.tick(self.frameLimit)
 
 if __name__ == '__main__':
-    game = Game()
+    parser = argparse.ArgumentParser(description='1321 Project')
+    parser.add_argument('--record', metavar='FILE', help="record this session's input to FILE")
+    parser.add_argument('--replay', metavar='FILE', help='play the input recorded in FILE back')
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help='replay speed, 2 is twice as fast as it was played and 0 is as fast as possible')
+    parser.add_argument('--headless', action='store_true',
+                        help='replay the game logic only, with no window, drawing or sound, as fast as possible')
+    args = parser.parse_args()
+    if args.headless and not args.replay:
+        parser.error('--headless needs a --replay to play')
+
+    game = Game(args.record, args.replay, args.speed, args.headless)
     game.run()
\ No newline at end of file
@@ -0,0 +1,507 @@
+import heapq
+from collections import OrderedDict
+import numpy as np
+import pygame
+from constants import TILESIZE
+
+
+# Moves between neighbouring tiles: straight ones cost 1, diagonals sqrt(2)
+SQRT2 = 2 ** 0.5
+neighbourSteps = ((1, 0, 1.0), (-1, 0, 1.0), (0, 1, 1.0), (0, -1, 1.0),
+                  (1, 1, SQRT2), (1, -1, SQRT2), (-1, 1, SQRT2), (-1, -1, SQRT2))
+
+
+class NavGrid:
+    def __init__(self, wallMask, tileSize=TILESIZE, agentSize=(TILESIZE, TILESIZE), clusterSize=8, cacheSize=2048,
+                 searchesPerStep=4):
+        # Where a character can walk on a map, worked out once from its wall mask.
+        # The map is cut into tileSize tiles, a tile is walkable when an agentSize box centred on it
+        # is inside the map and touches no wall. Paths are searched hierarchically: the tiles are grouped
+        # into clusterSize x clusterSize clusters, the ways across each cluster border are the nodes of a
+        # small graph searched first, and only the tiles of the clusters on the way are searched after.
+        # Found paths are kept, least recently used dropped past cacheSize, until their region changes.
+        # Paths asked for with requestPath are searched for searchesPerStep at a time by update()
+        self.wallMask = wallMask
+        self.tileSize = tileSize
+        self.agentSize = agentSize
+        self.agentMask = pygame.mask.Mask(agentSize, fill=True)
+        self.clusterSize = clusterSize
+        self.cacheSize = cacheSize
+
+        mapWidth, mapHeight = wallMask.get_size()
+        self.columns = mapWidth // tileSize
+        self.rows = mapHeight // tileSize
+        self.clusterColumns = -(-self.columns // clusterSize)  # Ceiling division
+        self.clusterRows = -(-self.rows // clusterSize)
+
+        # Tiles are numbered row by row, (col, row) -> row * columns + col, 1 where walkable
+        self.open = bytearray(self.columns * self.rows)
+        self.updateTiles(0, 0, self.columns, self.rows)
+        # Tile -> ((next tile, cost), ...) for every move that stays inside the tile's cluster
+        self.localSteps = [()] * (self.columns * self.rows)
+        self.updateSteps(0, 0, self.columns, self.rows)
+
+        # The abstract graph: nodes are tiles on cluster borders, edges[node] maps neighbouring nodes to the
+        # cost of walking there. borders[(clusterA, clusterB)] lists the (tile in A, tile in B) crossings.
+        # The edges across a cluster are only searched for once a path search first reaches the cluster
+        self.borders = {}
+        self.clusterNodes = {}
+        self.nodeClusters = {}
+        self.edges = {}
+        self.linked = set()  # Clusters whose edges across have been found
+        self.intraPaths = {}  # (node, node) -> tiles walked between two nodes of one cluster
+        for cluster in self.allClusters():
+            for border in self.bordersAfter(cluster):
+                self.borders[border] = self.findCrossings(*border)
+        self.relink(set(self.allClusters()))
+
+        # (start tile, goal tile) -> path, and which cached paths go through each cluster
+        self.paths = OrderedDict()
+        self.pathClusters = {}
+        # Tile -> (cost to each node of its cluster, parent tiles), from connecting a path's ends to the graph
+        self.links = OrderedDict()
+        # Keys of the paths requestPath is waiting on, oldest first
+        self.pending = OrderedDict()
+        self.searchesPerStep = searchesPerStep
+
+        # Counters for stats()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    # Tiles
+
+    def updateTiles(self, firstCol, firstRow, lastCol, lastRow):
+        # Work out walkability of the tiles in [firstCol, lastCol) x [firstRow, lastRow) from the wall mask
+        agentWidth, agentHeight = self.agentSize
+        mapWidth, mapHeight = self.wallMask.get_size()
+        half = self.tileSize // 2
+        for row in range(firstRow, lastRow):
+            y = row * self.tileSize + half - agentHeight // 2
+            for col in range(firstCol, lastCol):
+                x = col * self.tileSize + half - agentWidth // 2
+                inside = 0 <= x and 0 <= y and x + agentWidth <= mapWidth and y + agentHeight <= mapHeight
+                self.open[row * self.columns + col] = inside and self.wallMask.overlap(self.agentMask, (x, y)) is None
+
+    def updateSteps(self, firstCol, firstRow, lastCol, lastRow):
+        # Work out the moves out of the tiles in [firstCol, lastCol) x [firstRow, lastRow)
+        columns = self.columns
+        isOpen = self.open
+        for row in range(firstRow, lastRow):
+            for col in range(firstCol, lastCol):
+                tile = row * columns + col
+                if not isOpen[tile]:
+                    self.localSteps[tile] = ()
+                    continue
+                clusterFirstCol, clusterFirstRow, clusterLastCol, clusterLastRow = self.clusterBounds(
+                    (col // self.clusterSize, row // self.clusterSize))
+                steps = []
+                for dx, dy, stepCost in neighbourSteps:
+                    nextCol, nextRow = col + dx, row + dy
+                    if not (clusterFirstCol <= nextCol < clusterLastCol and clusterFirstRow <= nextRow < clusterLastRow):
+                        continue
+                    # Diagonals may not cut the corner of a blocked tile
+                    if isOpen[nextRow * columns + nextCol] and (not (dx and dy) or (
+                            isOpen[row * columns + nextCol] and isOpen[nextRow * columns + col])):
+                        steps.append((nextRow * columns + nextCol, stepCost))
+                self.localSteps[tile] = tuple(steps)
+
+    def walkableArray(self):
+        # The walkability grid as a (rows, columns) array sharing this grid's memory
+        return np.frombuffer(self.open, np.uint8).reshape(self.rows, self.columns)
+
+    def tileAt(self, pos):
+        # Index of the tile under a world position, None outside the map
+        col = int(pos[0]) // self.tileSize
+        row = int(pos[1]) // self.tileSize
+        if 0 <= col < self.columns and 0 <= row < self.rows:
+            return row * self.columns + col
+        return None
+
+    def tileCenter(self, tile):
+        row, col = divmod(tile, self.columns)
+        half = self.tileSize // 2
+        return col * self.tileSize + half, row * self.tileSize + half
+
+    def walkable(self, pos):
+        tile = self.tileAt(pos)
+        return tile is not None and bool(self.open[tile])
+
+    def clusterOf(self, tile):
+        row, col = divmod(tile, self.columns)
+        return col // self.clusterSize, row // self.clusterSize
+
+    def clusterBounds(self, cluster):
+        # First and one past last column and row of a cluster's tiles
+        firstCol = cluster[0] * self.clusterSize
+        firstRow = cluster[1] * self.clusterSize
+        return (firstCol, firstRow, min(firstCol + self.clusterSize, self.columns),
+                min(firstRow + self.clusterSize, self.rows))
+
+    def allClusters(self):
+        return [(cx, cy) for cy in range(self.clusterRows) for cx in range(self.clusterColumns)]
+
+    # Building the abstract graph
+
+    def bordersAfter(self, cluster):
+        # The borders with the clusters to the right and below, so each border is listed once
+        cx, cy = cluster
+        if cx + 1 < self.clusterColumns:
+            yield cluster, (cx + 1, cy)
+        if cy + 1 < self.clusterRows:
+            yield cluster, (cx, cy + 1)
+
+    def bordersOf(self, cluster):
+        cx, cy = cluster
+        for other in ((cx - 1, cy), (cx, cy - 1)):
+            if (other, cluster) in self.borders:
+                yield other, cluster
+        for border in self.bordersAfter(cluster):
+            yield border
+
+    def findCrossings(self, clusterA, clusterB):
+        # Where the border can be walked across. Every run of open tile pairs along it is crossed
+        # in its middle, long runs at both ends as well so paths don't have to bend to the middle
+        firstCol, firstRow, lastCol, lastRow = self.clusterBounds(clusterA)
+        columns = self.columns
+        if clusterB[0] > clusterA[0]:
+            pairs = [(row * columns + lastCol - 1, row * columns + lastCol) for row in range(firstRow, lastRow)]
+        else:
+            pairs = [((lastRow - 1) * columns + col, lastRow * columns + col) for col in range(firstCol, lastCol)]
+
+        crossings = []
+        run = []
+        for pair in pairs + [None]:
+            if pair is not None and self.open[pair[0]] and self.open[pair[1]]:
+                run.append(pair)
+                continue
+            if run:
+                if len(run) >= 6:
+                    crossings.extend((run[0], run[-1]))
+                else:
+                    crossings.append(run[len(run) // 2])
+                run = []
+        return crossings
+
+    def relink(self, clusters):
+        # Rebuild the nodes of these clusters and the edges between clusters from self.borders.
+        # The edges across each cluster are found again when a search next reaches it
+        for cluster in clusters:
+            self.linked.discard(cluster)
+            for node in self.clusterNodes.pop(cluster, ()):
+                del self.nodeClusters[node]
+                for neighbour in self.edges.pop(node, {}):
+                    if neighbour in self.edges:
+                        self.edges[neighbour].pop(node, None)
+                    self.intraPaths.pop((node, neighbour), None)
+                    self.intraPaths.pop((neighbour, node), None)
+
+        for cluster in clusters:
+            nodes = set()
+            for border in self.bordersOf(cluster):
+                for tileA, tileB in self.borders[border]:
+                    nodes.add(tileA if border[0] == cluster else tileB)
+                    self.edges.setdefault(tileA, {})[tileB] = 1.0
+                    self.edges.setdefault(tileB, {})[tileA] = 1.0
+            self.clusterNodes[cluster] = nodes
+            for node in nodes:
+                self.nodeClusters[node] = cluster
+
+    def linkCluster(self, cluster):
+        # Find the edges between the nodes of one cluster, and the tiles walked along each
+        nodes = self.clusterNodes[cluster]
+        for node in nodes:
+            costs, parents = self.searchCluster(node)
+            for other in nodes:
+                if other != node and other in costs:
+                    self.edges[node][other] = costs[other]
+                    self.intraPaths[(node, other)] = self.tracePath(parents, other)
+        self.linked.add(cluster)
+
+    def searchCluster(self, start, goal=None):
+        # Dijkstra from start over the open tiles of its cluster, stopping early at goal if given.
+        # Returns the cost to every tile reached and each tile's parent on the way
+        localSteps = self.localSteps
+        costs = {start: 0.0}
+        parents = {start: None}
+        waiting = [(0.0, start)]
+        while waiting:
+            cost, tile = heapq.heappop(waiting)
+            if tile == goal:
+                break
+            if cost > costs[tile]:
+                continue
+            for nextTile, stepCost in localSteps[tile]:
+                nextCost = cost + stepCost
+                if nextCost < costs.get(nextTile, float('inf')):
+                    costs[nextTile] = nextCost
+                    parents[nextTile] = tile
+                    heapq.heappush(waiting, (nextCost, nextTile))
+        return costs, parents
+
+    def searchArea(self, start, goal, bounds):
+        # A* from start to goal over the open tiles inside bounds, (first col, first row, last col, last row)
+        # with the lasts one past the end. Returns the tiles from start to goal, both included, or None
+        firstCol, firstRow, lastCol, lastRow = bounds
+        columns = self.columns
+        isOpen = self.open
+        goalRow, goalCol = divmod(goal, columns)
+
+        def estimate(tile):
+            dx = abs(tile % columns - goalCol)
+            dy = abs(tile // columns - goalRow)
+            return max(dx, dy) + (SQRT2 - 1) * min(dx, dy)
+
+        costs = {start: 0.0}
+        parents = {start: None}
+        waiting = [(estimate(start), 0.0, start)]
+        while waiting:
+            _, cost, tile = heapq.heappop(waiting)
+            if tile == goal:
+                return [start] + self.tracePath(parents, goal)
+            if cost > costs[tile]:
+                continue
+            row, col = divmod(tile, columns)
+            for dx, dy, stepCost in neighbourSteps:
+                nextCol, nextRow = col + dx, row + dy
+                if not (firstCol <= nextCol < lastCol and firstRow <= nextRow < lastRow):
+                    continue
+                nextTile = nextRow * columns + nextCol
+                # Diagonals may not cut the corner of a blocked tile
+                if not isOpen[nextTile] or (dx and dy and not (isOpen[row * columns + nextCol] and
+                                                               isOpen[nextRow * columns + col])):
+                    continue
+                nextCost = cost + stepCost
+                if nextCost < costs.get(nextTile, float('inf')):
+                    costs[nextTile] = nextCost
+                    parents[nextTile] = tile
+                    heapq.heappush(waiting, (nextCost + estimate(nextTile), nextCost, nextTile))
+        return None
+
+    def tracePath(self, parents, tile):
+        # Tiles from the search's start to tile, start excluded
+        path = []
+        while parents[tile] is not None:
+            path.append(tile)
+            tile = parents[tile]
+        return path[::-1]
+
+    # Path queries
+
+    def findPath(self, start, goal):
+        # World positions of the tile centres to walk through from start to goal, both world positions,
+        # or None when there's no way there. The tuple is shared with the cache, it must not be changed
+        key = self.pathKey(start, goal)
+        if key is None:
+            return None
+        if key in self.paths:
+            self.hits += 1
+            self.paths.move_to_end(key)
+            return self.paths[key]
+        self.misses += 1
+        return self.search(key)
+
+    def requestPath(self, start, goal):
+        # Like findPath, but a path that isn't cached is left for update() to search for instead of
+        # being searched now. Returns False until then, so any number of characters can ask every step
+        key = self.pathKey(start, goal)
+        if key is None:
+            return None
+        if key in self.paths:
+            self.hits += 1
+            self.paths.move_to_end(key)
+            return self.paths[key]
+        self.pending[key] = None
+        return False
+
+    def update(self):
+        # Search for the paths asked for with requestPath, oldest first and at most searchesPerStep of them.
+        # Called once a simulation step, so how soon a path arrives never depends on the frame rate
+        for _ in range(min(self.searchesPerStep, len(self.pending))):
+            key, _ = self.pending.popitem(last=False)
+            if key not in self.paths:
+                self.misses += 1
+                self.search(key)
+
+    def pathKey(self, start, goal):
+        # (start tile, goal tile), or None if either end is off the map or somewhere nothing can stand
+        startTile = self.tileAt(start)
+        goalTile = self.tileAt(goal)
+        if startTile is None or goalTile is None or not self.open[startTile] or not self.open[goalTile]:
+            return None
+        return startTile, goalTile
+
+    def search(self, key):
+        tiles = self.searchTiles(*key)
+        path = tuple(self.tileCenter(tile) for tile in tiles) if tiles is not None else None
+        self.remember(key, path, {self.clusterOf(tile) for tile in tiles} if tiles is not None else None)
+        return path
+
+    def searchTiles(self, startTile, goalTile):
+        # Tiles from startTile to goalTile, both included
+        if startTile == goalTile:
+            return [startTile]
+        startCluster = self.clusterOf(startTile)
+        goalCluster = self.clusterOf(goalTile)
+        if startCluster == goalCluster:
+            # Usually the way is inside the cluster, but it may have to leave it round a wall
+            costs, parents = self.searchCluster(startTile, goalTile)
+            if goalTile in costs:
+                return [startTile] + self.tracePath(parents, goalTile)
+        elif abs(startCluster[0] - goalCluster[0]) <= 1 and abs(startCluster[1] - goalCluster[1]) <= 1:
+            # Ends in neighbouring clusters are searched for directly over the tiles of both first. Going
+            # through the border crossings would send two tiles either side of a border round a detour
+            startBounds = self.clusterBounds(startCluster)
+            goalBounds = self.clusterBounds(goalCluster)
+            tiles = self.searchArea(startTile, goalTile, (
+                min(startBounds[0], goalBounds[0]), min(startBounds[1], goalBounds[1]),
+                max(startBounds[2], goalBounds[2]), max(startBounds[3], goalBounds[3])))
+            if tiles is not None:
+                return tiles
+
+        startCosts, startParents = self.linksFor(startTile)
+        goalCosts, goalParents = self.linksFor(goalTile)
+        nodes = self.searchGraph(startTile, startCosts, goalTile, goalCosts)
+        if nodes is None:
+            return None
+
+        # Refine the nodes back into tiles: into the first node, across the graph's edges, out of the last
+        tiles = [startTile] + self.tracePath(startParents, nodes[0])
+        for node, nextNode in zip(nodes, nodes[1:]):
+            intra = self.intraPaths.get((node, nextNode))
+            tiles.extend(intra if intra is not None else (nextNode,))
+        if nodes[-1] != goalTile:
+            tiles.extend(self.tracePath(goalParents, nodes[-1])[::-1][1:] + [goalTile])
+        return tiles
+
+    def linksFor(self, tile):
+        # Costs from tile to the nodes of its cluster, and the parents to trace those paths back with
+        links = self.links.get(tile)
+        if links is not None:
+            self.links.move_to_end(tile)
+            return links
+        cluster = self.clusterOf(tile)
+        costs, parents = self.searchCluster(tile)
+        links = ({node: costs[node] for node in self.clusterNodes[cluster] if node in costs}, parents)
+        self.links[tile] = links
+        if len(self.links) > self.cacheSize:
+            self.links.popitem(last=False)
+        return links
+
+    def searchGraph(self, startTile, startCosts, goalTile, goalCosts):
+        # A* over the abstract graph from the nodes startTile reaches to those that reach goalTile.
+        # Returns the nodes on the way
+        goalCol, goalRow = goalTile % self.columns, goalTile // self.columns
+
+        def estimate(node):
+            dx = abs(node % self.columns - goalCol)
+            dy = abs(node // self.columns - goalRow)
+            return max(dx, dy) + (SQRT2 - 1) * min(dx, dy)
+
+        costs = dict(startCosts)
+        parents = dict.fromkeys(startCosts)
+        waiting = [(cost + estimate(node), cost, node) for node, cost in startCosts.items()]
+        heapq.heapify(waiting)
+        best = None
+        bestCost = float('inf')
+        while waiting:
+            total, cost, node = heapq.heappop(waiting)
+            if total >= bestCost:
+                break
+            if cost > costs[node]:
+                continue
+            if node in goalCosts and cost + goalCosts[node] < bestCost:
+                best = node
+                bestCost = cost + goalCosts[node]
+            if self.nodeClusters[node] not in self.linked:
+                self.linkCluster(self.nodeClusters[node])
+            for neighbour, edgeCost in self.edges.get(node, {}).items():
+                nextCost = cost + edgeCost
+                if nextCost < costs.get(neighbour, float('inf')):
+                    costs[neighbour] = nextCost
+                    parents[neighbour] = node
+                    heapq.heappush(waiting, (nextCost + estimate(neighbour), nextCost, neighbour))
+        if best is None:
+            return None
+        nodes = [best]
+        while parents[nodes[-1]] is not None:
+            nodes.append(parents[nodes[-1]])
+        return nodes[::-1]
+
+    def remember(self, key, path, clusters):
+        # clusters is None for "no path", which any change to the map may make wrong
+        self.paths[key] = path
+        for cluster in clusters if clusters is not None else (None,):
+            self.pathClusters.setdefault(cluster, set()).add(key)
+        if len(self.paths) > self.cacheSize:
+            self.forget(next(iter(self.paths)))
+
+    def forget(self, key):
+        path = self.paths.pop(key)
+        clusters = {self.clusterOf(self.tileAt(point)) for point in path} if path is not None else (None,)
+        for cluster in clusters:
+            keys = self.pathClusters.get(cluster)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.pathClusters[cluster]
+
+    # Changes to the map
+
+    def invalidateRegion(self, rect):
+        # The walls inside rect (world pixels) have changed: work its tiles out again, rebuild the graph
+        # around them and drop the cached paths through the clusters touched. Paths elsewhere stay cached
+        self.invalidations += 1
+        agentWidth, agentHeight = self.agentSize
+        # A tile's walkability depends on the walls under the agent box centred on it, not just the tile
+        rect = pygame.Rect(rect).inflate(agentWidth, agentHeight)
+        firstCol = max(0, rect.left // self.tileSize)
+        firstRow = max(0, rect.top // self.tileSize)
+        lastCol = min(self.columns, -(-rect.right // self.tileSize))
+        lastRow = min(self.rows, -(-rect.bottom // self.tileSize))
+        if firstCol >= lastCol or firstRow >= lastRow:
+            return
+        self.updateTiles(firstCol, firstRow, lastCol, lastRow)
+        # Moves into the changed tiles start one tile further out
+        self.updateSteps(max(0, firstCol - 1), max(0, firstRow - 1),
+                         min(self.columns, lastCol + 1), min(self.rows, lastRow + 1))
+
+        changed = {(cx, cy)
+                   for cy in range(firstRow // self.clusterSize, (lastRow - 1) // self.clusterSize + 1)
+                   for cx in range(firstCol // self.clusterSize, (lastCol - 1) // self.clusterSize + 1)}
+        for cluster in changed:
+            for border in self.bordersOf(cluster):
+                self.borders[border] = self.findCrossings(*border)
+        # A cluster next to a changed one may have gained or lost crossings on their shared border
+        affected = set(changed)
+        for cluster in changed:
+            for border in self.bordersOf(cluster):
+                affected.update(border)
+        self.relink(affected)
+
+        for cluster in affected | {None}:
+            for key in list(self.pathClusters.get(cluster, ())):
+                self.forget(key)
+        for tile in [tile for tile in self.links if self.clusterOf(tile) in affected]:
+            del self.links[tile]
+
+    def clearCache(self):
+        self.pending.clear()
+        self.paths.clear()
+        self.pathClusters.clear()
+        self.links.clear()
+
+    def stats(self):
+        return {
+            'tiles': (self.columns, self.rows),
+            'walkable': sum(self.open),
+            'clusters': len(self.clusterNodes),
+            'linkedClusters': len(self.linked),
+            'nodes': len(self.edges),
+            'edges': sum(len(neighbours) for neighbours in self.edges.values()) // 2,
+            'cachedPaths': len(self.paths),
+            'pending': len(self.pending),
+            'hits': self.hits,
+            'misses': self.misses,
+            'invalidations': self.invalidations,
+        }
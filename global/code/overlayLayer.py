@@ -0,0 +1,127 @@
+import pygame
+
+
+class OverlayRegion:
+    def __init__(self, image, rect):
+        # One building's roof, or one stretch of balustrade: the part of an overlay layer drawn and faded on its own
+        self.image = image  # Subsurface of the layer, shared with the asset cache
+        self.rect = rect  # Where it is in the world
+        self.alpha = 255.0  # Opacity it is fading towards or at
+        self.level = None  # Fade level it was drawn at last, None before the first draw
+        self.variants = {}  # Fade level -> copy of image with its alpha multiplied down, made once
+
+    def imageAt(self, level, fadeLevels):
+        # The image at a fade level between 1 and fadeLevels. Copies are made the first time a level is
+        # shown and kept, so a region fading back and forth never builds a surface again
+        if level >= fadeLevels:
+            return self.image
+        variant = self.variants.get(level)
+        if variant is None:
+            variant = self.image.copy()
+            variant.fill((255, 255, 255, 255 * level // fadeLevels), special_flags=pygame.BLEND_RGBA_MULT)
+            self.variants[level] = variant
+        return variant
+
+
+class OverlayLayer:
+    def __init__(self, surface, mask, fadeMs=250, fadeLevels=8, mergeDistance=16, coarseGrid=16):
+        # A layer drawn over the sprites (house roofs, the crypt's balustrades), split into regions where it
+        # has pixels. Only regions on screen are drawn, and a region covering the player fades out
+        # over fadeMs and back in once they step clear, in fadeLevels steps.
+        # mask is the layer's alpha mask. Regions closer than mergeDistance count as one
+        self.fadeMs = fadeMs
+        self.fadeLevels = fadeLevels
+        self.mask = mask
+        self.regions = [OverlayRegion(surface.subsurface(rect), rect)
+                        for rect in self.findRegions(surface, mask, mergeDistance, coarseGrid)]
+        self.playerMasks = {}  # Size -> filled mask, to test a region's pixels against the player's rect
+        self.lastUpdate = None
+
+        # Number of regions blitted by the last draw call
+        self.lastDrawCount = 0
+
+    def findRegions(self, surface, mask, mergeDistance, coarseGrid):
+        # Bounding rects of the layer's pieces, found on a scaled down copy of the mask and tightened on the
+        # surface. If that misses any pixels (a piece thinner than the grid) the full mask is searched instead
+        width, height = mask.get_size()
+        coarse = mask.scale((max(1, width // coarseGrid), max(1, height // coarseGrid)))
+        bounds = surface.get_rect()
+        rects = []
+        for rect in coarse.get_bounding_rects():
+            rect = pygame.Rect(rect.x * coarseGrid, rect.y * coarseGrid, rect.w * coarseGrid, rect.h * coarseGrid)
+            rect = rect.inflate(coarseGrid * 2, coarseGrid * 2).clip(bounds)
+            tight = surface.subsurface(rect).get_bounding_rect()
+            if tight.width and tight.height:
+                rects.append(tight.move(rect.topleft))
+        rects = self.mergeRects(rects, mergeDistance)
+
+        covered = pygame.mask.Mask((width, height))
+        for rect in rects:
+            covered.draw(pygame.mask.Mask(rect.size, fill=True), rect.topleft)
+        if mask.overlap_area(covered, (0, 0)) != mask.count():
+            rects = self.mergeRects(mask.get_bounding_rects(), mergeDistance)
+        return rects
+
+    def mergeRects(self, rects, mergeDistance):
+        # Join rects that overlap or come within mergeDistance until none do, so regions never overlap
+        rects = [pygame.Rect(rect) for rect in rects]
+        merged = True
+        while merged:
+            merged = False
+            for index, rect in enumerate(rects):
+                other = rect.inflate(mergeDistance * 2, mergeDistance * 2).collidelist(rects[index + 1:])
+                if other >= 0:
+                    rects[index] = rect.union(rects.pop(index + 1 + other))
+                    merged = True
+                    break
+        return rects
+
+    def covers(self, region, playerRect):
+        # Whether any of the region's pixels are over the player
+        area = region.rect.clip(playerRect)
+        if not area.width or not area.height:
+            return False
+        playerMask = self.playerMasks.get(area.size)
+        if playerMask is None:
+            playerMask = pygame.mask.Mask(area.size, fill=True)
+            self.playerMasks[area.size] = playerMask
+        return self.mask.overlap(playerMask, area.topleft) is not None
+
+    def update(self, playerRect, now):
+        # Move each region's fade on, now is the game time in milliseconds
+        elapsed = 0 if self.lastUpdate is None else now - self.lastUpdate
+        self.lastUpdate = now
+        change = 255 * elapsed / self.fadeMs if self.fadeMs else 255
+        for region in self.regions:
+            if self.covers(region, playerRect):
+                region.alpha = max(0.0, region.alpha - change)
+            else:
+                region.alpha = min(255.0, region.alpha + change)
+
+    def levelOf(self, region):
+        return round(region.alpha * self.fadeLevels / 255)
+
+    def changedRects(self, offset):
+        # Screen rects of the regions that will look different from when they were last drawn
+        return [region.rect.move(-int(offset[0]), -int(offset[1])) for region in self.regions
+                if region.level is not None and self.levelOf(region) != region.level]
+
+    def draw(self, surface, offset):
+        # Blit the regions that overlap the view at their current fade
+        view = pygame.Rect(int(offset[0]), int(offset[1]), *surface.get_size())
+        blits = []
+        for region in self.regions:
+            level = self.levelOf(region)
+            region.level = level
+            if level and region.rect.colliderect(view):
+                blits.append((region.imageAt(level, self.fadeLevels), region.rect.move(-view.x, -view.y)))
+        surface.blits(blits, doreturn=False)
+        self.lastDrawCount = len(blits)
+
+    def stats(self):
+        return {
+            'regions': len(self.regions),
+            'drawn': self.lastDrawCount,
+            'fading': sum(1 for region in self.regions if 0 < region.alpha < 255),
+            'variants': sum(len(region.variants) for region in self.regions),
+        }
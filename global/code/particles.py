@@ -0,0 +1,239 @@
+import numpy as np
+import pygame
+
+
+# Rows of an emitter's state array, one column per particle
+X, Y, SPEED, ANGLE, SIZE, AGE, LIFE, ALPHA = range(8)
+FIELDS = 8
+
+
+class ParticleEmitter:
+    def __init__(self, pos, capacity=1000, color=(255, 255, 255), speed=(60, 180), size=(2, 6),
+                 life=(1.0, 1.0), alpha=255, spin=0.0, rate=0.0):
+        # A source of particles. Their state is kept column-wise in one float32 array
+        # and only the first `count` columns are alive
+        self.pos = (pos[0], pos[1])
+        self.capacity = capacity
+        self.color = tuple(color)
+        self.speed = speed  # Pixels per second, (min, max)
+        self.size = size  # Radius in pixels, (min, max)
+        self.life = life  # Seconds, (min, max)
+        self.alpha = alpha  # Alpha at birth, fading linearly to 0 over the particle's life
+        self.spin = spin  # Radians per second every particle's heading turns by
+        self.rate = rate  # Particles per second emitted continuously at pos, 0 for bursts only
+
+        self.state = np.zeros((FIELDS, capacity), np.float32)
+        self.count = 0
+        self.owed = 0.0  # Fraction of a particle the rate has built up but not yet emitted
+        self.stopped = False
+
+    def emit(self, count, pos=None, room=None):
+        # Spawn up to count particles at pos (the emitter's pos by default), flying off at random angles
+        # Returns how many actually fit under the emitter's capacity and the room left in the system
+        count = min(count, self.capacity - self.count)
+        if room is not None:
+            count = min(count, room)
+        if count <= 0:
+            return 0
+        x, y = self.pos if pos is None else pos
+        spawned = self.state[:, self.count:self.count + count]
+        spawned[X] = x
+        spawned[Y] = y
+        spawned[SPEED] = np.random.uniform(self.speed[0], self.speed[1], count)
+        spawned[ANGLE] = np.random.uniform(0, 2 * np.pi, count)
+        spawned[SIZE] = np.random.uniform(self.size[0], self.size[1], count)
+        spawned[AGE] = 0
+        spawned[LIFE] = np.random.uniform(self.life[0], self.life[1], count)
+        spawned[ALPHA] = self.alpha
+        self.count += count
+        return count
+
+    def stop(self):
+        # No more particles are emitted, the emitter goes away once its last particle dies
+        self.stopped = True
+
+    @property
+    def finished(self):
+        return self.stopped and self.count == 0
+
+    def update(self, dt, room=None):
+        # Age, move, turn and fade every live particle at once, then pack the survivors together
+        if self.rate and not self.stopped:
+            self.owed += self.rate * dt
+            whole = int(self.owed)
+            self.owed -= whole
+            self.emit(whole, room=room)
+
+        live = self.state[:, :self.count]
+        if not self.count:
+            return
+        live[AGE] += dt
+        alive = live[AGE] < live[LIFE]
+        if not alive.all():
+            self.count = int(np.count_nonzero(alive))
+            self.state[:, :self.count] = live[:, alive]
+            live = self.state[:, :self.count]
+
+        distance = live[SPEED] * dt
+        live[X] += np.cos(live[ANGLE]) * distance
+        live[Y] += np.sin(live[ANGLE]) * distance
+        live[ANGLE] += self.spin * dt
+        live[ALPHA] = self.alpha * (1 - live[AGE] / live[LIFE])
+
+
+class ParticleSystem:
+    def __init__(self, maxParticles=50000, alphaLevels=16, blitLimit=1000):
+        # Every emitter in play, drawn together. maxParticles caps the live particles across all of them
+        self.emitters = []
+        self.maxParticles = maxParticles
+        self.alphaLevels = alphaLevels
+
+        # Up to blitLimit particles of a color are blitted from stamp surfaces,
+        # past that it is cheaper to stamp them all into one overlay with numpy
+        self.blitLimit = blitLimit
+
+        # Stamps are rendered once: a circle surface per (color, radius, alpha level)
+        # and the pixel offsets of a circle per radius
+        self.stampSurfaces = {}
+        self.stamps = {}
+
+        # One alpha overlay per particle color, grown to the largest area drawn so far
+        self.overlays = {}
+
+        # Counters for the last frame
+        self.drawn = 0
+        self.culled = 0
+
+    def addEmitter(self, emitter):
+        self.emitters.append(emitter)
+        return emitter
+
+    def removeEmitter(self, emitter):
+        if emitter in self.emitters:
+            self.emitters.remove(emitter)
+
+    def clear(self):
+        self.emitters.clear()
+
+    def liveCount(self):
+        return sum(emitter.count for emitter in self.emitters)
+
+    def room(self):
+        return max(0, self.maxParticles - self.liveCount())
+
+    def emit(self, emitter, count, pos=None):
+        # Burst from one of the system's emitters, within the system-wide cap
+        return emitter.emit(count, pos, self.room())
+
+    def update(self, dt):
+        # The room left under the cap is worked out once and kept up to date as each emitter
+        # spawns and loses particles, rather than summed over every emitter for each one
+        room = self.room()
+        for emitter in self.emitters:
+            before = emitter.count
+            emitter.update(dt, room)
+            room = max(0, room - (emitter.count - before))
+        self.emitters = [emitter for emitter in self.emitters if not emitter.finished]
+
+    def stampSurface(self, color, radius, level):
+        key = (color, radius, level)
+        surf = self.stampSurfaces.get(key)
+        if surf is None:
+            surf = pygame.Surface((radius * 2, radius * 2), pygame.SRCALPHA)
+            pygame.draw.circle(surf, (*color, self.levelAlpha(level)), (radius, radius), radius)
+            self.stampSurfaces[key] = surf
+        return surf
+
+    def levelAlpha(self, level):
+        return level * 255 // (self.alphaLevels - 1)
+
+    def stamp(self, radius):
+        # Rendered once with draw.circle so particles look the same as a circle drawn per particle
+        offsets = self.stamps.get(radius)
+        if offsets is None:
+            surf = pygame.Surface((radius * 2, radius * 2), pygame.SRCALPHA)
+            pygame.draw.circle(surf, (255, 255, 255, 255), (radius, radius), radius)
+            offsets = tuple(axis.astype(np.int32) for axis in np.nonzero(pygame.surfarray.pixels_alpha(surf)))
+            self.stamps[radius] = offsets
+        return offsets
+
+    def draw(self, surface, offset):
+        # Draw every particle in view, one overlay blit per color
+        offsetX = int(offset[0])
+        offsetY = int(offset[1])
+        byColor = {}
+        for emitter in self.emitters:
+            if emitter.count:
+                byColor.setdefault(emitter.color, []).append(emitter.state[:, :emitter.count])
+
+        self.drawn = 0
+        self.culled = 0
+        for color, states in byColor.items():
+            self.drawColor(surface, color, np.concatenate(states, axis=1), offsetX, offsetY)
+        return self.drawn
+
+    def drawColor(self, surface, color, live, offsetX, offsetY):
+        # Cull the particles of one color and draw the rest from stamps of their size and alpha level
+        radius = np.maximum(live[SIZE].astype(np.int32), 1)
+        left = (live[X] - offsetX).astype(np.int32) - radius
+        top = (live[Y] - offsetY).astype(np.int32) - radius
+        level = np.rint(live[ALPHA] * ((self.alphaLevels - 1) / 255)).astype(np.int32)
+
+        width, height = surface.get_size()
+        visible = (left + radius * 2 > 0) & (left < width) & (top + radius * 2 > 0) & (top < height) & (level > 0)
+        self.culled += len(visible) - int(np.count_nonzero(visible))
+        if not visible.any():
+            return
+        radius = radius[visible]
+        left = left[visible]
+        top = top[visible]
+        level = level[visible]
+        self.drawn += len(radius)
+
+        if len(radius) <= self.blitLimit:
+            stampSurface = self.stampSurface
+            surface.blits([(stampSurface(color, particleRadius, particleLevel), (x, y)) for particleRadius, particleLevel, x, y
+                           in zip(radius.tolist(), level.tolist(), left.tolist(), top.tolist())], doreturn=False)
+        else:
+            self.rasterize(surface, color, radius, left, top, level)
+
+    def rasterize(self, surface, color, radius, left, top, level):
+        # Particles are stamped into an alpha buffer with numpy instead of being blitted one at a time
+        # Buffer covering just the particles' bounds, laid out column-major like pixels_alpha
+        boundsX = int(left.min())
+        boundsY = int(top.min())
+        boundsW = int((left + radius * 2).max()) - boundsX
+        boundsH = int((top + radius * 2).max()) - boundsY
+        buffer = np.zeros(boundsW * boundsH, np.uint8)
+        corner = (left - boundsX) * boundsH + (top - boundsY)
+
+        # Group particles by (radius, alpha level) so each group is one stamp written at one alpha.
+        # Overlapping particles don't blend, the larger and more opaque group is written last
+        key = radius * self.alphaLevels + level
+        order = np.argsort(key, kind='stable')
+        key = key[order]
+        corner = corner[order]
+        starts = np.flatnonzero(np.diff(key)) + 1
+        for start, end in zip(np.concatenate(([0], starts)), np.concatenate((starts, [len(key)]))):
+            groupRadius, groupLevel = divmod(int(key[start]), self.alphaLevels)
+            stampX, stampY = self.stamp(groupRadius)
+            stampOffsets = stampX * boundsH + stampY
+            buffer[(corner[start:end, None] + stampOffsets).ravel()] = self.levelAlpha(groupLevel)
+
+        overlay = self.overlayFor(color, boundsW, boundsH)
+        region = overlay.subsurface((0, 0, boundsW, boundsH))
+        alpha = pygame.surfarray.pixels_alpha(region)
+        alpha[...] = buffer.reshape(boundsW, boundsH)
+        del alpha
+        surface.blit(region, (boundsX, boundsY))
+
+    def overlayFor(self, color, width, height):
+        overlay = self.overlays.get(color)
+        if overlay is None or overlay.get_width() < width or overlay.get_height() < height:
+            if overlay is not None:
+                width = max(width, overlay.get_width())
+                height = max(height, overlay.get_height())
+            overlay = pygame.Surface((width, height), pygame.SRCALPHA)
+            overlay.fill((*color, 0))
+            self.overlays[color] = overlay
+        return overlay
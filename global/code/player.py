@@ -1,24 +1,38 @@
 import pygame
 from constants import *
 from level import *
+from assetCache import assets
+from collision import MaskCollider, getMask
+from simClock import simClock
+from inputSource import inputs
 
 
 class Player(pygame.sprite.Sprite):
+    imagePath = '../graphics/test/player.png'
+
     def __init__(self, pos, groups, obstacleSprites, wallMask, level):
         super().__init__(groups)
-        self.image = pygame.image.load('../graphics/test/player.png').convert_alpha()
+        # With no display (a headless level) the image can't be converted, it's only used for its size and mask
+        self.imageConvert = None if level.headless else 'alpha'
+        self.image = assets.load(self.imagePath, convert=self.imageConvert)
         self.rect = self.image.get_rect(topleft=pos)
         self.hitbox = self.rect.inflate(0, 0)  # Shrinks hitbox vertically
-        self.mask = pygame.mask.from_surface(self.image)
+        self.mask = getMask(self.image)
+
+        # The hitbox is where the simulation has the player, rect is where the player is drawn
+        # pos keeps the fraction of a pixel the hitbox can't, previousPos is pos one step ago
+        self.pos = pygame.math.Vector2(self.hitbox.topleft)
+        self.previousPos = pygame.math.Vector2(self.pos)
 
         self.direction = pygame.math.Vector2()
-        self.speed = 5
+        self.speed = PLAYERSPEED  # Pixels per second
         self.obstacleSprites = obstacleSprites
         self.wallMask = wallMask  # Pass the wall mask from the camera group
+        self.collider = MaskCollider(wallMask)
         self.level = level
 
     def input(self):
-        keys = pygame.key.get_pressed()
+        keys = inputs.pressed()
 
         if keys[pygame.K_w]:
             self.direction.y = -1
@@ -33,74 +47,29 @@ class Player(pygame.sprite.Sprite):
         else:
             self.direction.x = 0
 
-    def move(self, speed):
+    def move(self, distance):
+        # The camera the player is kept inside is the one centered on them before this step
+        camera_offset = self.level.visibleSprites.cameraOffset(self.hitbox.center)
+
         if self.direction.magnitude() != 0:
             self.direction = self.direction.normalize()
 
-            # Move horizontally
-            self.hitbox.x += self.direction.x * speed
-            self.rect.x = self.hitbox.x
-            self.collision("horizontal")
-
-            # Move vertically
-            self.hitbox.y += self.direction.y * speed
-            self.rect.y = self.hitbox.y
-            self.collision("vertical")
-        self.checkCameraBoundaries()
-
-    def collision(self, direction):
-        MAX_ATTEMPTS = 10  # Safety limit to prevent infinite loops
-        playerMask = pygame.mask.from_surface(self.image)
-
-        # Check for collision
-        collisionPoint = self.wallMask.overlap(playerMask, (self.rect.x, self.rect.y))
-
-        if collisionPoint:
-            attempts = 0
-            if direction == "horizontal":
-                if self.direction.x > 0:  # Moving right
-                    # Move player to the left of the wall
-                    while (self.wallMask.overlap(playerMask, (self.rect.x, self.rect.y))
-                           and attempts < MAX_ATTEMPTS):
-                        self.hitbox.x -= 1
-                        self.rect.x -= 1
-                        attempts += 1
-                elif self.direction.x < 0:  # Moving left
-                    # Move player to the right of the wall
-                    while (self.wallMask.overlap(playerMask, (self.rect.x, self.rect.y))
-                           and attempts < MAX_ATTEMPTS):
-                        self.hitbox.x += 1
-                        self.rect.x += 1
-                        attempts += 1
-
-            if direction == "vertical":
-                if self.direction.y > 0:  # Moving down
-                    # Move player up
-                    while (self.wallMask.overlap(playerMask, (self.rect.x, self.rect.y))
-                           and attempts < MAX_ATTEMPTS):
-                        self.hitbox.y -= 1
-                        self.rect.y -= 1
-                        attempts += 1
-                elif self.direction.y < 0:  # Moving up
-                    # Move player down
-                    while (self.wallMask.overlap(playerMask, (self.rect.x, self.rect.y))
-                           and attempts < MAX_ATTEMPTS):
-                        self.hitbox.y += 1
-                        self.rect.y += 1
-                        attempts += 1
-
-            # If we hit the max attempts, reset to previous position
-            if attempts >= MAX_ATTEMPTS:
-                if direction == "horizontal":
-                    self.hitbox.x -= self.direction.x * self.speed
-                    self.rect.x = self.hitbox.x
-                else:
-                    self.hitbox.y -= self.direction.y * self.speed
-                    self.rect.y = self.hitbox.y
-
-    def checkCameraBoundaries(self):
-        # Get the camera offset from the YSortCameraGroup
-        camera_offset = self.level.visibleSprites.offset
+            # Work out the whole pixel step on each axis from the exact position
+            targetX = self.pos.x + self.direction.x * distance
+            targetY = self.pos.y + self.direction.y * distance
+            dx = int(targetX) - self.hitbox.x
+            dy = int(targetY) - self.hitbox.y
+
+            # Move as far as the walls allow, sliding along them on a diagonal
+            x, y = self.collider.move(self.mask, self.hitbox.x, self.hitbox.y, dx, dy)
+
+            # An axis a wall stopped loses its fraction, the other keeps moving smoothly
+            self.pos.x = targetX if x == self.hitbox.x + dx else x
+            self.pos.y = targetY if y == self.hitbox.y + dy else y
+            self.hitbox.topleft = (x, y)
+        self.checkCameraBoundaries(camera_offset)
+
+    def checkCameraBoundaries(self, camera_offset):
 
         # Get the screen dimensions
         screen_width = self.level.visibleSprites.screenWidth
@@ -117,9 +86,30 @@ class Player(pygame.sprite.Sprite):
         max_y = min_y + original_height - screen_height
 
         # Clamp the player's position within the boundaries
+        topleft = self.hitbox.topleft
         self.hitbox.clamp_ip(pygame.Rect(min_x, min_y, screen_width, screen_height))
-        self.rect.topleft = self.hitbox.topleft
+        if self.hitbox.topleft != topleft:
+            self.pos.update(self.hitbox.topleft)
+
+    def setPosition(self, topleft):
+        # Put the player somewhere directly, with nothing to interpolate from
+        self.hitbox.topleft = topleft
+        self.rect.topleft = topleft
+        self.pos.update(topleft)
+        self.previousPos.update(topleft)
+
+    def interpolate(self, alpha):
+        # Place rect between the last two simulation steps for drawing
+        x = self.previousPos.x + (self.pos.x - self.previousPos.x) * alpha
+        y = self.previousPos.y + (self.pos.y - self.previousPos.y) * alpha
+        self.rect.topleft = (int(x), int(y))
+
+    def releaseAssets(self):
+        # Called by the level when this player is replaced on a map load
+        assets.release(self.imagePath, convert=self.imageConvert)
 
     def update(self):
+        # One simulation step
+        self.previousPos.update(self.pos)
         self.input()
-        self.move(self.speed)
\ No newline at end of file
+        self.move(self.speed * simClock.step)
\ No newline at end of file
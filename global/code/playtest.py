@@ -0,0 +1,411 @@
+import io
+import os
+import sys
+import json
+import time
+import argparse
+import traceback
+import contextlib
+import multiprocessing
+from collections import deque
+
+# Run without opening a real window or sound device
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+
+import pygame
+from constants import *
+
+
+# Plays the game headlessly to check every build: every option of every NPC's dialog is chosen
+# along the shortest path of options to it and checked against the dialog's compiled tables,
+# the actions (map transitions and the portal) have to finish where they should, and the player
+# has to be able to walk from where they enter each map to every NPC on it.
+# Every check is a job run on its own fresh headless Level, so jobs are spread over a process pool.
+# A job is (kind, map name, NPC name, details): details are (option path, option) for a dialog job
+# and (entry name, entry position) for a route job
+
+# Where the player enters each map: the arrival point of each transition action,
+# and the map's playerSpawn for the map a new game starts on
+startMap = 'crypt'
+entryPoints = {
+    'crypt': [('fromTown', (1214, 168))],
+    'town': [('fromCrypt', (2630, 650))],
+}
+
+# Where each action has to leave the player
+actionMaps = {'transition_town': 'town', 'transition_crypt': 'crypt'}
+
+routeGrid = 12  # Size in pixels of the cells the route search walks between
+stuckSteps = 30  # Steps without moving before a walk counts as stuck
+
+
+class PlaytestError(Exception):
+    # A check that failed, the message says where and how
+    pass
+
+
+def quiet():
+    # The game prints debug lines as it plays, a worker keeps them out of the report
+    return contextlib.redirect_stdout(io.StringIO())
+
+
+def freshLevel(mapName):
+    from level import Level
+    from inputSource import inputs
+    inputs.hold(())
+    level = Level(headless=True)
+    if level.currentMap != mapName:
+        level.currentMap = mapName
+        level.loadMap(mapName)
+    return level
+
+
+def findNpc(level, name):
+    for npc in level.npcs:
+        if npc.name == name:
+            return npc
+    raise PlaytestError(f"no NPC '{name}' on {level.currentMap}")
+
+
+def tickUntil(level, done, seconds, what):
+    # Step the level until done() or seconds of game time have passed
+    for _ in range(int(seconds * SIMRATE)):
+        if done():
+            return
+        level.update()
+    if not done():
+        raise PlaytestError(f"{what} didn't happen within {seconds:.0f} s")
+
+
+def pressKey(level, key):
+    level.dialogSystem.handleInput(pygame.event.Event(pygame.KEYDOWN, key=key))
+
+
+def talkTo(level, npc):
+    # Hold E for one step next to the NPC, the way a player starts a conversation
+    from inputSource import inputs
+    dialog = level.dialogSystem
+    inputs.hold((pygame.K_e,))
+    level.update()
+    inputs.hold(())
+    if not dialog.active or dialog.currentNpc is not npc:
+        raise PlaytestError(f"pressing E next to {npc.name} didn't start its dialog")
+
+
+def waitForOptions(level):
+    # Let the typewriter finish the response at its own speed
+    dialog = level.dialogSystem
+    seconds = len(dialog.fullResponse) / dialog.charDisplaySpeed + 1
+    tickUntil(level, lambda: dialog.showOptions, seconds, "the options showing")
+
+
+def chooseOption(level, optionIndex):
+    dialog = level.dialogSystem
+    waitForOptions(level)
+    for _ in range(optionIndex):
+        pressKey(level, pygame.K_DOWN)
+    if dialog.selectedOption != optionIndex:
+        raise PlaytestError(f"option {optionIndex + 1} couldn't be selected")
+    pressKey(level, pygame.K_RETURN)
+
+
+def dialogJob(level, npc, path, optionIndex):
+    # Follow path (option indices from the start state) then choose optionIndex,
+    # checking the dialog shows what the tree says at every step
+    tree = npc.dialogs
+    dialog = level.dialogSystem
+    state = tree.start
+    level.player.setPosition((npc.rect.centerx - level.player.hitbox.width // 2,
+                              npc.rect.centery - level.player.hitbox.height // 2))
+    talkTo(level, npc)
+    for step in path:
+        response, state, action = tree.choose(state, step)
+        chooseOption(level, step)
+        if dialog.currentOptions != tree.optionsFor(state) or dialog.fullResponse != response:
+            raise PlaytestError(f"reaching '{tree.stateNames[state]}' showed the wrong response or options")
+
+    response, nextState, action = tree.choose(state, optionIndex)
+    chooseOption(level, optionIndex)
+    if action in actionMaps:
+        if not level.inTransition:
+            raise PlaytestError(f"{action} didn't start a transition")
+        tickUntil(level, lambda: not level.inTransition, level.transitionDuration / 1000 + 5, action)
+        if level.currentMap != actionMaps[action] or level.visibleSprites.currentMap != actionMaps[action]:
+            raise PlaytestError(f"{action} ended on {level.currentMap}")
+        return f"arrived in {level.currentMap}"
+    if action == 'portal_animation':
+        if not level.inWinAnimation:
+            raise PlaytestError(f"{action} didn't start the win animation")
+        tickUntil(level, lambda: not level.inWinAnimation, level.winAnimationDuration / 1000 + 5, action)
+        return "win animation finished"
+    if nextState < 0:
+        if dialog.active:
+            raise PlaytestError("the conversation should have ended")
+        return "conversation ended"
+    if not dialog.active or dialog.currentOptions != tree.optionsFor(nextState) or dialog.fullResponse != response:
+        raise PlaytestError(f"choosing it didn't show '{tree.stateNames[nextState]}'")
+    waitForOptions(level)
+    return f"showed '{tree.stateNames[nextState]}'"
+
+
+def findRoute(level, npc):
+    # Breadth first search over routeGrid cells the player fits in, from where the player stands
+    # to a cell where npc is the nearest NPC in reach. Returns the hitbox positions to walk through
+    player = level.player
+    wallMask = level.visibleSprites.wallMask
+    columns = wallMask.get_size()[0] // routeGrid
+    rows = wallMask.get_size()[1] // routeGrid
+    halfWidth, halfHeight = player.hitbox.width // 2, player.hitbox.height // 2
+    reach = (npc.interactionRadius - routeGrid) ** 2
+    others = [other for other in level.npcs if other is not npc]
+
+    def arrived(cell):
+        x, y = cell[0] * routeGrid + halfWidth, cell[1] * routeGrid + halfHeight
+        distance = (npc.rect.centerx - x) ** 2 + (npc.rect.centery - y) ** 2
+        return distance <= reach and all((other.rect.centerx - x) ** 2 + (other.rect.centery - y) ** 2 > distance
+                                         for other in others)
+
+    start = (player.hitbox.x // routeGrid, player.hitbox.y // routeGrid)
+    previous = {start: None}
+    waiting = deque([start])
+    while waiting:
+        cell = waiting.popleft()
+        if arrived(cell):
+            route = []
+            while cell is not None:
+                route.append((cell[0] * routeGrid, cell[1] * routeGrid))
+                cell = previous[cell]
+            return route[::-1]
+        for dx, dy in ((1, 0), (-1, 0), (0, 1), (0, -1)):
+            nextCell = (cell[0] + dx, cell[1] + dy)
+            if (nextCell not in previous and 0 <= nextCell[0] < columns and 0 <= nextCell[1] < rows
+                    and wallMask.overlap(player.mask, (nextCell[0] * routeGrid, nextCell[1] * routeGrid)) is None):
+                previous[nextCell] = cell
+                waiting.append(nextCell)
+    raise PlaytestError(f"no way through the walls to {npc.name}")
+
+
+def walkTo(level, waypoint):
+    # Hold the movement keys towards waypoint until the player's hitbox is there
+    from inputSource import inputs
+    hitbox = level.player.hitbox
+    stuck = 0
+    while abs(waypoint[0] - hitbox.x) > 3 or abs(waypoint[1] - hitbox.y) > 3:
+        dx, dy = waypoint[0] - hitbox.x, waypoint[1] - hitbox.y
+        keys = []
+        if dx:
+            keys.append(pygame.K_d if dx > 0 else pygame.K_a)
+        if dy:
+            keys.append(pygame.K_s if dy > 0 else pygame.K_w)
+        inputs.hold(keys)
+        before = hitbox.topleft
+        level.update()
+        stuck = stuck + 1 if hitbox.topleft == before else 0
+        if stuck > stuckSteps:
+            inputs.hold(())
+            raise PlaytestError(f"stuck at {hitbox.topleft} walking to {waypoint}")
+    inputs.hold(())
+
+
+def routeJob(level, npc, entryPosition):
+    # Walk from where the player enters the map to the NPC and start its dialog
+    level.player.setPosition(entryPosition)
+    route = findRoute(level, npc)
+    for waypoint in route:
+        walkTo(level, waypoint)
+    talkTo(level, npc)
+    return f"walked {len(route)} cells"
+
+
+def runJob(job):
+    # Run one check on a fresh level. Returns a result dict, a failed check has its reason in 'detail'
+    from simClock import simClock
+    kind, mapName, npcName, details = job
+    startSteps = simClock.steps
+    start = time.perf_counter()
+    level = None
+    try:
+        with quiet():
+            level = freshLevel(mapName)
+            npc = findNpc(level, npcName)
+            if kind == 'dialog':
+                detail = dialogJob(level, npc, *details)
+            else:
+                detail = routeJob(level, npc, details[1])
+        ok = True
+    except PlaytestError as error:
+        ok, detail = False, str(error)
+    except Exception:
+        # The game itself crashed: that job fails with the traceback, the rest of the farm carries on
+        ok, detail = False, traceback.format_exc()
+    finally:
+        if level is not None:
+            level.close()
+    return {
+        'job': [kind, mapName, npcName, list(details)],
+        'ok': ok,
+        'detail': detail,
+        'ticks': simClock.steps - startSteps,
+        'seconds': time.perf_counter() - start,
+        'worker': os.getpid(),
+    }
+
+
+def startWorker():
+    # Build what every level shares (sprite atlas, collision masks, dialog trees) before timing any job
+    with quiet():
+        freshLevel('town').close()
+
+
+def shortestPaths(tree):
+    # The option indices that lead from the start state to each state the dialog can reach
+    paths = {tree.start: []}
+    waiting = deque([tree.start])
+    while waiting:
+        state = waiting.popleft()
+        for optionIndex in range(len(tree.optionsFor(state))):
+            _, nextState, action = tree.choose(state, optionIndex)
+            # Choosing an option with an action leaves the conversation whatever its next state says
+            if action is None and nextState >= 0 and nextState not in paths:
+                paths[nextState] = paths[state] + [optionIndex]
+                waiting.append(nextState)
+    return paths
+
+
+def deadEnds(tree):
+    # States that show no options, and states with no chain of options out of the conversation
+    empty = [state for state in range(len(tree.stateNames)) if not tree.optionsFor(state)]
+    canLeave = set()
+    changed = True
+    while changed:
+        changed = False
+        for state in range(len(tree.stateNames)):
+            if state in canLeave:
+                continue
+            for optionIndex in range(len(tree.optionsFor(state))):
+                _, nextState, action = tree.choose(state, optionIndex)
+                if action is not None or nextState < 0 or nextState in canLeave:
+                    canLeave.add(state)
+                    changed = True
+                    break
+    trapped = [state for state in range(len(tree.stateNames)) if state not in canLeave and state not in empty]
+    return [tree.stateNames[state] for state in empty], [tree.stateNames[state] for state in trapped]
+
+
+def planJobs():
+    # Every NPC on every map, from the maps as the game loads them, and the jobs that check them
+    jobs = []
+    npcs = {}
+    with quiet():
+        for mapName in entryPoints:
+            level = freshLevel(mapName)
+            for npc in sorted(level.npcs, key=lambda npc: npc.name):
+                npcs[npc.name] = (mapName, npc.dialogs)
+                paths = shortestPaths(npc.dialogs)
+                for state, path in paths.items():
+                    for optionIndex in range(len(npc.dialogs.optionsFor(state))):
+                        jobs.append(('dialog', mapName, npc.name, (path, optionIndex)))
+                entries = list(entryPoints[mapName])
+                if mapName == startMap:
+                    entries.insert(0, ('spawn', level.mapData[mapName]['playerSpawn']))
+                for entryName, position in entries:
+                    jobs.append(('route', mapName, npc.name, (entryName, position)))
+            level.close()
+    return jobs, npcs
+
+
+def report(results, npcs, workers, wallSeconds):
+    # Coverage per NPC, failures, and how fast each worker ran. Returns the report as a dict
+    summary = {'npcs': {}, 'failures': [], 'workers': {}}
+    for name, (mapName, tree) in npcs.items():
+        edges = sum(len(tree.optionsFor(state)) for state in range(len(tree.stateNames)))
+        passed = [result for result in results if result['ok'] and result['job'][0] == 'dialog'
+                  and result['job'][2] == name]
+        shown = {tree.start}
+        for result in passed:
+            path, optionIndex = result['job'][3]
+            state = tree.start
+            for step in path + [optionIndex]:
+                _, nextState, action = tree.choose(state, step)
+                if action is not None or nextState < 0:
+                    break
+                state = nextState
+                shown.add(state)
+        empty, trapped = deadEnds(tree)
+        summary['npcs'][name] = {
+            'map': mapName,
+            'optionsChecked': len({(tuple(result['job'][3][0]), result['job'][3][1]) for result in passed}),
+            'options': edges,
+            'statesShown': len(shown),
+            'states': len(tree.stateNames),
+            'neverShown': [tree.stateNames[state] for state in range(len(tree.stateNames)) if state not in shown],
+            'noOptions': empty,
+            'noWayOut': trapped,
+        }
+    for result in results:
+        if not result['ok']:
+            summary['failures'].append(result)
+        worker = summary['workers'].setdefault(result['worker'], {'jobs': 0, 'ticks': 0, 'seconds': 0.0})
+        worker['jobs'] += 1
+        worker['ticks'] += result['ticks']
+        worker['seconds'] += result['seconds']
+
+    print(f"{'npc':<10} {'map':<6} {'options':>9} {'states':>8}  problems")
+    for name, npc in summary['npcs'].items():
+        problems = []
+        if npc['neverShown']:
+            problems.append(f"never shown: {', '.join(npc['neverShown'])}")
+        if npc['noOptions']:
+            problems.append(f"no options: {', '.join(npc['noOptions'])}")
+        if npc['noWayOut']:
+            problems.append(f"no way out: {', '.join(npc['noWayOut'])}")
+        print(f"{name:<10} {npc['map']:<6} {npc['optionsChecked']:>4}/{npc['options']:<4} "
+              f"{npc['statesShown']:>3}/{npc['states']:<4} {'; '.join(problems)}")
+    for failure in summary['failures']:
+        kind, mapName, npcName, details = failure['job']
+        print(f"FAILED {kind} {mapName}/{npcName} {details}: {failure['detail']}")
+
+    totalTicks = sum(result['ticks'] for result in results)
+    print(f"{'worker':>8} {'jobs':>6} {'ticks':>9} {'ticks/s':>9}")
+    for pid, worker in sorted(summary['workers'].items()):
+        worker['ticksPerSecond'] = worker['ticks'] / worker['seconds'] if worker['seconds'] else 0.0
+        print(f"{pid:>8} {worker['jobs']:>6} {worker['ticks']:>9} {worker['ticksPerSecond']:>9.0f}")
+    summary['total'] = {
+        'jobs': len(results),
+        'failed': len(summary['failures']),
+        'workers': workers,
+        'ticks': totalTicks,
+        'seconds': wallSeconds,
+        'ticksPerSecond': totalTicks / wallSeconds if wallSeconds else 0.0,
+    }
+    print(f"{len(results)} jobs, {len(summary['failures'])} failed, {totalTicks} ticks in {wallSeconds:.2f} s "
+          f"on {workers} workers ({summary['total']['ticksPerSecond']:.0f} ticks/s)")
+    return summary
+
+
+def runPlaytest(workers, repeat=1):
+    jobs, npcs = planJobs()
+    jobs = jobs * repeat
+    # A few chunks per worker keeps every worker busy to the end without a round trip per job
+    chunkSize = max(1, len(jobs) // (workers * 4))
+    start = time.perf_counter()
+    with multiprocessing.Pool(workers, initializer=startWorker) as pool:
+        results = list(pool.imap_unordered(runJob, jobs, chunkSize))
+    return report(results, npcs, workers, time.perf_counter() - start)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Play every dialog option, action and route headlessly')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='processes to spread the jobs over')
+    parser.add_argument('--repeat', type=int, default=1, help='run every job this many times, to measure throughput')
+    parser.add_argument('--out', help='write the report as JSON to this file')
+    args = parser.parse_args()
+
+    summary = runPlaytest(max(1, args.workers), max(1, args.repeat))
+    if args.out:
+        with open(args.out, 'w') as file:
+            json.dump(summary, file, indent=2)
+        print(f"Wrote the report to {args.out}")
+    if summary['failures']:
+        sys.exit(1)
@@ -0,0 +1,197 @@
+import os
+import json
+import time
+import numpy as np
+import pygame
+from textCache import textCache
+
+
+class PhaseTimer:
+    def __init__(self, profiler, column):
+        # One per phase, reused every frame so timing a phase allocates nothing
+        self.profiler = profiler
+        self.column = column
+        self.start = 0
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter_ns()
+        profiler = self.profiler
+        row = profiler.row
+        start = self.start - profiler.frameStarts[row]
+        if profiler.starts[row, self.column] < 0:
+            profiler.starts[row, self.column] = start
+        profiler.durations[row, self.column] += end - self.start
+
+        # Each run is also kept on its own for the trace: a phase run twice in a frame (an update
+        # at two simulation steps) would otherwise become one event spanning whatever ran between
+        count = profiler.runCounts[row]
+        if count < profiler.runs.shape[1]:
+            runs = profiler.runs[row, count]
+            runs[0] = self.column
+            runs[1] = start
+            runs[2] = end - self.start
+            profiler.runCounts[row] = count + 1
+        return False
+
+
+class NullPhase:
+    # Stands in for a PhaseTimer while profiling is off
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+nullPhase = NullPhase()
+
+
+class FrameProfiler:
+    def __init__(self, capacity=600, maxPhases=16, maxRuns=256, traceDir='../profiles'):
+        # Times named phases of each frame into a ring buffer of the last `capacity` frames
+        self.enabled = os.environ.get('PROFILE') == '1'
+        self.showOverlay = self.enabled
+        self.capacity = capacity
+        self.traceDir = traceDir
+
+        self.phases = []  # Phase names, in column order
+        self.timers = {}  # name -> PhaseTimer
+
+        # Nanoseconds. A phase's start is relative to its frame's start, -1 marks a phase that didn't run.
+        # durations sums every run of a phase in the frame
+        self.frameStarts = np.zeros(capacity, np.int64)
+        self.frameDurations = np.full(capacity, -1, np.int64)
+        self.starts = np.full((capacity, maxPhases), -1, np.int64)
+        self.durations = np.zeros((capacity, maxPhases), np.int64)
+        # Every run of a phase in order as (column, start, duration), up to maxRuns a frame, for the trace
+        self.runs = np.zeros((capacity, maxRuns, 3), np.int64)
+        self.runCounts = np.zeros(capacity, np.int64)
+        self.frames = 0  # Frames recorded so far
+        self.row = 0
+        self.recording = False  # Between beginFrame and endFrame of a profiled frame
+
+        # Overlay text is only remade a few times a second
+        self.overlayEvery = 30
+        self.overlayCells = []  # (surface, position) for every piece of text in the table
+        self.overlaySize = (0, 0)
+        self.overlayBackground = None  # Remade only when the table changes size
+
+    def toggle(self):
+        self.enabled = not self.enabled
+        self.showOverlay = self.enabled
+
+    def phase(self, name):
+        # with profiler.phase('name'): ... times the block as part of the current frame
+        if not self.recording:
+            return nullPhase
+        timer = self.timers.get(name)
+        if timer is None:
+            if len(self.phases) == self.starts.shape[1]:
+                return nullPhase
+            timer = PhaseTimer(self, len(self.phases))
+            self.phases.append(name)
+            self.timers[name] = timer
+        return timer
+
+    def beginFrame(self):
+        self.recording = self.enabled
+        if not self.recording:
+            return
+        self.row = self.frames % self.capacity
+        self.frameStarts[self.row] = time.perf_counter_ns()
+        self.frameDurations[self.row] = -1
+        self.starts[self.row] = -1
+        self.durations[self.row] = 0
+        self.runCounts[self.row] = 0
+
+    def endFrame(self):
+        if not self.recording:
+            return
+        self.recording = False
+        self.frameDurations[self.row] = time.perf_counter_ns() - self.frameStarts[self.row]
+        self.frames += 1
+
+    def recordedRows(self, frames=None):
+        # Ring buffer rows of the last `frames` complete frames, oldest first
+        count = min(self.frames, self.capacity)
+        if frames is not None:
+            count = min(count, frames)
+        first = self.frames - count
+        return np.arange(first, self.frames) % self.capacity
+
+    def percentiles(self):
+        # name -> (p50, p95, p99) in milliseconds over the buffered frames, 'frame' is the whole frame
+        rows = self.recordedRows()
+        results = {}
+        if not len(rows):
+            return results
+        columns = [('frame', self.frameDurations[rows])]
+        for column, name in enumerate(self.phases):
+            ran = self.starts[rows, column] >= 0
+            columns.append((name, self.durations[rows, column][ran]))
+        for name, values in columns:
+            if len(values):
+                results[name] = tuple(float(value) / 1e6 for value in np.percentile(values, (50, 95, 99)))
+        return results
+
+    def drawOverlay(self, surface):
+        if not (self.enabled and self.showOverlay):
+            return
+        if self.frames % self.overlayEvery == 0 or not self.overlayCells:
+            self.layoutOverlay()
+
+        surface.blit(self.overlayBackground, (8, 8))
+        surface.blits(self.overlayCells, doreturn=False)
+
+    def layoutOverlay(self):
+        # A table of phase name and p50/p95/p99 columns, numbers right aligned
+        font = textCache.getFont(None, 22)
+        rows = [('phase (ms)', 'p50', 'p95', 'p99')]
+        for name, values in self.percentiles().items():
+            rows.append((name,) + tuple(f"{value:.2f}" for value in values))
+
+        self.overlayCells = []
+        nameWidth = 150
+        columnWidth = 60
+        for index, row in enumerate(rows):
+            y = 14 + index * 20
+            # Rendered directly, numbers that change every refresh would only churn the text cache
+            self.overlayCells.append((font.render(row[0], True, (255, 255, 0)), (16, y)))
+            for column, text in enumerate(row[1:]):
+                cell = font.render(text, True, (255, 255, 0))
+                self.overlayCells.append((cell, (16 + nameWidth + (column + 1) * columnWidth - cell.get_width(), y)))
+        size = (nameWidth + 3 * columnWidth + 16, len(rows) * 20 + 12)
+        if size != self.overlaySize or self.overlayBackground is None:
+            self.overlaySize = size
+            self.overlayBackground = pygame.Surface(size)
+            self.overlayBackground.set_alpha(160)
+
+    def chromeTrace(self, frames=None):
+        # The last `frames` frames as Chrome trace events (chrome://tracing, Perfetto), times in microseconds
+        events = []
+        for row in self.recordedRows(frames):
+            frameStart = int(self.frameStarts[row])
+            events.append({'name': 'frame', 'ph': 'X', 'pid': 1, 'tid': 1,
+                           'ts': frameStart / 1000, 'dur': int(self.frameDurations[row]) / 1000})
+            for column, start, duration in self.runs[row, :self.runCounts[row]].tolist():
+                events.append({'name': self.phases[column], 'ph': 'X', 'pid': 1, 'tid': 1,
+                               'ts': (frameStart + start) / 1000, 'dur': duration / 1000})
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def dumpTrace(self, frames=None):
+        # Write the trace to traceDir and return its path
+        trace = self.chromeTrace(frames)
+        os.makedirs(self.traceDir, exist_ok=True)
+        path = os.path.join(self.traceDir, time.strftime('trace-%Y%m%d-%H%M%S.json'))
+        with open(path, 'w') as file:
+            json.dump(trace, file)
+        print(f"Wrote {len(self.recordedRows(frames))} frames to {path}")
+        return path
+
+
+# One profiler for the whole game loop. F3 toggles it (or start with PROFILE=1), F4 dumps a trace
+profiler = FrameProfiler()
@@ -0,0 +1,117 @@
+import bisect
+from operator import attrgetter
+import pygame
+
+
+getRect = attrgetter('rect')
+getSortKey = attrgetter('rect.centery')
+
+
+class RenderQueue:
+    def __init__(self):
+        # Sprites kept in draw order (by rect.centery) with the key each was sorted on alongside
+        self.order = []
+        self.keys = []
+
+        # Sprites join the order on the next draw, by then they have a rect to sort on
+        # and removed sprites are dropped in one pass. added is a dict for its order and quick removal
+        self.added = {}
+        self.removed = set()
+
+        # Counters for the last frame
+        self.submitted = 0
+        self.culled = 0
+
+        # What each sprite on screen looked like last time changedRects was asked: sprite -> (image, screen rect)
+        self.lastOnScreen = {}
+
+    def add(self, sprite):
+        if sprite in self.removed:
+            # Taken out and put back before the next draw, it is still in the order
+            self.removed.discard(sprite)
+            return
+        self.added[sprite] = None
+
+    def insert(self, sprite):
+        key = sprite.rect.centery
+        index = bisect.bisect_right(self.keys, key)
+        self.order.insert(index, sprite)
+        self.keys.insert(index, key)
+
+    def remove(self, sprite):
+        if sprite in self.added:
+            del self.added[sprite]
+        else:
+            self.removed.add(sprite)
+
+    def clear(self):
+        self.order.clear()
+        self.keys.clear()
+        self.added.clear()
+        self.removed.clear()
+
+    def updateOrder(self):
+        if self.removed:
+            kept = [index for index, sprite in enumerate(self.order) if sprite not in self.removed]
+            self.order = [self.order[index] for index in kept]
+            self.keys = [self.keys[index] for index in kept]
+            self.removed.clear()
+        for sprite in self.added:
+            self.insert(sprite)
+        self.added.clear()
+
+        # Only the sprites whose centery changed since they were sorted are out of place:
+        # they are taken out and put back where their new key goes, everything else stays put
+        moved = [index for index, (sprite, key) in enumerate(zip(self.order, self.keys))
+                 if getSortKey(sprite) != key]
+        movedSprites = []
+        for index in reversed(moved):
+            movedSprites.append(self.order.pop(index))
+            del self.keys[index]
+        for sprite in reversed(movedSprites):
+            self.insert(sprite)
+
+    def changedRects(self, surface, offset):
+        # Screen rects of every sprite that appeared, vanished, moved or changed image since the last call
+        self.updateOrder()
+        offsetX = int(offset[0])
+        offsetY = int(offset[1])
+        viewport = pygame.Rect(offsetX, offsetY, surface.get_width(), surface.get_height())
+
+        onScreen = {}
+        for index in viewport.collidelistall(list(map(getRect, self.order))):
+            sprite = self.order[index]
+            if sprite.image is not None:
+                onScreen[sprite] = (sprite.image, sprite.rect.move(-offsetX, -offsetY))
+
+        changed = []
+        for sprite, (image, rect) in onScreen.items():
+            last = self.lastOnScreen.get(sprite)
+            if last is None or last[0] is not image or last[1] != rect:
+                changed.append(rect)
+                if last is not None:
+                    changed.append(last[1])
+        for sprite, (image, rect) in self.lastOnScreen.items():
+            if sprite not in onScreen:
+                changed.append(rect)
+        self.lastOnScreen = onScreen
+        return changed
+
+    def draw(self, surface, offset):
+        # Draw everything inside the view in Y order with one blits call
+        self.updateOrder()
+        offsetX = int(offset[0])
+        offsetY = int(offset[1])
+        viewport = pygame.Rect(offsetX, offsetY, surface.get_width(), surface.get_height())
+
+        visible = viewport.collidelistall(list(map(getRect, self.order)))
+        blitList = []
+        for index in visible:
+            sprite = self.order[index]
+            if sprite.image is not None:
+                blitList.append((sprite.image, (sprite.rect.x - offsetX, sprite.rect.y - offsetY)))
+        surface.blits(blitList, doreturn=False)
+
+        self.submitted = len(blitList)
+        self.culled = len(self.order) - self.submitted
+        return self.submitted
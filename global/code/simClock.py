@@ -0,0 +1,23 @@
+from constants import *
+
+
+class SimClock:
+    def __init__(self, rate=SIMRATE):
+        # Game time, moved on only by whole simulation steps so gameplay never depends on the frame rate
+        self.rate = rate
+        self.step = 1 / rate  # Seconds per step
+        self.steps = 0
+
+        # Longest stretch of real time one frame may add, so a long stall doesn't turn into a burst of steps
+        self.maxFrameTime = 0.25
+
+    def advance(self):
+        self.steps += 1
+
+    def now(self):
+        # Milliseconds of game time, a stand-in for pygame.time.get_ticks in gameplay code
+        return self.steps * 1000 / self.rate
+
+
+# The one clock the level, the dialog and the game loop share
+simClock = SimClock()
@@ -1,34 +1,138 @@
+import wave
+from collections import OrderedDict
 import pygame
+from ambient import AmbientPlayer
+from voices import VoiceManager
 
 
-class SoundManager:
-    def __init__(self):
-        # Initialize mixer
-        pygame.mixer.init()
+# Every sound the game can play, by name. Nothing is decoded until it is first played
+soundPaths = {
+    # Dialog sounds
+    # 'typing': '../audio/sfx/typing.wav',
+    'dialogOpen': '../audio/sfx/dialogOpen.wav',
+    'dialogClose': '../audio/sfx/dialogClose.wav',
+    'dialogSelect': '../audio/sfx/dialogSelect.wav',
+
+    # Map transition
+    'transition': '../audio/sfx/transition.wav',
+
+    #Portal
+    'portalOpen': '../audio/sfx/portalOpen.wav',
+
+    #Intro
+    'intro': '../audio/sfx/Intro.wav'
+}
+
+# Ambient loop for each map, streamed from disk rather than decoded into the sound bank
+ambientPaths = {
+    'crypt': '../audio/ambient/cryptAmbient.wav',
+    'town': '../audio/ambient/townAmbient.wav',
+}
+
+
+class SoundBank:
+    def __init__(self, paths, byteBudget=32 * 1024 * 1024):
+        # Decodes a sound the first time it is asked for and keeps it while there is room,
+        # sounds that aren't playing are unloaded least recently used first once over byteBudget
+        self.paths = dict(paths)
+        self.byteBudget = byteBudget
+        self.loaded = OrderedDict()  # name -> (Sound, decoded bytes), least recently used first
+        self.volumes = {}  # name -> volume applied whenever the sound is decoded
+        self.missing = set()  # Names whose file is missing or unreadable, only reported once
+        self.residentBytes = 0
+
+        # Counters for stats()
+        self.hits = 0
+        self.loads = 0
+        self.unloads = 0
+
+    def get(self, name):
+        # The decoded sound, or None if there is no such sound or its file can't be read
+        entry = self.loaded.get(name)
+        if entry is not None:
+            self.hits += 1
+            self.loaded.move_to_end(name)
+            return entry[0]
+        if name not in self.paths or name in self.missing:
+            return None
+
+        try:
+            sound = pygame.mixer.Sound(self.paths[name])
+        except (FileNotFoundError, pygame.error) as error:
+            self.missing.add(name)
+            print(f"Sound '{name}' unavailable: {error}")
+            return None
+        self.loads += 1
+        if name in self.volumes:
+            sound.set_volume(self.volumes[name])
+        size = decodedBytes(sound)
+        self.loaded[name] = (sound, size)
+        self.residentBytes += size
+        self.trim(keep=name)
+        return sound
 
-        # Sound effect dictionary
-        self.sounds = {
-            # Dialog sounds
-            # 'typing': pygame.mixer.Sound('../audio/sfx/typing.wav'),
-            'dialogOpen': pygame.mixer.Sound('../audio/sfx/dialogOpen.wav'),
-            'dialogClose': pygame.mixer.Sound('../audio/sfx/dialogClose.wav'),
-            'dialogSelect': pygame.mixer.Sound('../audio/sfx/dialogSelect.wav'),
+    def setVolume(self, name, volume):
+        self.volumes[name] = volume
+        entry = self.loaded.get(name)
+        if entry is not None:
+            entry[0].set_volume(volume)
 
-            # Map transition
-            'transition': pygame.mixer.Sound('../audio/sfx/transition.wav'),
+    def unload(self, name):
+        entry = self.loaded.pop(name, None)
+        if entry is not None:
+            self.residentBytes -= entry[1]
+            self.unloads += 1
 
-            # Ambient sound channels (these will be longer audio files)
-            'ambientCrypt': pygame.mixer.Sound('../audio/ambient/cryptAmbient.wav'),
-            'ambientTown': pygame.mixer.Sound('../audio/ambient/townAmbient.wav'),
+    def trim(self, keep=None):
+        # Unload idle sounds until back under budget. Sounds still playing (and keep, about to be)
+        # stay, so going over budget for a moment is allowed rather than cutting a sound off
+        for name in list(self.loaded):
+            if self.residentBytes <= self.byteBudget:
+                break
+            if name != keep and self.loaded[name][0].get_num_channels() == 0:
+                self.unload(name)
 
-            #Portal
-            'portalOpen': pygame.mixer.Sound('../audio/sfx/portalOpen.wav'),
+    def setBudget(self, byteBudget):
+        self.byteBudget = byteBudget
+        self.trim()
 
-            #Intro
-            'intro': pygame.mixer.Sound('../audio/sfx/Intro.wav')
+    def clear(self):
+        for name in list(self.loaded):
+            self.unload(name)
 
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'loads': self.loads,
+            'unloads': self.unloads,
+            'resident': len(self.loaded),
+            'residentBytes': self.residentBytes,
+            'budget': self.byteBudget,
+            'missing': sorted(self.missing),
         }
 
+
+def wavLength(path):
+    # Milliseconds of audio in a WAV file going by its header, None if path isn't a readable WAV
+    if path is None:
+        return None
+    try:
+        with wave.open(path, 'rb') as file:
+            return file.getnframes() / file.getframerate() * 1000
+    except (OSError, EOFError, wave.Error):
+        return None
+
+
+def decodedBytes(sound):
+    # Size of the sound's PCM in the mixer's format
+    frequency, format, channels = pygame.mixer.get_init()
+    return round(sound.get_length() * frequency) * channels * (abs(format) // 8)
+
+
+class SoundManager:
+    def __init__(self):
+        self.bank = SoundBank(soundPaths)
+
         # Set default volumes
         self.volumes = {
             'sfx': 0.7,
@@ -37,43 +141,74 @@ class SoundManager:
         }
 
         # Apply volumes
-        for soundName, sound in self.sounds.items():
-            # if 'typing' in soundName:
-                # sound.set_volume(self.volumes['typing'])
-            if 'ambient' in soundName:
-                sound.set_volume(self.volumes['ambient'])
-            else:
-                sound.set_volume(self.volumes['sfx'])
+        for soundName in self.bank.paths:
+            self.bank.setVolume(soundName, self.volumes['sfx'])
 
         # Track current ambient sound
         self.currentAmbient = None
 
-        # Reserve channels
+        # The mixer is started by whichever part of the game plays a sound first
+        self.ambient = None
+        self.voices = None
+
+    def ensureMixer(self):
+        if self.ambient is not None:
+            return
+        if not pygame.mixer.get_init():
+            pygame.mixer.init()
+
+        # Reserve channels 0 and 1 for the ambient crossfade so sound effects never take them,
+        # the other six are the sound effect voices
         pygame.mixer.set_num_channels(8)
-        self.ambientChannel = pygame.mixer.Channel(7)  # Reserve last channel for ambient
+        pygame.mixer.set_reserved(2)
+        self.ambient = AmbientPlayer((pygame.mixer.Channel(0), pygame.mixer.Channel(1)))
+        self.ambient.setVolume(self.volumes['ambient'])
+        self.voices = VoiceManager([pygame.mixer.Channel(index) for index in range(2, 8)])
+
+    def update(self):
+        # Called once a frame to keep the ambient streams fed and their fades moving
+        if self.ambient is not None:
+            self.ambient.update()
+            self.voices.endFrame()
 
     def playSound(self, soundName):
-        # Play a sound effect once
-        if soundName in self.sounds:
-            self.sounds[soundName].play()
+        # Play a sound effect once. Returns the channel it plays on, or None if it isn't playing
+        self.ensureMixer()
+        sound = self.bank.get(soundName)
+        if sound is None:
+            return None
+        return self.voices.play(soundName, sound)
 
-    def startAmbient(self, mapName):
-        # Start playing the ambient sound for a specific map
-        ambientName = f'ambient{mapName.capitalize()}'
+    def soundLength(self, soundName):
+        # How long a sound effect plays for in milliseconds, 0 if it can't be played.
+        # WAVs are timed from their header, the same as headless, so game logic waiting on a sound agrees
+        length = wavLength(self.bank.paths.get(soundName))
+        if length is not None:
+            return length
+        self.ensureMixer()
+        sound = self.bank.get(soundName)
+        return sound.get_length() * 1000 if sound is not None else 0
 
-        # Stop current ambient if it's different
-        if self.currentAmbient != ambientName:
-            self.ambientChannel.stop()
+    def preloadAmbient(self, mapName):
+        # Get a map's ambient ready to stream, e.g. while the screen fades to it
+        self.ensureMixer()
+        if mapName in ambientPaths:
+            self.ambient.prepare(ambientPaths[mapName])
 
-            if ambientName in self.sounds:
-                # Play new ambient sound on loop
-                self.ambientChannel.play(self.sounds[ambientName], loops=-1, fade_ms=1000)
-                self.currentAmbient = ambientName
+    def startAmbient(self, mapName):
+        # Crossfade from the current ambient loop to the one for a specific map
+        self.ensureMixer()
+        if self.currentAmbient != mapName:
+            self.currentAmbient = mapName
+            if mapName in ambientPaths:
+                self.ambient.play(ambientPaths[mapName])
+            else:
+                self.ambient.stop(self.ambient.crossfadeMs)
 
     def stopAmbient(self):
         # Stop current ambient sound with fade out
         if self.currentAmbient:
-            self.ambientChannel.fadeout(1000)
+            self.ambient.stop(1000)
             self.currentAmbient = None
 
     def setVolume(self, volumeType, value):
@@ -82,10 +217,48 @@ class SoundManager:
             self.volumes[volumeType] = max(0.0, min(1.0, value))
 
             # Update volumes for affected sounds
-            for soundName, sound in self.sounds.items():
-                # if volumeType == 'typing' and 'typing' in soundName:
-                    # sound.set_volume(self.volumes['typing'])
-                if volumeType == 'ambient' and 'ambient' in soundName:
-                    sound.set_volume(self.volumes['ambient'])
-                elif volumeType == 'sfx' and 'ambient' not in soundName: # and 'typing' not in soundName:
-                    sound.set_volume(self.volumes['sfx'])
\ No newline at end of file
+            if volumeType == 'ambient':
+                if self.ambient is not None:
+                    self.ambient.setVolume(self.volumes['ambient'])
+            else:
+                for soundName in self.bank.paths:
+                    self.bank.setVolume(soundName, self.volumes[volumeType])
+
+    def residentBytes(self):
+        # Decoded sound effects plus the ambient chunks currently queued
+        ambientBytes = self.ambient.residentBytes() if self.ambient is not None else 0
+        return self.bank.residentBytes + ambientBytes
+
+
+class NullSoundManager:
+    # Stands in for the sound manager in a headless level: nothing is decoded or played
+    def update(self):
+        pass
+
+    def playSound(self, soundName):
+        return None
+
+    def soundLength(self, soundName):
+        # Game logic timed by a sound (the intro) still waits as long as it would with audio
+        length = wavLength(soundPaths.get(soundName))
+        return length if length is not None else 0
+
+    def preloadAmbient(self, mapName):
+        pass
+
+    def startAmbient(self, mapName):
+        pass
+
+    def stopAmbient(self):
+        pass
+
+    def setVolume(self, volumeType, value):
+        pass
+
+    def residentBytes(self):
+        return 0
+
+
+# One sound manager, and so one set of decoded sounds, shared by everything that plays audio
+soundManager = SoundManager()
+nullSoundManager = NullSoundManager()
@@ -0,0 +1,85 @@
+class SpatialHash:
+    def __init__(self, cellSize=256):
+        # Uniform grid of buckets so proximity checks only look at nearby entities
+        # Keep cellSize at least as large as the usual query radius so a query touches 3x3 cells
+        self.cellSize = cellSize
+        self.cells = {}  # (col, row) -> {entity: (x, y)}
+        self.entities = {}  # entity -> (col, row)
+
+    def cellFor(self, pos):
+        return int(pos[0] // self.cellSize), int(pos[1] // self.cellSize)
+
+    def insert(self, entity, pos):
+        if entity in self.entities:
+            self.move(entity, pos)
+            return
+        cell = self.cellFor(pos)
+        self.cells.setdefault(cell, {})[entity] = (pos[0], pos[1])
+        self.entities[entity] = cell
+
+    def remove(self, entity):
+        cell = self.entities.pop(entity, None)
+        if cell is None:
+            return
+        bucket = self.cells[cell]
+        del bucket[entity]
+        if not bucket:
+            del self.cells[cell]
+
+    def move(self, entity, pos):
+        # Only touches the buckets when the entity actually changes cell
+        oldCell = self.entities.get(entity)
+        if oldCell is None:
+            self.insert(entity, pos)
+            return
+        newCell = self.cellFor(pos)
+        if newCell == oldCell:
+            self.cells[oldCell][entity] = (pos[0], pos[1])
+            return
+        self.remove(entity)
+        self.cells.setdefault(newCell, {})[entity] = (pos[0], pos[1])
+        self.entities[entity] = newCell
+
+    def clear(self):
+        self.cells.clear()
+        self.entities.clear()
+
+    def __len__(self):
+        return len(self.entities)
+
+    def __contains__(self, entity):
+        return entity in self.entities
+
+    def nearbyBuckets(self, pos, radius):
+        firstCol, firstRow = self.cellFor((pos[0] - radius, pos[1] - radius))
+        lastCol, lastRow = self.cellFor((pos[0] + radius, pos[1] + radius))
+        for col in range(firstCol, lastCol + 1):
+            for row in range(firstRow, lastRow + 1):
+                bucket = self.cells.get((col, row))
+                if bucket:
+                    yield bucket
+
+    def queryRadius(self, pos, radius):
+        # Every entity within radius of pos
+        x, y = pos
+        radiusSquared = radius * radius
+        found = []
+        for bucket in self.nearbyBuckets(pos, radius):
+            for entity, (entityX, entityY) in bucket.items():
+                if (entityX - x) ** 2 + (entityY - y) ** 2 <= radiusSquared:
+                    found.append(entity)
+        return found
+
+    def nearest(self, pos, radius, predicate=None):
+        # Closest entity within radius of pos, optionally only ones the predicate accepts
+        x, y = pos
+        bestEntity = None
+        bestDistance = radius * radius
+        for bucket in self.nearbyBuckets(pos, radius):
+            for entity, (entityX, entityY) in bucket.items():
+                distance = (entityX - x) ** 2 + (entityY - y) ** 2
+                if distance <= bestDistance and (predicate is None or predicate(entity)):
+                    bestEntity = entity
+                    bestDistance = distance
+        return bestEntity
+
@@ -0,0 +1,77 @@
+import os
+import pygame
+
+
+class SpriteAtlas:
+    def __init__(self, directory='../graphics/Characters', scale=3, padding=1, maxWidth=1024):
+        # Every character frame in directory, scaled once and packed into one surface.
+        # frame() hands out subsurfaces of it, the same one to every sprite drawn with that frame,
+        # so sprites share the atlas's pixels instead of each holding a scaled copy
+        self.directory = directory
+        self.scale = scale
+        self.padding = padding  # Transparent pixels left between frames
+        self.maxWidth = maxWidth
+
+        self.surface = None  # Built the first time a frame is asked for
+        self.rects = {}  # Frame name (the file name without extension) -> rect in the atlas
+        self.frames = {}  # Frame name -> subsurface, made once
+
+    def build(self):
+        # Scale every PNG in the directory and pack them in rows, tallest first
+        images = {}
+        for fileName in sorted(os.listdir(self.directory)):
+            name, extension = os.path.splitext(fileName)
+            if extension.lower() != '.png':
+                continue
+            image = pygame.image.load(os.path.join(self.directory, fileName))
+            images[name] = pygame.transform.scale(image, (image.get_width() * self.scale,
+                                                          image.get_height() * self.scale))
+
+        self.rects = {}
+        x = y = rowHeight = width = 0
+        for name in sorted(images, key=lambda name: -images[name].get_height()):
+            imageWidth, imageHeight = images[name].get_size()
+            if x and x + imageWidth > self.maxWidth:
+                x = 0
+                y += rowHeight + self.padding
+                rowHeight = 0
+            self.rects[name] = pygame.Rect(x, y, imageWidth, imageHeight)
+            x += imageWidth + self.padding
+            rowHeight = max(rowHeight, imageHeight)
+            width = max(width, x)
+
+        surface = pygame.Surface((max(width, 1), max(y + rowHeight, 1)), pygame.SRCALPHA)
+        # Onto fully transparent pixels an alpha blit copies the image as it is
+        surface.blits([(images[name], rect) for name, rect in self.rects.items()], doreturn=False)
+        # Match the display's pixel format once the display exists, so every frame blits fast
+        if pygame.display.get_surface() is not None:
+            surface = surface.convert_alpha()
+        self.surface = surface
+        self.frames = {}
+
+    def frame(self, name):
+        # The shared, pre-scaled frame. It is never to be drawn on, every sprite using it would change
+        frame = self.frames.get(name)
+        if frame is None:
+            if self.surface is None:
+                self.build()
+            frame = self.surface.subsurface(self.rects[name])
+            self.frames[name] = frame
+        return frame
+
+    def clear(self):
+        # Let go of the atlas, it is rebuilt (picking up new or changed files) on the next frame()
+        self.surface = None
+        self.rects = {}
+        self.frames = {}
+
+    def stats(self):
+        return {
+            'frames': len(self.rects),
+            'size': self.surface.get_size() if self.surface is not None else (0, 0),
+            'bytes': self.surface.get_pitch() * self.surface.get_height() if self.surface is not None else 0,
+        }
+
+
+# One atlas of character frames shared by every NPC
+spriteAtlas = SpriteAtlas()
@@ -0,0 +1,68 @@
+from collections import OrderedDict
+import pygame
+
+
+class TextCache:
+    def __init__(self, maxEntries=256):
+        # Fonts by (name, size) and rendered text by (text, font, color, antialias)
+        # A name of None is pygame's default font, anything else is looked up with SysFont
+        self.fonts = {}
+        self.rendered = OrderedDict()
+        self.maxEntries = maxEntries
+
+        # Counters for stats()
+        self.fontHits = 0
+        self.fontMisses = 0
+        self.textHits = 0
+        self.textMisses = 0
+        self.evictions = 0
+
+    def getFont(self, name=None, size=32):
+        key = (name, size)
+        font = self.fonts.get(key)
+        if font is not None:
+            self.fontHits += 1
+            return font
+
+        # SysFont scans the system font list, so it is only ever called once per font
+        self.fontMisses += 1
+        font = pygame.font.Font(None, size) if name is None else pygame.font.SysFont(name, size)
+        self.fonts[key] = font
+        return font
+
+    def render(self, text, name=None, size=32, color=(255, 255, 255), antialias=True):
+        # Rendered text surface, rasterized only the first time it is asked for
+        key = (text, name, size, tuple(color), antialias)
+        surface = self.rendered.get(key)
+        if surface is not None:
+            self.textHits += 1
+            self.rendered.move_to_end(key)
+            return surface
+
+        self.textMisses += 1
+        surface = self.getFont(name, size).render(text, antialias, color)
+        self.rendered[key] = surface
+        if len(self.rendered) > self.maxEntries:
+            self.rendered.popitem(last=False)
+            self.evictions += 1
+        return surface
+
+    def clear(self):
+        self.rendered.clear()
+
+    def stats(self):
+        lookups = self.textHits + self.textMisses
+        return {
+            'fonts': len(self.fonts),
+            'fontHits': self.fontHits,
+            'fontMisses': self.fontMisses,
+            'textHits': self.textHits,
+            'textMisses': self.textMisses,
+            'textHitRate': self.textHits / lookups if lookups else 0.0,
+            'entries': len(self.rendered),
+            'evictions': self.evictions,
+        }
+
+
+# One cache shared by everything that draws text
+textCache = TextCache()
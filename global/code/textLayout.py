@@ -0,0 +1,67 @@
+import re
+
+
+class TextLayout:
+    def __init__(self, font, color, lineHeight=30):
+        # Word wraps a block of text once and keeps each line rendered,
+        # so drawing it again (or revealing it a character at a time) costs a few blits
+        self.font = font
+        self.color = color
+        self.lineHeight = lineHeight
+
+        self.text = None
+        self.maxWidth = None
+        self.lines = []  # (line text, index of its first character in the full text, rendered surface)
+
+        # Width of the revealed part of the partly shown line, remembered between frames
+        self.partialLine = None
+        self.partialChars = None
+        self.partialWidth = 0
+
+    def layout(self, text, maxWidth):
+        # Wrap and render the text. Does nothing if it is already laid out at this width
+        if text == self.text and maxWidth == self.maxWidth:
+            return
+        self.text = text
+        self.maxWidth = maxWidth
+        self.partialLine = None
+
+        # Greedy word wrap over the whole text, remembering where each line starts
+        self.lines = []
+        lineWords = []
+        lineStart = 0
+        for match in re.finditer(r'\S+', text):
+            candidate = ' '.join(lineWords + [match.group()])
+            if lineWords and self.font.size(candidate)[0] > maxWidth:
+                self.addLine(' '.join(lineWords), lineStart)
+                lineWords = []
+            if not lineWords:
+                lineStart = match.start()
+            lineWords.append(match.group())
+        if lineWords:
+            self.addLine(' '.join(lineWords), lineStart)
+
+    def addLine(self, lineText, start):
+        self.lines.append((lineText, start, self.font.render(lineText, True, self.color)))
+
+    def draw(self, surface, pos, revealedChars=None):
+        # Draw the first revealedChars characters of the text (all of it if None)
+        x, y = pos
+        for index, (lineText, start, lineSurf) in enumerate(self.lines):
+            shown = len(lineText) if revealedChars is None else revealedChars - start
+            if shown <= 0:
+                break
+            if shown >= len(lineText):
+                surface.blit(lineSurf, (x, y))
+            else:
+                # Crop the pre-rendered line to the revealed characters instead of rendering the prefix
+                surface.blit(lineSurf, (x, y), (0, 0, self.revealedWidth(index, lineText, shown), lineSurf.get_height()))
+            y += self.lineHeight
+
+    def revealedWidth(self, index, lineText, shown):
+        # Only measured again when the typewriter has actually added a character
+        if index != self.partialLine or shown != self.partialChars:
+            self.partialLine = index
+            self.partialChars = shown
+            self.partialWidth = self.font.size(lineText[:shown])[0]
+        return self.partialWidth
@@ -0,0 +1,105 @@
+import pygame
+
+
+# How each sound effect competes for a channel. Sounds not listed get defaultRule
+# priority: a sound can only steal a channel from one of equal or lower priority
+# limit: most copies of the sound allowed to play at once, the oldest copy makes way for a new one
+# retriggerMs: a sound started again sooner than this after its last start is dropped
+soundRules = {
+    'intro': {'priority': 3, 'limit': 1, 'retriggerMs': 0},
+    'portalOpen': {'priority': 3, 'limit': 1, 'retriggerMs': 500},
+    'transition': {'priority': 2, 'limit': 1, 'retriggerMs': 250},
+    'dialogOpen': {'priority': 1, 'limit': 1, 'retriggerMs': 100},
+    'dialogClose': {'priority': 1, 'limit': 1, 'retriggerMs': 100},
+    'dialogSelect': {'priority': 0, 'limit': 2, 'retriggerMs': 40},
+}
+defaultRule = {'priority': 1, 'limit': 2, 'retriggerMs': 0}
+
+
+class VoiceManager:
+    def __init__(self, channels, steal='oldest'):
+        # Sound effects play on a fixed pool of channels, so mixing cost is bounded by the pool size
+        # steal is 'oldest' or 'quietest': which voice gives up its channel when every one is busy
+        self.channels = list(channels)
+        self.steal = steal
+        self.voices = {}  # channel index -> (sound name, priority, start time in ms)
+        self.lastStart = {}  # sound name -> ms it last started
+
+        # Counters since the last endFrame(), and the totals of the last finished frame
+        self.started = 0
+        self.stolen = 0
+        self.dropped = 0
+        self.frameStats = {'active': 0, 'started': 0, 'stolen': 0, 'dropped': 0}
+
+    def play(self, name, sound, now=None):
+        # Start sound on a channel if its rules allow it. Returns the channel, or None if it was dropped
+        now = pygame.time.get_ticks() if now is None else now
+        rule = soundRules.get(name, defaultRule)
+        self.forgetFinished()
+
+        last = self.lastStart.get(name)
+        if last is not None and now - last < rule['retriggerMs']:
+            self.dropped += 1
+            return None
+
+        index = self.channelFor(name, rule)
+        if index is None:
+            self.dropped += 1
+            return None
+
+        self.channels[index].play(sound)
+        self.voices[index] = (name, rule['priority'], now)
+        self.lastStart[name] = now
+        self.started += 1
+        return self.channels[index]
+
+    def channelFor(self, name, rule):
+        # A copy of the same sound over its limit is replaced first, then a free channel is used,
+        # and only then is another sound of equal or lower priority cut off
+        copies = [index for index, voice in self.voices.items() if voice[0] == name]
+        if len(copies) >= rule['limit']:
+            self.stolen += 1
+            return min(copies, key=lambda index: self.voices[index][2])
+
+        for index in range(len(self.channels)):
+            if index not in self.voices:
+                return index
+
+        candidates = [index for index, voice in self.voices.items() if voice[1] <= rule['priority']]
+        if not candidates:
+            return None
+        self.stolen += 1
+        return min(candidates, key=self.stealOrder)
+
+    def stealOrder(self, index):
+        # Lowest priority goes first, then the oldest (or quietest, then oldest) voice
+        name, priority, startTime = self.voices[index]
+        if self.steal == 'quietest':
+            return priority, self.loudness(index), startTime
+        return priority, startTime
+
+    def loudness(self, index):
+        channel = self.channels[index]
+        sound = channel.get_sound()
+        return channel.get_volume() * (sound.get_volume() if sound is not None else 0.0)
+
+    def forgetFinished(self):
+        for index in [index for index in self.voices if not self.channels[index].get_busy()]:
+            del self.voices[index]
+
+    def stopAll(self):
+        for index in self.voices:
+            self.channels[index].stop()
+        self.voices.clear()
+
+    def endFrame(self):
+        # Called once a frame: keep the frame's counts for stats() and start counting the next one
+        self.forgetFinished()
+        self.frameStats = {'active': len(self.voices), 'started': self.started,
+                           'stolen': self.stolen, 'dropped': self.dropped}
+        self.started = 0
+        self.stolen = 0
+        self.dropped = 0
+
+    def stats(self):
+        return dict(self.frameStats, channels=len(self.channels))